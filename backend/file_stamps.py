@@ -0,0 +1,15 @@
+import os
+
+
+def file_stamp(path):
+    """Cheap change marker for a file: (mtime_ns, size), or None if it is missing"""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def database_version(db_path: str) -> tuple:
+    """Changes whenever the database or its write-ahead log is written to"""
+    return (file_stamp(db_path), file_stamp(f"{db_path}-wal"))
@@ -0,0 +1,133 @@
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from image_storage import ByteRange, ImageInfo, ImageStorage, RangeNotSatisfiable
+
+# Images are immutable once processed, so let browsers keep them for a day
+IMAGE_CACHE_CONTROL = os.getenv('IMAGE_CACHE_CONTROL', 'public, max-age=86400')
+
+# One "first-last", "first-" or "-suffix" byte range
+_BYTE_RANGE = re.compile(r'(\d*)-(\d*)')
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against our ETag"""
+    if header.strip() == '*':
+        return True
+    strip_weak = lambda tag: tag.strip().removeprefix('W/')
+    return strip_weak(etag) in (strip_weak(tag) for tag in header.split(','))
+
+
+def is_not_modified(request: Request, info: ImageInfo) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since as RFC 9110 requires"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, info.etag)
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and info.mtime is not None:
+        try:
+            return int(info.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(request: Request) -> Optional[ByteRange]:
+    """
+    Parse a single "bytes=" Range header.
+
+    Returns None when the whole image should be sent: no Range header, a
+    malformed one (including a last byte before the first, as RFC 9110 asks
+    to be ignored), or a multi-range request (which we answer in full).
+    """
+    header = request.headers.get('range')
+    if not header or not header.startswith('bytes='):
+        return None
+
+    match = _BYTE_RANGE.fullmatch(header[len('bytes='):].strip())
+    if not match or not any(match.groups()):
+        return None
+    start_text, end_text = match.groups()
+    if not start_text:
+        # Suffix range: the last N bytes
+        return None, int(end_text)
+    start, end = int(start_text), int(end_text) if end_text else None
+    if end is not None and end < start:
+        return None
+    return start, end
+
+
+def if_range_matches(request: Request, info: ImageInfo) -> bool:
+    """
+    Whether a range may be served under If-Range: a single entity tag must
+    match ours by strong comparison (neither weak), a date our Last-Modified exactly.
+    """
+    if_range = (request.headers.get('if-range') or '').strip()
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return not if_range.startswith('W/') and not info.etag.startswith('W/') and if_range == info.etag
+    return info.mtime is not None and if_range == formatdate(info.mtime, usegmt=True)
+
+
+async def image_response(request: Request, storage: ImageStorage, path: str) -> Response:
+    """
+    Build a streaming response for an image with validators, 304 and byte-range support.
+
+    The storage is opened once, off the event loop, with the range and
+    If-None-Match passed along so remote backends can answer in one round trip.
+    Raises FileNotFoundError if the image does not exist.
+    """
+    byte_range = parse_range(request)
+    if_none_match = request.headers.get('if-none-match')
+    try:
+        stream = await storage.open_image_async(path, byte_range, if_none_match)
+        if byte_range and not stream.not_modified and not if_range_matches(request, stream.info):
+            # The client's copy is stale, so it gets the whole new image instead of a piece
+            stream.close()
+            stream = await storage.open_image_async(path, None, if_none_match)
+    except RangeNotSatisfiable as e:
+        headers = {'Content-Range': f'bytes */{e.size}'} if e.size is not None else {}
+        return Response(status_code=416, headers=headers)
+
+    info = stream.info
+    headers = {
+        'ETag': info.etag,
+        'Cache-Control': IMAGE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+    if info.mtime is not None:
+        headers['Last-Modified'] = formatdate(info.mtime, usegmt=True)
+
+    if stream.not_modified or is_not_modified(request, info):
+        stream.close()
+        return Response(status_code=304, headers=headers)
+
+    if stream.byte_range:
+        start, end = stream.byte_range
+        headers.update({
+            'Content-Range': f'bytes {start}-{end}/{info.size}',
+            'Content-Length': str(end - start + 1),
+        })
+        return StreamingResponse(
+            stream.chunks, status_code=206, media_type=info.content_type,
+            headers=headers, background=BackgroundTask(stream.close),
+        )
+
+    if info.local_path:
+        # Let the server send the file directly instead of copying it through Python
+        stream.close()
+        return FileResponse(info.local_path, media_type=info.content_type, headers=headers)
+
+    headers['Content-Length'] = str(info.size)
+    return StreamingResponse(
+        stream.chunks, media_type=info.content_type,
+        headers=headers, background=BackgroundTask(stream.close),
+    )
@@ -0,0 +1,200 @@
+import gzip
+import hashlib
+import os
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import orjson
+from fastapi import Request, Response
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it we only offer gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+def _default(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, 'isoformat'):  # pandas Timestamp
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize to JSON bytes with orjson. NaN/inf become null, numpy arrays and scalars are supported"""
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0, or None for identity"""
+    offered = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip().lower()] = quality
+
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        quality = offered.get(encoding, offered.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+@dataclass
+class CachedBody:
+    """One serialized payload plus its compressed variants, built on first request for each"""
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def encode(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        if encoding is None or len(self.body) < MIN_COMPRESS_BYTES:
+            return self.body, None
+        data = self.encoded.get(encoding)
+        if data is None:
+            if encoding == 'br':
+                data = brotli.compress(self.body, quality=5)
+            else:
+                data = gzip.compress(self.body, compresslevel=6, mtime=0)
+            # Another request may have compressed it meanwhile; both results are the same bytes
+            data = self.encoded.setdefault(encoding, data)
+        return data, encoding
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+
+class ResponseCache:
+    """
+    Byte-bounded LRU of serialized JSON responses.
+
+    Entries are keyed by (endpoint, params, data version), so a new version of
+    the underlying data simply stops matching the old entries, which age out.
+    Repeat requests are answered straight from the cached bytes in the encoding
+    the client accepts. Each entry is stored with the size it was counted at,
+    so the total stays exact however the compressed variants are added.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[CachedBody]:
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return stored[0]
+
+    def put(self, key: Hashable, entry: CachedBody):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._total_bytes -= previous[1]
+            size = entry.size
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (entry, size)
+            self._total_bytes += size
+            self._evict()
+
+    def resize(self, key: Hashable, entry: CachedBody):
+        """Account for compressed variants added to an entry after it was stored"""
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is not None and stored[0] is entry:
+                size = entry.size
+                self._entries[key] = (entry, size)
+                self._total_bytes += size - stored[1]
+                self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'bytes': self._total_bytes}
+
+
+response_cache = ResponseCache(int(os.getenv('JSON_RESPONSE_CACHE_BYTES', 64 * 1024 ** 2)))
+
+
+async def cached_json_response(
+    request: Request,
+    version: Hashable,
+    build: Callable[[], Awaitable[Tuple[Any, Dict[str, str]]]],
+    params: Hashable = None,
+    cache: bool = True,
+) -> Response:
+    """
+    Serve a JSON payload from the response cache, building it on a miss.
+
+    build() returns (payload, extra_headers). The cache key is the request
+    path, params (the sorted query string by default) and the data version.
+    With cache=False the payload is still serialized and compressed the same
+    way but never stored, for responses that go stale on their own.
+    """
+    if params is None:
+        params = tuple(sorted(request.query_params.multi_items()))
+    key = (request.url.path, params, version)
+
+    entry = response_cache.get(key) if cache else None
+    if entry is None:
+        payload, headers = await build()
+        body = await run_in_threadpool(dumps, payload)
+        entry = CachedBody(body, f'"{hashlib.sha1(body).hexdigest()[:20]}"', headers or {})
+        if cache:
+            response_cache.put(key, entry)
+
+    headers = {**entry.headers, 'ETag': entry.etag, 'Vary': 'Accept-Encoding'}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and entry.etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    encoding = choose_encoding(request.headers.get('accept-encoding'))
+    if encoding and encoding not in entry.encoded and len(entry.body) >= MIN_COMPRESS_BYTES:
+        content, encoding = await run_in_threadpool(entry.encode, encoding)
+        response_cache.resize(key, entry)
+    else:
+        content, encoding = entry.encode(encoding)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(content=content, media_type='application/json', headers=headers)
@@ -1,9 +1,46 @@
-from litellm import completion
+import asyncio
+import hashlib
+import os
+import random
+import logging
+import litellm
+from litellm import acompletion, completion
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+LLM_MODEL = os.getenv('LLM_MODEL', 'gemini/gemini-2.0-flash-exp')
+# Point at any OpenAI-compatible server, e.g. a local fake for testing (with LLM_MODEL=openai/<name>)
+LLM_API_BASE = os.getenv('LLM_API_BASE') or None
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 30))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 2))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 4))
+# "litellm" calls the model; "replay" answers offline from recorded responses (see backend/llm_replay.py)
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'litellm')
+
+if LLM_PROVIDER == 'replay':
+    from backend.llm_replay import replay_provider_from_env
+
+    _replay = replay_provider_from_env()
+    completion, acompletion = _replay.completion, _replay.acompletion
+    # Keeps replayed answers apart from the real model's in the translation cache
+    LLM_MODEL = f"replay:{_replay.path}"
+    logger.info(f"LLM responses are replayed from {_replay.path}")
+elif LLM_PROVIDER != 'litellm':
+    raise ValueError(f"Unknown LLM_PROVIDER {LLM_PROVIDER!r} (expected litellm or replay)")
+
+# Errors worth another attempt: the request may well succeed a moment later
+RETRYABLE_ERRORS = (
+    litellm.Timeout,
+    litellm.APIConnectionError,
+    litellm.RateLimitError,
+    litellm.ServiceUnavailableError,
+    litellm.InternalServerError,
+)
+
 safety_settings = [
 {
             "category": "HARM_CATEGORY_HARASSMENT",
@@ -23,19 +60,155 @@ safety_settings = [
         },
 ]
 
+def _completion_args(question, prompt):
+    args = {
+        'model': LLM_MODEL,
+        'messages': [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": question}
+        ],
+        'stream': False,
+    }
+    if LLM_MODEL.startswith('gemini/'):
+        args['safety_settings'] = safety_settings
+    if LLM_API_BASE:
+        args['api_base'] = LLM_API_BASE
+    return args
+
 def get_llm_response(question, prompt):
-    
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": question}
-    ]
-    
-    response = completion( 
-        model='gemini/gemini-2.0-flash-exp',
-        messages=messages,
-        stream=False,
-        safety_settings=safety_settings
-        )
+    response = completion(**_completion_args(question, prompt))
     
     response_text = response.choices[0].message.content
-    return response_text
\ No newline at end of file
+    return response_text
+
+
+class AsyncLLMClient:
+    """
+    Non-blocking LLM calls for the web server.
+
+    Every attempt is bounded by a timeout and retryable failures are retried
+    with jittered exponential backoff. A semaphore caps concurrent upstream
+    calls, and identical questions that arrive while one is already in flight
+    share its result instead of making their own call.
+    """
+
+    def __init__(self, timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, backoff: float = 0.5):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self._loop = None
+        self._semaphore = None
+        self._in_flight = {}
+        self.counters = {'calls': 0, 'coalesced': 0, 'retries': 0, 'failures': 0}
+
+    def _bind_loop(self):
+        # Semaphores and futures belong to one event loop; start afresh if the loop changed
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._in_flight = {}
+
+    async def _call(self, question: str, prompt: str) -> str:
+        args = _completion_args(question, prompt)
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    self.counters['calls'] += 1
+                    # Retries are ours alone, so the provider SDK must not add its own
+                    response = await asyncio.wait_for(
+                        acompletion(**args, timeout=self.timeout, max_retries=0), self.timeout)
+                return response.choices[0].message.content
+            except (asyncio.TimeoutError, *RETRYABLE_ERRORS) as e:
+                if attempt == self.max_retries:
+                    self.counters['failures'] += 1
+                    raise
+                # Full jitter keeps retries from many clients from arriving in lockstep
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                self.counters['retries'] += 1
+                logger.warning(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def _read_stream(self, args: dict, pieces: asyncio.Queue):
+        """
+        Read one streamed response into pieces, ending with None or the exception that stopped it.
+
+        Only this reading holds the semaphore, so a slow consumer never keeps
+        an upstream slot. Failures are retried like _call() as long as nothing
+        has been read yet; the timeout applies to the wait for each piece.
+        """
+        try:
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    async with self._semaphore:
+                        self.counters['calls'] += 1
+                        stream = await asyncio.wait_for(
+                            acompletion(**args, timeout=self.timeout, max_retries=0), self.timeout)
+                        chunks = stream.__aiter__()
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                            except StopAsyncIteration:
+                                break
+                            text = chunk.choices[0].delta.content if chunk.choices else None
+                            if text:
+                                started = True
+                                pieces.put_nowait(text)
+                    pieces.put_nowait(None)
+                    return
+                except (asyncio.TimeoutError, *RETRYABLE_ERRORS) as e:
+                    if started or attempt == self.max_retries:
+                        self.counters['failures'] += 1
+                        raise
+                    delay = random.uniform(0, self.backoff * 2 ** attempt)
+                    self.counters['retries'] += 1
+                    logger.warning(f"LLM stream failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+        except Exception as e:
+            pieces.put_nowait(e)
+
+    async def stream_response(self, question: str, prompt: str):
+        """
+        Yield the response text piece by piece as the model produces it.
+
+        A background task reads the stream (see _read_stream()) and the pieces
+        are handed out from its queue. Streams are not coalesced, since every
+        caller wants its own tokens.
+        """
+        self._bind_loop()
+        args = {**_completion_args(question, prompt), 'stream': True}
+        pieces = asyncio.Queue()
+        reader = asyncio.ensure_future(self._read_stream(args, pieces))
+        try:
+            while True:
+                piece = await pieces.get()
+                if piece is None:
+                    return
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            # The consumer went away (or the stream ended): stop reading for it
+            reader.cancel()
+
+    async def get_response(self, question: str, prompt: str) -> str:
+        self._bind_loop()
+        key = (LLM_MODEL, hashlib.sha1(prompt.encode()).hexdigest(), question)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(question, prompt))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.counters['coalesced'] += 1
+        # Shielded so one caller going away does not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+
+llm_client = AsyncLLMClient()
+
+async def get_llm_response_async(question, prompt):
+    return await llm_client.get_response(question, prompt)
\ No newline at end of file
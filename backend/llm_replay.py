@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import logging
+from types import SimpleNamespace
+from typing import Dict, Tuple
+
+from backend.file_stamps import file_stamp
+from backend.translation_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Pieces a replayed response is split into when streaming
+STREAM_CHUNKS = 8
+
+
+class ReplayMiss(LookupError):
+    """The replay file has no response for a question"""
+
+
+def load_recordings(path: str) -> Dict[str, str]:
+    """
+    normalized question -> response text from a replay file.
+
+    The file is either {"question": "response", ...} or a list of examples
+    like data/sql_examples.json, whose responses are the {"sql", "graph"} JSON
+    the model is asked to produce.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return {normalize_question(question): response for question, response in data.items()}
+    return {
+        normalize_question(item['question']): json.dumps({'sql': item['sql'], 'graph': item.get('graph')})
+        for item in data
+    }
+
+
+class ReplayProvider:
+    """
+    Offline stand-in for litellm's completion()/acompletion().
+
+    Answers from a file of recorded question -> response pairs after an
+    artificial delay, so /api/query can be exercised and benchmarked without a
+    network or an API key. The delay is latency plus up to ±jitter of it,
+    derived from the question so every run is the same. Responses have the
+    shape of litellm's: choices[0].message.content, or choices[0].delta.content
+    chunks when streaming.
+    """
+
+    def __init__(self, path: str, latency: float = 0.5, jitter: float = 0.0):
+        self.path = path
+        self.latency = latency
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._recordings = (None, {})
+
+    def _recorded(self, messages) -> Tuple[str, str]:
+        stamp = file_stamp(self.path)
+        with self._lock:
+            if self._recordings[0] != stamp:
+                self._recordings = (stamp, load_recordings(self.path))
+                logger.info(f"Loaded {len(self._recordings[1])} recorded LLM responses from {self.path}")
+            recordings = self._recordings[1]
+        question = next(message['content'] for message in reversed(messages) if message['role'] == 'user')
+        response = recordings.get(normalize_question(question))
+        if response is None:
+            raise ReplayMiss(f"No recorded response for {question!r} in {self.path}")
+        return response, question
+
+    def delay(self, question: str) -> float:
+        seed = int(hashlib.sha1(normalize_question(question).encode()).hexdigest()[:8], 16)
+        return max(0.0, self.latency * (1 + random.Random(seed).uniform(-self.jitter, self.jitter)))
+
+    @staticmethod
+    def _message(text: str):
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=text))])
+
+    def completion(self, model=None, messages=(), stream=False, **kwargs):
+        text, question = self._recorded(messages)
+        time.sleep(self.delay(question))
+        return self._message(text)
+
+    async def acompletion(self, model=None, messages=(), stream=False, **kwargs):
+        text, question = self._recorded(messages)
+        if stream:
+            return self._stream(text, question)
+        await asyncio.sleep(self.delay(question))
+        return self._message(text)
+
+    async def _stream(self, text: str, question: str):
+        # The delay is spread over the pieces, the first one arriving after the largest share
+        step = max(1, -(-len(text) // STREAM_CHUNKS))
+        pieces = [text[start:start + step] for start in range(0, len(text), step)]
+        total = self.delay(question)
+        for index, piece in enumerate(pieces):
+            await asyncio.sleep(total / 2 if index == 0 else total / 2 / max(1, len(pieces) - 1))
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+
+def replay_provider_from_env() -> ReplayProvider:
+    return ReplayProvider(
+        os.getenv('LLM_REPLAY_PATH', 'data/sql_examples.json'),
+        latency=float(os.getenv('LLM_REPLAY_LATENCY', 0.5)),
+        jitter=float(os.getenv('LLM_REPLAY_JITTER', 0.2)),
+    )
+
+
+if __name__ == '__main__':
+    # python -m backend.llm_replay export <path>: record every cached translation as a replay file
+    if len(sys.argv) != 3 or sys.argv[1] != 'export':
+        sys.exit("Usage: python -m backend.llm_replay export <path>")
+    from backend.translation_cache import translation_cache
+
+    with translation_cache._connect() as conn:
+        rows = conn.execute("SELECT question, response FROM translations ORDER BY created_at").fetchall()
+    with open(sys.argv[2], "w") as f:
+        json.dump(dict(rows), f, indent=2)
+    print(f"Wrote {len(rows)} recorded responses to {sys.argv[2]}")
@@ -0,0 +1,168 @@
+import threading
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from backend.file_stamps import database_version, file_stamp
+from backend.mouse_data import Mouse, SessionLocal, engine, get_full_mice_data_from_db
+from image_storage import get_picture_index
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Immutable view of every mouse plus the indexes built over it"""
+    version: int
+    stamps: tuple
+    mice: Tuple[Mouse, ...]
+    images: Dict[int, list]
+    picture_counts: Dict[int, int]
+    pictures_by_date: Dict[int, list]
+    by_ear_tag: Dict[int, Mouse]
+    by_group: Dict[Optional[int], Tuple[int, ...]]
+    by_cohort: Dict[Optional[int], Tuple[int, ...]]
+    by_sex: Dict[Optional[str], Tuple[int, ...]]
+    by_alive: Dict[bool, Tuple[int, ...]]
+
+
+def _index_by(mice, key):
+    index = {}
+    for mouse in mice:
+        index.setdefault(key(mouse), []).append(mouse.EarTag)
+    return {value: tuple(ear_tags) for value, ear_tags in index.items()}
+
+
+class MouseCatalog:
+    """
+    Versioned, indexed snapshots of the mice table and their pictures.
+
+    Lookups go through the current snapshot, which is swapped atomically
+    whenever the SQLite file or the image CSV changes on disk. Every read
+    compares the files' cheap stamps (stats() of the database, its WAL and the
+    CSV) with the snapshot's, so an import is never followed by a stale answer.
+    A background thread polls for changes too, so the rebuild normally happens
+    before anyone asks; async code reads through current(), which rebuilds in
+    the thread pool rather than on the event loop.
+    """
+
+    def __init__(self, database_path: str = None, image_csv_path: str = 'data/image_results.csv',
+                 poll_interval: float = 2.0):
+        self.database_path = database_path or engine.url.database
+        self.image_csv_path = image_csv_path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = None
+
+    def stamps(self) -> tuple:
+        """Change markers of the files the catalog is built from"""
+        return database_version(self.database_path), file_stamp(self.image_csv_path)
+
+    def _build(self, version, stamps):
+        db = SessionLocal()
+        try:
+            mice = tuple(get_full_mice_data_from_db(db=db))
+        finally:
+            db.close()
+        pictures = get_picture_index(self.image_csv_path).snapshot
+
+        return CatalogSnapshot(
+            version=version,
+            stamps=stamps,
+            mice=mice,
+            images=pictures.images,
+            picture_counts=pictures.counts,
+            pictures_by_date=pictures.by_date,
+            by_ear_tag={mouse.EarTag: mouse for mouse in mice},
+            by_group=_index_by(mice, lambda m: m.Group_Number),
+            by_cohort=_index_by(mice, lambda m: m.Cohort_id),
+            by_sex=_index_by(mice, lambda m: m.Sex),
+            by_alive=_index_by(mice, lambda m: m.DOD is None),
+        )
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rebuild the snapshot if the underlying files changed. Returns True if rebuilt"""
+        with self._lock:
+            stamps = self.stamps()
+            current = self._snapshot
+            if current is not None and not force and current.stamps == stamps:
+                return False
+
+            version = current.version + 1 if current else 1
+            self._snapshot = self._build(version, stamps)
+            logger.info(f"Mouse catalog rebuilt: version {version}, {len(self._snapshot.mice)} mice")
+            return True
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        current = self._snapshot
+        if current is None or current.stamps != self.stamps():
+            self.refresh()
+            current = self._snapshot
+        return current
+
+    async def current(self) -> CatalogSnapshot:
+        """snapshot for async code: a rebuild, when the files changed, runs in the thread pool"""
+        current = self._snapshot
+        if current is None or current.stamps != self.stamps():
+            await run_in_threadpool(self.refresh)
+            current = self._snapshot
+        return current
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    def get(self, ear_tag: int) -> Optional[Mouse]:
+        return self.snapshot.by_ear_tag.get(ear_tag)
+
+    def images_for(self, ear_tag: int) -> list:
+        return self.snapshot.images.get(ear_tag, [])
+
+    def filter(self, group: int = None, cohort: int = None, sex: str = None, alive: bool = None,
+               snapshot: CatalogSnapshot = None) -> List[Mouse]:
+        """Return mice matching every given criterion, using the hash indexes (of snapshot if given)"""
+        snapshot = snapshot or self.snapshot
+        selections = []
+        if group is not None:
+            selections.append(snapshot.by_group.get(group, ()))
+        if cohort is not None:
+            selections.append(snapshot.by_cohort.get(cohort, ()))
+        if sex is not None:
+            selections.append(snapshot.by_sex.get(sex, ()))
+        if alive is not None:
+            selections.append(snapshot.by_alive.get(alive, ()))
+
+        if not selections:
+            return list(snapshot.mice)
+
+        selections.sort(key=len)
+        ear_tags = set(selections[0])
+        for selection in selections[1:]:
+            ear_tags.intersection_update(selection)
+        return [mouse for mouse in snapshot.mice if mouse.EarTag in ear_tags]
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error rebuilding mouse catalog: {str(e)}")
+
+    def start(self):
+        """Load the first snapshot and start watching the data files in the background"""
+        self.refresh()
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name="mouse-catalog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -1,12 +1,15 @@
 from datetime import date
+import base64
+import json
 import os
-from typing import Optional
+from functools import cmp_to_key
+from typing import List, Optional
 from fastapi import HTTPException, Depends
 from pydantic import BaseModel
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import desc, create_engine
+from sqlalchemy import desc, create_engine, and_, or_, case, func
 from backend.models import Base, MouseData as MouseModel
-from image_storage import load_mouse_images
+from image_storage import get_picture_index
 import logging
 from dotenv import load_dotenv
 
@@ -60,8 +63,8 @@ def get_full_mice_data_from_db(sort_column: str = None, sort_order: str = 'asc',
         
     mice = query.all()
     
-    # Load mouse images data
-    mouse_images = load_mouse_images()
+    # Picture counts from the shared, cached image index
+    picture_counts = get_picture_index().counts
     
     mice_data = [
         Mouse(
@@ -75,7 +78,7 @@ def get_full_mice_data_from_db(sort_column: str = None, sort_order: str = 'asc',
             Stagger=mouse.Stagger,
             Group_Number=mouse.Group_Number,
             Cohort_id=mouse.Cohort_id,
-            PictureCount=len(mouse_images.get(mouse.EarTag, []))
+            PictureCount=picture_counts.get(mouse.EarTag, 0)
         )
         for mouse in mice
     ]
@@ -83,4 +86,191 @@ def get_full_mice_data_from_db(sort_column: str = None, sort_order: str = 'asc',
     if sort_column == 'PictureCount':
         mice_data.sort(key=lambda x: x.PictureCount, reverse=(sort_order.lower() == 'desc'))
         
-    return mice_data
\ No newline at end of file
+    return mice_data
+
+# Columns the mouse list can be sorted on; PictureCount comes from the image CSV
+SORTABLE_COLUMNS = ('EarTag', 'Sex', 'DOB', 'DOD', 'Necropsy', 'Stagger', 'Group_Number', 'Cohort_id', 'PictureCount')
+DATE_COLUMNS = ('DOB', 'DOD')
+
+
+def parse_sort(sort: str = None):
+    """
+    Parse a sort specification such as "Group_Number-asc,DOB-desc".
+    
+    Returns:
+        list of (column, order) tuples
+    """
+    if not sort:
+        return []
+    result = []
+    for part in sort.split(','):
+        column_name, _, order = part.strip().partition('-')
+        if column_name not in SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot sort by {column_name}")
+        result.append((column_name, 'desc' if order == 'desc' else 'asc'))
+    return result
+
+
+def encode_cursor(values_):
+    payload = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values_])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, columns):
+    try:
+        values_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values_, list) or len(values_) != len(columns):
+        raise ValueError("Cursor does not match the requested sort")
+    return [
+        date.fromisoformat(v) if name in DATE_COLUMNS and v is not None else v
+        for name, v in zip(columns, values_)
+    ]
+
+
+def _keyset_condition(keys, cursor_values):
+    """
+    Build the "strictly after the cursor" condition for a keyset page.
+    
+    Every sort column sorts NULLs last, so it contributes an "is null" flag key and,
+    when the cursor value is not NULL, the value itself.
+    """
+    atoms = []
+    for (expr, order), value in zip(keys, cursor_values):
+        atoms.append((case((expr.is_(None), 1), else_=0), 'asc', 1 if value is None else 0))
+        if value is not None:
+            atoms.append((expr, order, value))
+
+    alternatives = []
+    for i, (expr, order, value) in enumerate(atoms):
+        previous = [e == v for e, _, v in atoms[:i]]
+        step = expr > value if order == 'asc' else expr < value
+        alternatives.append(and_(*previous, step))
+    return or_(*alternatives)
+
+
+def _compare_keys(sort_spec, a, b):
+    """Order two sort key tuples as SQL does in get_mice_page(): each column NULLs last"""
+    for (_, order), x, y in zip(sort_spec, a, b):
+        if x == y:
+            continue
+        if x is None or y is None:
+            return 1 if x is None else -1
+        return (1 if x > y else -1) * (1 if order == 'asc' else -1)
+    return 0
+
+
+def _page_in_memory(rows, sort_spec, picture_counts, after, limit):
+    """Sort rows by sort_spec, keep those after the cursor and return up to limit + 1 of them"""
+    def sort_key(mouse):
+        return tuple(picture_counts.get(mouse.EarTag, 0) if name == 'PictureCount' else getattr(mouse, name)
+                     for name, _ in sort_spec)
+
+    compare = cmp_to_key(lambda a, b: _compare_keys(sort_spec, a, b))
+    keyed = sorted(((sort_key(mouse), mouse) for mouse in rows), key=lambda item: compare(item[0]))
+    if after:
+        cursor = decode_cursor(after, [name for name, _ in sort_spec])
+        try:
+            keyed = [(key, mouse) for key, mouse in keyed if _compare_keys(sort_spec, key, cursor) > 0]
+        except TypeError:
+            raise ValueError("Cursor does not match the requested sort")
+    rows = [mouse for _, mouse in keyed]
+    return rows[:limit + 1] if limit else rows
+
+
+def get_mice_page(limit: int = None, after: str = None, sort: str = None,
+                  group: List[int] = None, cohort: List[int] = None, sex: str = None, alive: bool = None,
+                  dob_from: date = None, dob_to: date = None, dod_from: date = None, dod_to: date = None,
+                  picture_counts: dict = None, db: Session = None):
+    """
+    Fetch one page of mice with filtering, sorting and keyset pagination done in SQL.
+
+    Sorting by PictureCount, which the database does not hold, sorts and pages
+    the filtered mice in memory instead, with the same ordering and cursors.
+    
+    Args:
+        limit: Maximum number of mice to return, or None for all of them
+        after: Opaque cursor returned with the previous page
+        sort: Sort specification, see parse_sort(); EarTag is always the final tie-breaker
+        picture_counts: Mapping of ear tag to number of pictures, loaded from the image CSV if not given
+        
+    Returns:
+        tuple of (list of Mouse, total number of matching mice, cursor for the next page or None)
+    """
+    if not db:
+        db = SessionLocal()
+        try:
+            return get_mice_page(limit, after, sort, group, cohort, sex, alive,
+                                 dob_from, dob_to, dod_from, dod_to, picture_counts, db)
+        finally:
+            db.close()
+
+    if picture_counts is None:
+        picture_counts = get_picture_index().counts
+
+    requested = parse_sort(sort)
+    sort_spec = [(name, order) for name, order in requested if name != 'EarTag']
+    sort_spec.append(('EarTag', next((order for name, order in requested if name == 'EarTag'), 'asc')))
+    sort_names = [name for name, _ in sort_spec]
+
+    filters = []
+    if group:
+        filters.append(MouseModel.Group_Number.in_(group))
+    if cohort:
+        filters.append(MouseModel.Cohort_id.in_(cohort))
+    if sex:
+        filters.append(MouseModel.Sex == sex)
+    if alive is not None:
+        filters.append(MouseModel.DOD.is_(None) if alive else MouseModel.DOD.is_not(None))
+    if dob_from:
+        filters.append(MouseModel.DOB >= dob_from)
+    if dob_to:
+        filters.append(MouseModel.DOB <= dob_to)
+    if dod_from:
+        filters.append(MouseModel.DOD >= dod_from)
+    if dod_to:
+        filters.append(MouseModel.DOD <= dod_to)
+
+    total = db.query(func.count(MouseModel.EarTag)).filter(*filters).scalar()
+
+    query = db.query(MouseModel).filter(*filters)
+    if 'PictureCount' in sort_names:
+        # Picture counts live outside the database, so the matching mice are sorted and paged in memory
+        rows = _page_in_memory(query.all(), sort_spec, picture_counts, after, limit)
+    else:
+        keys = [(getattr(MouseModel, name), order) for name, order in sort_spec]
+        if after:
+            query = query.filter(_keyset_condition(keys, decode_cursor(after, sort_names)))
+        for expr, order in keys:
+            query = query.order_by(expr.is_(None), desc(expr) if order == 'desc' else expr)
+        if limit:
+            query = query.limit(limit + 1)
+        rows = query.all()
+
+    has_more = bool(limit) and len(rows) > limit
+    rows = rows[:limit] if limit else rows
+
+    mice_data = [
+        Mouse(
+            EarTag=mouse.EarTag,
+            Sex=mouse.Sex,
+            DOB=mouse.DOB,
+            DOD=mouse.DOD,
+            DeathDetails=mouse.DeathDetails,
+            DeathNotes=mouse.DeathNotes,
+            Necropsy=mouse.Necropsy,
+            Stagger=mouse.Stagger,
+            Group_Number=mouse.Group_Number,
+            Cohort_id=mouse.Cohort_id,
+            PictureCount=picture_counts.get(mouse.EarTag, 0)
+        )
+        for mouse in rows
+    ]
+
+    next_cursor = None
+    if has_more:
+        last = mice_data[-1]
+        next_cursor = encode_cursor([getattr(last, name) for name in sort_names])
+
+    return mice_data, total, next_cursor
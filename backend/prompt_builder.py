@@ -0,0 +1,251 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from backend.file_stamps import file_stamp
+
+logger = logging.getLogger(__name__)
+
+# prompt.txt layout: intro, <schema> with numbered table blocks and relationships, instructions,
+# a "---" delimited block of examples and the closing "Question:" line
+_TEMPLATE = re.compile(
+    r'^(?P<head>.*?)<schema>(?P<schema>.*?)</schema>(?P<middle>.*?)^---[ \t]*\n\s*Examples:.*?^---[ \t]*\n(?P<tail>.*)$',
+    re.S | re.M,
+)
+_TABLE_BLOCK = re.compile(r'^[ \t]*\d+\.[ \t]+(\w+)[ \t]*\n((?:[ \t]+-.*(?:\n|$))+)', re.M)
+_COLUMN = re.compile(r'^\s*-\s*(\w+)', re.M)
+_FROM_TABLE = re.compile(r'\b(?:from|join)\s+[\["`]?(\w+)', re.I)
+_CAMEL = re.compile(r'(?<=[a-z])(?=[A-Z])')
+_WORD = re.compile(r'[a-z0-9]+')
+
+_STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'did', 'do', 'does', 'each', 'every', 'for', 'from',
+    'give', 'has', 'have', 'how', 'i', 'in', 'is', 'it', 'list', 'me', 'of', 'on', 'or', 'please', 'show', 'the',
+    'their', 'them', 'there', 'to', 'was', 'we', 'were', 'what', 'which', 'who', 'with',
+}
+# Column words too common in questions to say which table is meant ("over time", "by date")
+_GENERIC_WORDS = {'id', 'date', 'time', 'value', 'index', 'number', 'data', 'notes', 'details'}
+
+
+def _stem(word: str) -> str:
+    if word == 'mice':
+        return 'mouse'
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased, lightly stemmed words, with CamelCase names split apart"""
+    words = _WORD.findall(_CAMEL.sub(' ', text).lower())
+    return [_stem(word) for word in words if word not in _STOP_WORDS]
+
+
+def sql_tables(sql: str) -> List[str]:
+    """Tables a statement reads, in order of first use"""
+    return list(dict.fromkeys(_FROM_TABLE.findall(sql)))
+
+
+@dataclass
+class Example:
+    """A verified question -> SQL translation"""
+    question: str
+    sql: str
+    graph: Optional[str]
+    tables: Tuple[str, ...]
+
+    def render(self) -> str:
+        answer = json.dumps({'sql': self.sql, 'graph': self.graph})
+        return f"Question: {self.question}\n\nAnswer: {answer}\n\n"
+
+
+class ExampleIndex:
+    """TF-IDF vectors of the example questions, compared by cosine similarity"""
+
+    def __init__(self, examples: List[Example]):
+        self.examples = examples
+        documents = [Counter(tokenize(example.question)) for example in examples]
+        frequency = Counter(term for document in documents for term in document)
+        self.idf = {term: math.log((1 + len(documents)) / (1 + count)) + 1 for term, count in frequency.items()}
+        self.vectors = [self._vector(document) for document in documents]
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        vector = {term: count * self.idf[term] for term, count in counts.items() if term in self.idf}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def search(self, question: str, k: int, min_score: float = 0.0) -> List[Tuple[float, Example]]:
+        query = self._vector(Counter(tokenize(question)))
+        scored = []
+        for example, vector in zip(self.examples, self.vectors):
+            score = sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            if score > min_score:
+                scored.append((score, example))
+        scored.sort(key=lambda pair: -pair[0])
+        return scored[:k]
+
+
+class PromptTemplate:
+    """prompt.txt split into the parts that are kept and the schema blocks and examples that are chosen"""
+
+    def __init__(self, text: str):
+        self.text = text
+        match = _TEMPLATE.match(text)
+        self.parsed = match is not None
+        if not self.parsed:
+            return
+        self.head, self.middle, self.tail = match.group('head'), match.group('middle'), match.group('tail')
+
+        schema = match.group('schema')
+        self.tables = {}
+        end = 0
+        for block in _TABLE_BLOCK.finditer(schema):
+            self.tables[block.group(1)] = block.group(2).rstrip()
+            end = block.end()
+        self.relationships = schema[end:].strip()
+        self.keywords = self._table_keywords()
+
+    def _table_keywords(self) -> Dict[str, set]:
+        # A table is needed when a question names it, or names a column only that table has
+        columns = {table: {word for column in _COLUMN.findall(block) for word in tokenize(column)}
+                   for table, block in self.tables.items()}
+        owners = Counter(word for words in columns.values() for word in words)
+        return {
+            table: set(tokenize(table)) | {word for word in columns[table]
+                                           if owners[word] == 1 and word not in _GENERIC_WORDS}
+            for table in self.tables
+        }
+
+    def tables_for(self, question: str) -> List[str]:
+        words = set(tokenize(question))
+        return [table for table, keywords in self.keywords.items() if words & keywords]
+
+    def render(self, tables: List[str], examples: List[Example]) -> str:
+        blocks = [f"{number}. {table}\n{self.tables[table]}" for number, table in enumerate(tables, 1)]
+        relationships = []
+        for line in self.relationships.splitlines():
+            # Keep a relationship line when it links two of the tables shown
+            named = [table for table in tables if re.search(rf'\b{table}\b', line)]
+            if not line.strip().startswith('-') or len(named) >= 2:
+                relationships.append(line)
+        if len([line for line in relationships if line.strip()]) == 1:
+            relationships = []
+        schema = '\n\n'.join(blocks) + ('\n\n' + '\n'.join(relationships) if relationships else '')
+        return (
+            f"{self.head}<schema>\n\n{schema}\n\n</schema>{self.middle}---\n\nExamples: \n\n"
+            f"{''.join(example.render() for example in examples)}---\n{self.tail}"
+        )
+
+
+class PromptBuilder:
+    """
+    Assembles a system prompt per question from prompt.txt and a bank of verified examples.
+
+    Instead of sending every table and a fixed set of examples, only the core
+    tables, the tables the question names and those the closest example
+    queries are shown, together with up to k of the most similar examples
+    (TF-IDF over the example questions, computed locally) that use no other
+    tables. The
+    template and example bank are re-read when either file changes. With k=0,
+    or a prompt.txt that does not follow the expected layout, the prompt is
+    sent unchanged.
+    """
+
+    def __init__(self, template_path: str, examples_path: str, k: int = 4, min_score: float = 0.05,
+                 core_tables=('MouseData',)):
+        self.template_path = template_path
+        self.examples_path = examples_path
+        self.k = k
+        self.min_score = min_score
+        self.core_tables = tuple(core_tables)
+        self._lock = threading.Lock()
+        self._loaded = (None, None, None)
+
+    def _load(self) -> Tuple[PromptTemplate, ExampleIndex]:
+        stamps = (file_stamp(self.template_path), file_stamp(self.examples_path))
+        with self._lock:
+            if self._loaded[0] == stamps:
+                return self._loaded[1], self._loaded[2]
+
+        with open(self.template_path, "r") as f:
+            template = PromptTemplate(f.read())
+        examples = []
+        if stamps[1] is not None:
+            with open(self.examples_path, "r") as f:
+                examples = [Example(item['question'], item['sql'], item.get('graph'), tuple(sql_tables(item['sql'])))
+                            for item in json.load(f)]
+        index = ExampleIndex(examples)
+        if not template.parsed:
+            logger.warning(f"{self.template_path} does not have the expected layout; sending it unchanged")
+        logger.info(f"Loaded prompt template and {len(examples)} examples from {self.examples_path}")
+        with self._lock:
+            self._loaded = (stamps, template, index)
+        return template, index
+
+    def select(self, question: str) -> Tuple[List[str], List[Example]]:
+        """The tables and examples a question's prompt will show"""
+        template, index = self._load()
+        candidates = [example for _, example in index.search(question, self.k * 3, self.min_score)]
+        if not candidates:
+            candidates = index.examples[:1]  # still show the answer format
+        wanted = {table.lower() for table in template.tables_for(question)}
+        wanted.update(table.lower() for table in self.core_tables)
+        # The best match decides the remaining tables; weaker matches are only shown if they fit in them
+        if candidates:
+            wanted.update(table.lower() for table in candidates[0].tables)
+        matches = [example for example in candidates
+                   if all(table.lower() in wanted for table in example.tables)][:self.k]
+        # Schema order, and only tables the template actually describes
+        return [table for table in template.tables if table.lower() in wanted], matches
+
+    def build(self, question: str) -> str:
+        template, _ = self._load()
+        if self.k <= 0 or not template.parsed:
+            return template.text
+        tables, examples = self.select(question)
+        prompt = template.render(tables, examples)
+        logger.info(
+            f"Prompt for {question!r}: {len(prompt)} chars (full prompt {len(template.text)}), "
+            f"tables {', '.join(tables)}, {len(examples)} examples"
+        )
+        return prompt
+
+
+prompt_builder = PromptBuilder(
+    os.getenv('PROMPT_PATH', 'prompt.txt'),
+    os.getenv('PROMPT_EXAMPLES_PATH', 'data/sql_examples.json'),
+    k=int(os.getenv('PROMPT_EXAMPLES', 4)),
+)
+
+
+if __name__ == '__main__':
+    # python -m backend.prompt_builder [show "question" | verify [database]]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    if command == 'show' and len(sys.argv) > 2:
+        print(prompt_builder.build(sys.argv[2]))
+    elif command == 'verify':
+        # Every example must still run against the current schema
+        from backend.sql_guard import get_guard
+
+        guard = get_guard(sys.argv[2] if len(sys.argv) > 2 else 'data/mouse_study.db')
+        _, index = prompt_builder._load()
+        failed = 0
+        for example in index.examples:
+            try:
+                guard.check(example.sql)
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {example.question!r}: {e}")
+        print(f"{len(index.examples) - failed}/{len(index.examples)} examples verified")
+        sys.exit(1 if failed else 0)
+    else:
+        sys.exit(f"Unknown command: {command} (expected show \"question\" or verify)")
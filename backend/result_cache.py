@@ -0,0 +1,105 @@
+import os
+import re
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backend.file_stamps import database_version
+
+logger = logging.getLogger(__name__)
+
+# Quoted strings and identifiers, or runs of whitespace and comments
+_SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(?:\s|--[^\n]*|/\*.*?\*/)+""", re.S)
+
+
+def canonical_sql(sql: str) -> str:
+    """Strip comments, collapse whitespace and trailing semicolons, leaving quoted text untouched"""
+    return _SQL_TOKENS.sub(lambda match: match.group(1) or ' ', sql).strip().rstrip(';').strip()
+
+
+@dataclass
+class ColumnarResult:
+    """A query result stored column by column as numpy arrays"""
+    version: tuple
+    columns: Tuple[str, ...]
+    arrays: Tuple[np.ndarray, ...]
+    nbytes: int
+    attrs: dict
+
+    @classmethod
+    def from_frame(cls, version: tuple, df: pd.DataFrame) -> 'ColumnarResult':
+        arrays = tuple(df.iloc[:, index].to_numpy(copy=True) for index in range(df.shape[1]))
+        return cls(version, tuple(df.columns), arrays, int(df.memory_usage(deep=True, index=False).sum()),
+                   dict(df.attrs))
+
+    def to_frame(self) -> pd.DataFrame:
+        # Each caller gets its own copy, so mutating a result never touches the cache
+        df = pd.DataFrame({index: array.copy() for index, array in enumerate(self.arrays)})
+        df.columns = list(self.columns)
+        df.attrs.update(self.attrs)
+        return df
+
+
+class QueryResultCache:
+    """
+    Size-bounded LRU of SQL query results.
+
+    Entries are keyed on (database path, canonical SQL) and remember the
+    database version they were computed against; any write to the database
+    file or its WAL changes the version and turns the entry into a miss.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def get(self, db_path: str, sql: str, version: tuple) -> Optional[pd.DataFrame]:
+        key = (os.path.abspath(db_path), canonical_sql(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version != version:
+                self._total_bytes -= self._entries.pop(key).nbytes
+                self.counters['stale'] += 1
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+        return entry.to_frame()
+
+    def put(self, db_path: str, sql: str, version: tuple, df: pd.DataFrame):
+        entry = ColumnarResult.from_frame(version, df)
+        if entry.nbytes > self.max_bytes:
+            return
+        key = (os.path.abspath(db_path), canonical_sql(sql))
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._total_bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._total_bytes += entry.nbytes
+            while self._total_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= evicted.nbytes
+                self.counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'entries': len(self._entries), 'bytes': self._total_bytes}
+
+
+result_cache = QueryResultCache(int(os.getenv('QUERY_RESULT_CACHE_BYTES', 128 * 1024 ** 2)))
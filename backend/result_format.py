@@ -0,0 +1,91 @@
+from datetime import date
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+# Shapes a query result can be returned in
+RESULT_SHAPES = ('records', 'columnar')
+
+
+def _convert_value(value):
+    """The original per-cell conversion, kept for object columns holding a mix of types"""
+    if pd.isna(value):
+        return None
+    if isinstance(value, (pd.Timestamp, date)):
+        return value.isoformat()
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return value
+
+
+def _isoformat_column(series: pd.Series) -> np.ndarray:
+    values = np.empty(len(series), dtype=object)
+    mask = series.isna().to_numpy()
+    values[mask] = None
+    values[~mask] = [value.isoformat() for value in series[~mask]]
+    return values
+
+
+def _datetime64_column(series: pd.Series) -> np.ndarray:
+    """Same strings as Timestamp.isoformat(), formatted by numpy for whole-second values"""
+    if getattr(series.dtype, 'tz', None) is not None:
+        return _isoformat_column(series)
+    values = series.to_numpy()
+    seconds = values.astype('datetime64[s]')
+    strings = np.datetime_as_string(seconds, unit='s').astype(object)
+    fractional = (values != seconds) & ~np.isnat(values)
+    if fractional.any():
+        strings[fractional] = [pd.Timestamp(value).isoformat() for value in values[fractional]]
+    strings[np.isnat(values)] = None
+    return strings
+
+
+def column_values(series: pd.Series, keep_numpy: bool = False):
+    """
+    Convert one result column to JSON-ready values in a single vectorized pass.
+
+    Missing values become None, timestamps ISO strings and numpy scalars plain
+    Python values. With keep_numpy, numeric and boolean columns are returned as
+    numpy arrays, which orjson serializes natively (NaN as null).
+    """
+    kind = series.dtype.kind
+    if kind in 'iub' and not isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        values = series.to_numpy()
+        return values if keep_numpy else values.tolist()
+    if kind == 'f':
+        values = series.to_numpy()
+        if keep_numpy:
+            return values
+        converted = values.astype(object)
+        converted[np.isnan(values)] = None
+        return converted.tolist()
+    if kind == 'M':
+        return _datetime64_column(series).tolist()
+
+    # Object (or extension) columns: only walk the values when they are not plain strings or numbers
+    inferred = pd.api.types.infer_dtype(series, skipna=True)
+    if inferred in ('date', 'datetime', 'datetime64'):
+        return _isoformat_column(series).tolist()
+    if inferred in ('string', 'empty'):
+        values = series.to_numpy(dtype=object, na_value=None).copy()
+        values[pd.isna(values)] = None
+        return values.tolist()
+    return [_convert_value(value) for value in series]
+
+
+def frame_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """[{column: value, ...}, ...] built column-wise instead of cell by cell"""
+    columns = [str(column) for column in df.columns]
+    values = [column_values(df.iloc[:, index]) for index in range(df.shape[1])]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def frame_to_columnar(df: pd.DataFrame) -> Dict[str, Any]:
+    """{"columns": [...], "dtypes": [...], "data": [column values, ...], "row_count": n}"""
+    return {
+        'columns': [str(column) for column in df.columns],
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+        'data': [column_values(df.iloc[:, index], keep_numpy=True) for index in range(df.shape[1])],
+        'row_count': len(df),
+    }
@@ -0,0 +1,281 @@
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# How many SQLite VM instructions run between budget checks
+PROGRESS_INTERVAL = 1000
+
+
+# Authorizer actions a read-only query may perform; everything else is refused at prepare time
+_READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+
+def _read_only_authorizer(action, *args):
+    return sqlite3.SQLITE_OK if action in _READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+class QueryBudgetExceeded(Exception):
+    """A query ran past its time or VM-step budget and was interrupted"""
+
+
+@dataclass
+class QueryStats:
+    sql: str
+    elapsed: float
+    rows: int
+    truncated: bool
+    vm_steps: int
+
+
+class _Budget:
+    """Progress-handler state for the query currently running on one connection"""
+
+    def __init__(self):
+        self.deadline = None
+        self.max_steps = None
+        self.steps = 0
+        self.reason = None
+
+    def start(self, timeout: Optional[float], max_steps: Optional[int]):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.max_steps = max_steps
+        self.steps = 0
+        self.reason = None
+
+    def __call__(self) -> int:
+        # Returning non-zero makes SQLite abort the statement with "interrupted"
+        self.steps += PROGRESS_INTERVAL
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.reason = 'time'
+            return 1
+        if self.max_steps and self.steps > self.max_steps:
+            self.reason = 'steps'
+            return 1
+        return 0
+
+
+class _Session:
+    """One pooled connection shared by the queries of a session, checked out on first use"""
+
+    def __init__(self, engine: 'SQLiteEngine'):
+        self.engine = engine
+        self.pooled = None
+        self.lock = threading.Lock()
+
+
+# The session the current task or thread belongs to; asyncio tasks and to_thread() inherit it
+_current_session = contextvars.ContextVar('sql_session', default=None)
+
+
+class SQLiteEngine:
+    """
+    Executes untrusted (LLM-generated) SELECTs against a SQLite database.
+
+    Connections are opened read-only (mode=ro, PRAGMA query_only and an
+    authorizer that only permits reads), tuned with mmap and cache pragmas, and
+    reused from a small pool. Every query runs under
+    a wall-clock and VM-step budget enforced by the progress handler, results
+    are capped at max_rows, and timings of recent queries are kept for stats().
+    """
+
+    def __init__(self, db_path: str, pool_size: int = 4, timeout: float = 5.0, max_vm_steps: int = None,
+                 max_rows: int = 100_000, mmap_bytes: int = 256 * 1024 ** 2, cache_kib: int = 64 * 1024):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.max_vm_steps = max_vm_steps
+        self.max_rows = max_rows
+        self.mmap_bytes = mmap_bytes
+        self.cache_kib = cache_kib
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.Semaphore(pool_size)
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=1000)
+        self.counters = {'queries': 0, 'interrupted': 0, 'truncated': 0, 'errors': 0}
+
+    def _connect(self) -> Tuple[sqlite3.Connection, _Budget]:
+        uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_bytes)}")
+        conn.execute(f"PRAGMA cache_size = -{int(self.cache_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.set_authorizer(_read_only_authorizer)
+        budget = _Budget()
+        conn.set_progress_handler(budget, PROGRESS_INTERVAL)
+        return conn, budget
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _release(self, pooled):
+        self._pool.put_nowait(pooled)
+        self._slots.release()
+
+    @staticmethod
+    def _unrestricted(conn: sqlite3.Connection, sql: str):
+        # Transaction control is refused by the read-only authorizer; it is only ever issued here
+        conn.set_authorizer(None)
+        try:
+            conn.execute(sql)
+        finally:
+            conn.set_authorizer(_read_only_authorizer)
+
+    @contextmanager
+    def _connection(self):
+        """The session's connection, held exclusively while one statement runs, or one from the pool"""
+        session = _current_session.get()
+        if session is None or session.engine is not self:
+            pooled = self._acquire()
+            try:
+                yield pooled, False
+            finally:
+                self._release(pooled)
+            return
+
+        with session.lock:
+            if session.pooled is None:
+                session.pooled = self._acquire()
+                self._unrestricted(session.pooled[0], "BEGIN")
+            yield session.pooled, True
+
+    @contextmanager
+    def session(self):
+        """
+        Run every query issued inside the block (from any task or thread it
+        spawns) on one pooled connection, in a single read transaction.
+
+        The queries see one consistent snapshot of the database and only one
+        connection is taken from the pool, however many there are; they run
+        one at a time on it.
+        """
+        session = _Session(self)
+        token = _current_session.set(session)
+        try:
+            yield
+        finally:
+            _current_session.reset(token)
+            with session.lock:
+                if session.pooled is not None:
+                    try:
+                        self._unrestricted(session.pooled[0], "ROLLBACK")
+                    finally:
+                        self._release(session.pooled)
+
+    def read_frame(self, sql: str, params=(), timeout: float = None, max_rows: int = None) -> Tuple[pd.DataFrame, QueryStats]:
+        """
+        Run one statement and return its rows as a DataFrame with the query's stats.
+
+        Raises QueryBudgetExceeded if the budget runs out; rows beyond max_rows
+        are dropped and reported as truncated.
+        """
+        max_rows = self.max_rows if max_rows is None else max_rows
+        started = time.perf_counter()
+        with self._connection() as ((conn, budget), in_session):
+            try:
+                budget.start(self.timeout if timeout is None else timeout, self.max_vm_steps)
+                cursor = conn.execute(sql, params)
+                columns = [column[0] for column in cursor.description or ()]
+                rows = cursor.fetchmany(max_rows + 1) if max_rows else cursor.fetchall()
+                cursor.close()
+            except sqlite3.OperationalError as e:
+                # The connection is still usable after an interrupt; roll back any open read transaction
+                # unless it is the session's, which a failed statement leaves intact
+                if not in_session:
+                    conn.rollback()
+                with self._lock:
+                    self.counters['queries'] += 1
+                    self.counters['interrupted' if budget.reason else 'errors'] += 1
+                if budget.reason:
+                    elapsed = time.perf_counter() - started
+                    logger.warning(f"SQL interrupted after {elapsed:.2f}s / {budget.steps} VM steps ({budget.reason} budget): {sql}")
+                    limit = f"{self.timeout if timeout is None else timeout}s" if budget.reason == 'time' else f"{self.max_vm_steps} VM steps"
+                    raise QueryBudgetExceeded(f"Query exceeded its {limit} budget and was stopped") from e
+                raise
+            except Exception:
+                if not in_session:
+                    conn.rollback()
+                with self._lock:
+                    self.counters['queries'] += 1
+                    self.counters['errors'] += 1
+                raise
+            finally:
+                steps = budget.steps
+                budget.start(None, None)
+
+        truncated = bool(max_rows) and len(rows) > max_rows
+        if truncated:
+            rows = rows[:max_rows]
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        stats = QueryStats(sql, time.perf_counter() - started, len(rows), truncated, steps)
+        with self._lock:
+            self.counters['queries'] += 1
+            self.counters['truncated'] += truncated
+            self._recent.append(stats.elapsed)
+        logger.info(f"SQL ran in {stats.elapsed * 1000:.1f}ms, {stats.rows} rows{' (truncated)' if truncated else ''}")
+        return df, stats
+
+    def explain(self, sql: str) -> list:
+        """EXPLAIN QUERY PLAN rows (id, parent, notused, detail) for a statement, without running it"""
+        with self._connection() as ((conn, budget), in_session):
+            try:
+                budget.start(self.timeout, None)
+                return conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            except Exception:
+                if not in_session:
+                    conn.rollback()
+                raise
+            finally:
+                budget.start(None, None)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            timings = sorted(self._recent)
+            counters = dict(self.counters)
+        percentile = lambda p: timings[min(len(timings) - 1, int(p * len(timings)))] if timings else None
+        return {
+            **counters,
+            'p50_seconds': percentile(0.5),
+            'p95_seconds': percentile(0.95),
+            'max_seconds': timings[-1] if timings else None,
+        }
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(db_path: str) -> SQLiteEngine:
+    """Shared engine for a database file, configured from the environment"""
+    key = os.path.abspath(db_path)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            max_vm_steps = int(os.getenv('SQL_MAX_VM_STEPS', 0)) or None
+            engine = _engines[key] = SQLiteEngine(
+                db_path,
+                pool_size=int(os.getenv('SQL_POOL_SIZE', 4)),
+                timeout=float(os.getenv('SQL_TIMEOUT_SECONDS', 5)),
+                max_vm_steps=max_vm_steps,
+                max_rows=int(os.getenv('SQL_MAX_ROWS', 100_000)),
+            )
+        return engine
@@ -0,0 +1,261 @@
+import os
+import re
+import sqlite3
+import threading
+import logging
+from dataclasses import dataclass, field
+from math import prod
+from typing import Dict, List, Tuple
+
+import pandas as pd
+
+from backend.file_stamps import database_version
+from backend.result_cache import canonical_sql
+from backend.sql_engine import SQLiteEngine, get_engine
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_QUOTED_IDENTIFIER = re.compile(r'"((?:[^"]|"")*)"|`([^`]*)`|\[([^\]]*)\]')
+_TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+)(?:\s*(?:offset|,)\s*\d+)?$", re.I)
+# "SCAN Weights", "SCAN w LEFT-JOIN", "SCAN main.Weights"; before SQLite 3.36 "SCAN TABLE Weights AS w"
+_SCAN = re.compile(r"^SCAN (?:(TABLE) )?(\S+)")
+# Subquery and CTE results the plan builds and then scans under their own name
+_DERIVED = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (?:SUBQUERY )?(\S+)")
+_DERIVED_SCAN = re.compile(r"^SCAN (?:CONSTANT ROW|SUBQUERY \d+)")
+_TOKEN = re.compile(r"\w+|[(),.]")
+# Keywords that can follow a FROM item where an alias would otherwise be
+_NOT_ALIASES = frozenset(
+    'on using where group order limit having window union intersect except join inner left right full outer cross natural indexed not'.split())
+# Keywords that end a FROM list at their parenthesis depth
+_FROM_LIST_END = frozenset('where group order limit having window union intersect except'.split())
+# SQLite renames duplicate result columns "name:1", "name:2", ... when a query is wrapped
+_DEDUPED_COLUMN = re.compile(r"^(.*):\d+$")
+
+
+class SQLRejected(Exception):
+    """Generated SQL that the cost gate refused to run"""
+
+
+@dataclass
+class SQLPlan:
+    """What the gate decided about one statement"""
+    sql: str  # the statement to execute, possibly wrapped in a LIMIT
+    limited: bool
+    scans: List[Tuple[str, int]] = field(default_factory=list)
+    estimated_rows: int = 0
+    notes: List[str] = field(default_factory=list)
+
+
+class SQLGuard:
+    """
+    Pre-execution checks for LLM-generated SQL.
+
+    A statement must be a single SELECT (or WITH ... SELECT); the read-only
+    authorizer on the engine's connections refuses anything else while the plan
+    is prepared. EXPLAIN QUERY PLAN then shows which tables would be scanned in
+    full: scans of large tables are flagged, nested full scans (unindexed joins)
+    are costed as the product of their row counts, and statements whose
+    estimate exceeds the budget are rejected before they run. Queries without a
+    LIMIT of their own are wrapped in one so results are capped and the
+    truncation is reported.
+    """
+
+    def __init__(self, engine: SQLiteEngine, max_rows: int, max_scan_rows: int, max_join_rows: int,
+                 large_tables=('GripStrength', 'Weights'), large_table_rows: int = 5000):
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_scan_rows = max_scan_rows
+        self.max_join_rows = max_join_rows
+        self.large_tables = {name.lower() for name in large_tables}
+        self.large_table_rows = large_table_rows
+        self._lock = threading.Lock()
+        self._table_rows = (None, {})
+
+    def table_rows(self) -> Dict[str, int]:
+        """Row count of every table (lower-cased name), recounted when the database changes"""
+        version = database_version(self.engine.db_path)
+        with self._lock:
+            if self._table_rows[0] == version:
+                return self._table_rows[1]
+
+        names, _ = self.engine.read_frame("SELECT name FROM sqlite_master WHERE type = 'table'")
+        counts = {}
+        for name in names['name']:
+            quoted = name.replace('"', '""')
+            df, _ = self.engine.read_frame(f'SELECT COUNT(*) AS n FROM "{quoted}"')
+            counts[name.lower()] = int(df['n'].iloc[0])
+        with self._lock:
+            self._table_rows = (version, counts)
+        return counts
+
+    def _decide(self, sql: str, decision: str, reason: str):
+        logger.info(f"SQL gate: {decision} ({reason}): {sql}")
+
+    def check(self, sql: str) -> SQLPlan:
+        """Validate and cost a statement. Raises SQLRejected when it must not run"""
+        statement = canonical_sql(sql)
+        # Blank out string literals and unwrap quoted identifiers so keywords and names can be matched
+        unquoted = _QUOTED_IDENTIFIER.sub(lambda m: next(g for g in m.groups() if g is not None),
+                                          _STRING.sub("''", statement))
+
+        if ';' in unquoted:
+            self._decide(sql, 'rejected', 'multiple statements')
+            raise SQLRejected("Only a single SELECT statement can be run")
+        if not re.match(r'(select|with)\b', unquoted, re.I):
+            self._decide(sql, 'rejected', 'not a SELECT')
+            raise SQLRejected("Only SELECT statements can be run")
+
+        try:
+            plan_rows = self.engine.explain(statement)
+        except sqlite3.DatabaseError as e:
+            if 'not authorized' in str(e):
+                self._decide(sql, 'rejected', 'statement writes or uses disallowed features')
+                raise SQLRejected("Only read-only SELECT statements can be run") from e
+            raise
+
+        tables = self.table_rows()
+        aliases = _from_aliases(unquoted)
+        plan = SQLPlan(statement, limited=False)
+        nested, separate, derived = [], [], set()
+        for _, parent, _, detail in plan_rows:
+            match = _DERIVED.match(detail)
+            if match:
+                derived.add(match.group(1).lower())
+                continue
+            match = _SCAN.match(detail)
+            if not match or _DERIVED_SCAN.match(detail):
+                continue
+            # The newer format names the alias, the older one the table itself
+            name = match.group(2).lower().rsplit('.', 1)[-1]
+            if name in derived:
+                continue
+            table = name if match.group(1) else aliases.get(name, name)
+            if table not in tables:
+                if table in derived or table.startswith('sqlite_') or 'VIRTUAL TABLE' in detail:
+                    continue  # CTE results, the schema tables and table-valued functions
+                # Anything else could be a full scan the estimate would miss
+                self._decide(sql, 'rejected', f'unmapped plan step "{detail}"')
+                raise SQLRejected("Could not tell which tables the query scans; simplify the query")
+            rows = tables[table]
+            plan.scans.append((table, rows))
+            (nested if parent == 0 else separate).append(rows)
+            if table in self.large_tables or rows >= self.large_table_rows:
+                plan.notes.append(f"full scan of large table {table} ({rows} rows)")
+
+        # Full scans in the same loop nest multiply; scans in subqueries run on their own
+        plan.estimated_rows = (prod(nested) if nested else 0) + sum(separate)
+        if len(nested) > 1:
+            plan.notes.append(f"unindexed join over {len(nested)} full scans (~{plan.estimated_rows} row visits)")
+            if plan.estimated_rows > self.max_join_rows:
+                self._decide(sql, 'rejected', '; '.join(plan.notes))
+                raise SQLRejected(
+                    f"Query joins tables without an index (~{plan.estimated_rows:,} row visits); add a join condition or filter"
+                )
+        if plan.estimated_rows > self.max_scan_rows:
+            self._decide(sql, 'rejected', '; '.join(plan.notes))
+            raise SQLRejected(f"Query would scan ~{plan.estimated_rows:,} rows; add a filter")
+
+        limit = _TRAILING_LIMIT.search(unquoted)
+        if limit is None or int(limit.group(1)) > self.max_rows:
+            plan.sql = f"SELECT * FROM ({statement}) LIMIT {self.max_rows + 1}"
+            plan.limited = True
+            plan.notes.append(f"wrapped in LIMIT {self.max_rows}")
+
+        self._decide(sql, 'accepted', '; '.join(plan.notes) or 'indexed or small')
+        return plan
+
+    def run(self, sql: str) -> Tuple[pd.DataFrame, bool]:
+        """Check and execute a statement. Returns (rows, truncated)"""
+        plan = self.check(sql)
+        df, stats = self.engine.read_frame(plan.sql, max_rows=self.max_rows)
+        if plan.limited:
+            df.columns = [_restore_column(column, df.columns[:index]) for index, column in enumerate(df.columns)]
+        return df, stats.truncated
+
+
+def _closing(tokens: List[str], start: int) -> int:
+    """Index of the parenthesis closing the one at start"""
+    depth = 0
+    for index in range(start, len(tokens)):
+        depth += {'(': 1, ')': -1}.get(tokens[index], 0)
+        if depth == 0:
+            return index
+    return len(tokens) - 1
+
+
+def _from_aliases(sql: str) -> Dict[str, str]:
+    """
+    Alias of every aliased FROM item to its table or CTE name (lower-cased).
+
+    "FROM GripStrength g", "JOIN MouseData AS m", "FROM MouseData m, Weights w":
+    only names in FROM item position count, so column aliases and keywords are
+    never mistaken for tables. Subqueries are left out; the plan names their
+    results itself.
+    """
+    tokens = _TOKEN.findall(sql.lower())
+    aliases = {}
+    from_depths = set()  # parenthesis depths currently inside a FROM list
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token == '(':
+            depth += 1
+            continue
+        if token == ')':
+            from_depths.discard(depth)
+            depth -= 1
+            continue
+        if token in _FROM_LIST_END:
+            from_depths.discard(depth)
+            continue
+        if token == 'from':
+            from_depths.add(depth)
+        elif token != 'join' and not (token == ',' and depth in from_depths):
+            continue
+
+        position = index + 1
+        if position >= len(tokens):
+            break
+        if tokens[position] == '(':
+            continue
+        name = tokens[position]
+        position += 1
+        if position + 1 < len(tokens) and tokens[position] == '.':
+            name = tokens[position + 1]
+            position += 2
+        if position < len(tokens) and tokens[position] == '(':  # table-valued function
+            position = _closing(tokens, position) + 1
+        if position < len(tokens) and tokens[position] == 'as':
+            position += 1
+        if position < len(tokens) and tokens[position] not in '(),.' and tokens[position] not in _NOT_ALIASES:
+            aliases[tokens[position]] = name
+    return aliases
+
+
+def _restore_column(column: str, previous) -> str:
+    match = _DEDUPED_COLUMN.match(column)
+    if match and match.group(1) in previous:
+        return match.group(1)
+    return column
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(db_path: str) -> SQLGuard:
+    """Shared gate for a database file, configured from the environment"""
+    key = os.path.abspath(db_path)
+    with _guards_lock:
+        guard = _guards.get(key)
+        if guard is None:
+            large_tables = [name.strip() for name in os.getenv('SQL_LARGE_TABLES', 'GripStrength,Weights').split(',') if name.strip()]
+            guard = _guards[key] = SQLGuard(
+                get_engine(db_path),
+                max_rows=int(os.getenv('SQL_MAX_ROWS', 100_000)),
+                max_scan_rows=int(os.getenv('SQL_MAX_SCAN_ROWS', 50_000_000)),
+                max_join_rows=int(os.getenv('SQL_MAX_JOIN_ROWS', 10_000_000)),
+                large_tables=large_tables,
+                large_table_rows=int(os.getenv('SQL_LARGE_TABLE_ROWS', 5000)),
+            )
+        return guard
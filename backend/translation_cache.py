@@ -0,0 +1,154 @@
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not change what a question asks"""
+    return re.sub(r'\s+', ' ', question).strip().rstrip('?.!').strip().lower()
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode()).hexdigest()
+
+
+class TranslationCache:
+    """
+    Persistent cache of natural-language question -> LLM response.
+
+    Entries are keyed on the normalized question, a hash of the system prompt
+    and the model name, so editing prompt.txt or switching models never serves
+    an old translation. Translations live in a local SQLite table with an
+    in-memory LRU in front of it.
+    """
+
+    def __init__(self, db_path: str, memory_entries: int = 512):
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS translations (
+                    key TEXT PRIMARY KEY,
+                    question TEXT NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections are not shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def key(question: str, prompt: str, model: str) -> str:
+        return hashlib.sha1(f"{model}\0{prompt_hash(prompt)}\0{normalize_question(question)}".encode()).hexdigest()
+
+    def _remember(self, key: str, response: str):
+        with self._lock:
+            self._memory[key] = response
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, question: str, prompt: str, model: str) -> Optional[str]:
+        key = self.key(question, prompt, model)
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return response
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM translations WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE translations SET hits = hits + 1 WHERE key = ?", (key,))
+        if row is None:
+            with self._lock:
+                self.counters['misses'] += 1
+            return None
+
+        with self._lock:
+            self.counters['disk_hits'] += 1
+        self._remember(key, row[0])
+        return row[0]
+
+    def put(self, question: str, prompt: str, model: str, response: str):
+        key = self.key(question, prompt, model)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO translations (key, question, prompt_hash, model, response, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, normalize_question(question), prompt_hash(prompt), model, response, time.time()),
+            )
+        self._remember(key, response)
+
+    def clear(self, model: str = None) -> int:
+        """Drop every cached translation, or only those for one model. Returns the number removed"""
+        with self._connect() as conn:
+            if model:
+                removed = conn.execute("DELETE FROM translations WHERE model = ?", (model,)).rowcount
+            else:
+                removed = conn.execute("DELETE FROM translations").rowcount
+        with self._lock:
+            self._memory.clear()
+        logger.info(f"Cleared {removed} cached translations")
+        return removed
+
+    def stats(self) -> Dict[str, float]:
+        with self._connect() as conn:
+            entries, stored_hits = conn.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM translations").fetchone()
+        with self._lock:
+            counters = dict(self.counters)
+            memory_entries = len(self._memory)
+        lookups = sum(counters.values())
+        hits = counters['memory_hits'] + counters['disk_hits']
+        return {
+            **counters,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'memory_entries': memory_entries,
+            'entries': entries,
+            'lifetime_disk_hits': stored_hits,
+        }
+
+
+translation_cache = TranslationCache(
+    os.getenv('TRANSLATION_CACHE_DB', 'data/llm_cache.db'),
+    memory_entries=int(os.getenv('TRANSLATION_CACHE_ENTRIES', 512)),
+)
+
+
+if __name__ == '__main__':
+    # python -m backend.translation_cache [stats | clear [model]]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    if command == 'clear':
+        print(f"Removed {translation_cache.clear(sys.argv[2] if len(sys.argv) > 2 else None)} translations")
+    elif command == 'stats':
+        print(translation_cache.stats())
+    else:
+        sys.exit(f"Unknown command: {command} (expected stats or clear)")
@@ -0,0 +1,117 @@
+"""
+End-to-end latency of call_llm_and_get_results() at several concurrency levels.
+
+The LLM is replaced by the offline replay provider, so the numbers cover
+prompt assembly, the (simulated) model call, SQL checks and execution and
+result serialization without a network. Run from the repository root:
+
+    python -m benchmarks.query_latency --concurrency 1,4,16 --requests 200 --latency 0.3
+
+By default the translation and result caches are bypassed so every request
+takes the full path; --cache keeps them, which measures repeat questions.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', default='1,4,16', help="comma-separated levels (default 1,4,16)")
+    parser.add_argument('--requests', type=int, default=100, help="requests per level (default 100)")
+    parser.add_argument('--latency', type=float, default=0.5, help="simulated LLM latency in seconds (default 0.5)")
+    parser.add_argument('--jitter', type=float, default=0.2, help="latency varies by up to this fraction (default 0.2)")
+    parser.add_argument('--recordings', default='data/sql_examples.json', help="replay file the questions come from")
+    parser.add_argument('--mode', choices=('sync', 'async'), default='sync',
+                        help="sync: call_llm_and_get_results in threads; async: the server's coroutine path")
+    parser.add_argument('--cache', action='store_true', help="keep the translation and result caches")
+    return parser.parse_args()
+
+
+class NoTranslationCache:
+    """Translation cache that never hits, so every request reaches the LLM"""
+
+    def get(self, *args):
+        return None
+
+    def put(self, *args):
+        pass
+
+
+def run_sync(questions, concurrency):
+    def timed(question):
+        started = time.perf_counter()
+        try:
+            llm_sql.call_llm_and_get_results(question)
+            return time.perf_counter() - started, None
+        except Exception as e:
+            return time.perf_counter() - started, e
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(timed, questions))
+
+
+def run_async(questions, concurrency):
+    async def main():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def timed(question):
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    await llm_sql.call_llm_and_get_results_async(question)
+                    return time.perf_counter() - started, None
+                except Exception as e:
+                    return time.perf_counter() - started, e
+
+        return await asyncio.gather(*(timed(question) for question in questions))
+
+    return asyncio.run(main())
+
+
+def report(concurrency, outcomes, wall):
+    timings = np.array([elapsed for elapsed, _ in outcomes]) * 1000
+    errors = [error for _, error in outcomes if error is not None]
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    print(f"{concurrency:>11} {len(outcomes):>8} {len(errors):>6} {len(outcomes) / wall:>9.1f} "
+          f"{p50:>9.1f} {p95:>9.1f} {p99:>9.1f} {timings.max():>9.1f}")
+    for error in errors[:3]:
+        print(f"{'':>11} error: {type(error).__name__}: {error}")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # The provider is chosen when backend.llm is imported, so configure it first
+    os.environ.update({
+        'LLM_PROVIDER': 'replay',
+        'LLM_REPLAY_PATH': args.recordings,
+        'LLM_REPLAY_LATENCY': str(args.latency),
+        'LLM_REPLAY_JITTER': str(args.jitter),
+    })
+    import llm_sql
+    from backend.llm_replay import load_recordings
+    from backend.result_cache import QueryResultCache
+
+    if not args.cache:
+        llm_sql.translation_cache = NoTranslationCache()
+        llm_sql.result_cache = QueryResultCache(0)
+
+    recorded = list(load_recordings(args.recordings))
+    if not recorded:
+        sys.exit(f"No recorded questions in {args.recordings}")
+    runner = run_sync if args.mode == 'sync' else run_async
+
+    print(f"{len(recorded)} recorded questions, {args.latency}s ±{args.jitter:.0%} LLM latency, "
+          f"{args.mode} path, caches {'on' if args.cache else 'off'}")
+    print(f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for concurrency in [int(level) for level in args.concurrency.split(',')]:
+        questions = [recorded[index % len(recorded)] for index in range(args.requests)]
+        started = time.perf_counter()
+        outcomes = runner(questions, concurrency)
+        report(concurrency, outcomes, time.perf_counter() - started)
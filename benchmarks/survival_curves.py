@@ -0,0 +1,100 @@
+"""
+convert_survival_data() against the original day-by-day implementation.
+
+Both run on a synthetic colony (and on the study database, when present), the
+outputs are compared for equality and the timings reported. Run from the
+repository root:
+
+    python -m benchmarks.survival_curves --mice 100000 --groups 10
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_processing.data_functions import convert_survival_data, end_date, load_survival_rows, start_date
+
+
+def convert_survival_data_by_day(df, start_date=start_date, end_date=end_date):
+    """The implementation convert_survival_data() replaced, kept as the reference"""
+    survival_data = {}
+    death_events = []
+
+    current_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+
+    while current_date <= end_date:
+        date_str = current_date.strftime('%Y-%m-%d')
+        survival_data[date_str] = {}
+
+        for group in df['Group'].unique():
+            alive_count = ((df['DOD'].isna()) | (pd.to_datetime(df['DOD']) > current_date)) & (df['Group'] == group)
+            survival_data[date_str][f'Group {group}'] = alive_count.sum()
+
+        deaths_today = df[pd.to_datetime(df['DOD']) == current_date]
+        for _, mouse in deaths_today.iterrows():
+            death_events.append({
+                'date': date_str,
+                'group': f"Group {mouse['Group']}",
+                'ear_tag': mouse['EarTag']
+            })
+
+        current_date += pd.Timedelta(days=1)
+    return survival_data, death_events
+
+
+def synthetic_colony(mice: int, groups: int, alive_fraction: float = 0.4, seed: int = 0) -> pd.DataFrame:
+    """Mice shaped like the survival query's rows: EarTag, DOD (ISO string or None), Group"""
+    rng = np.random.default_rng(seed)
+    first, last = pd.Timestamp(start_date) - pd.Timedelta(days=30), pd.Timestamp(end_date) + pd.Timedelta(days=30)
+    days = rng.integers(0, (last - first).days + 1, mice)
+    dod = pd.Series((first + pd.to_timedelta(days, unit='D')).strftime('%Y-%m-%d'), dtype=object)
+    dod[rng.random(mice) < alive_fraction] = None
+    return pd.DataFrame({
+        'EarTag': np.arange(1, mice + 1),
+        'DOD': dod,
+        'Group': rng.integers(1, groups + 1, mice),
+    })
+
+
+def same_output(expected, actual) -> bool:
+    """Equal values and equal types (numpy counts, the same ear tag objects), in the same order"""
+    (expected_data, expected_events), (actual_data, actual_events) = expected, actual
+    if list(expected_data) != list(actual_data) or expected_events != actual_events:
+        return False
+    for date, groups in expected_data.items():
+        other = actual_data[date]
+        if list(groups) != list(other) or any(type(groups[key]) is not type(other[key]) or groups[key] != other[key]
+                                              for key in groups):
+            return False
+    return [type(event['ear_tag']) for event in expected_events] == [type(event['ear_tag']) for event in actual_events]
+
+
+def compare(label: str, df: pd.DataFrame, skip_reference: bool = False):
+    started = time.perf_counter()
+    actual = convert_survival_data(df)
+    vectorized = time.perf_counter() - started
+    if skip_reference:
+        print(f"{label}: {len(df)} mice, vectorized {vectorized * 1000:.1f}ms")
+        return
+
+    started = time.perf_counter()
+    expected = convert_survival_data_by_day(df)
+    by_day = time.perf_counter() - started
+    print(f"{label}: {len(df)} mice, {len(expected[0])} days, {len(expected[1])} deaths | "
+          f"by day {by_day:.2f}s, vectorized {vectorized * 1000:.1f}ms ({by_day / vectorized:.0f}x) | "
+          f"identical: {same_output(expected, actual)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mice', type=int, default=100_000, help="synthetic colony size (default 100000)")
+    parser.add_argument('--groups', type=int, default=10, help="synthetic groups (default 10)")
+    parser.add_argument('--skip-reference', action='store_true', help="only time the vectorized version")
+    args = parser.parse_args()
+
+    if os.path.exists('data/mouse_study.db'):
+        compare('study database', load_survival_rows(), args.skip_reference)
+    compare('synthetic colony', synthetic_colony(args.mice, args.groups), args.skip_reference)
@@ -1,89 +1,180 @@
 import json
 from datetime import datetime, timedelta
 import os
+import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import sqlite3
+from data_processing.survival_cache import survival_cache
+from data_processing.survival_store import SURVIVAL_ANALYSIS_ROWS_SQL, SURVIVAL_ROWS_SQL, grid_placement, survival_store
 
 start_date = '2023-11-03'
 end_date = '2024-10-03'
 
+# Treatment columns of the "Group" table survival curves can be filtered on
+TREATMENT_FACTORS = ('Rapamycin', 'HSCs', 'Senolytic', 'Mobilization', 'AAV9')
+
 def convert_survival_data(df, start_date=start_date, end_date=end_date):
-    # Initialize data structure
-    survival_data = {}
-    death_events = []
-
-    # Process data
-    current_date = pd.to_datetime(start_date)
-    end_date = pd.to_datetime(end_date)
-
-    while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        survival_data[date_str] = {}
-
-        for group in df['Group'].unique():
-            alive_count = ((df['DOD'].isna()) | (pd.to_datetime(df['DOD']) > current_date)) & (df['Group'] == group)
-            survival_data[date_str][f'Group {group}'] = alive_count.sum()
-
-        # Check for deaths on this date
-        deaths_today = df[pd.to_datetime(df['DOD']) == current_date]
-        for _, mouse in deaths_today.iterrows():
-            death_events.append({
-                'date': date_str,
-                'group': f"Group {mouse['Group']}",
-                'ear_tag': mouse['EarTag']
-            })
-
-        current_date += pd.Timedelta(days=1)
+    """
+    Mice alive per group on every day from start_date to end_date, and the deaths on those days.
+
+    Returns ({date: {"Group <n>": alive, ...}}, [{"date", "group", "ear_tag"}, ...]).
+    A mouse counts as alive on a day until the day of its DOD. Each mouse is
+    placed on the day grid once by grid_placement(), as survival_steps() and
+    the survival store do, so every group's curve is a cumulative sum over the
+    grid rather than a scan of all mice per day.
+    """
+    dates = pd.date_range(pd.to_datetime(start_date), pd.to_datetime(end_date), freq='D')
+    date_strings = list(dates.strftime('%Y-%m-%d'))
+    grid = dates.to_numpy(dtype='datetime64[ns]')
+    days_alive, death_day = grid_placement(grid, df['DOD'])
+
+    groups = df['Group'].unique()
+    codes = pd.Index(groups).get_indexer(df['Group'])
+    in_group = df['Group'].notna().to_numpy()
+    width = len(grid) + 1
+    leaving = np.bincount(codes[in_group] * width + days_alive[in_group],
+                          minlength=len(groups) * width).reshape(len(groups), width)
+    # alive on day j = mice alive on more than j days
+    alive = leaving[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+
+    keys = [f'Group {group}' for group in groups]
+    survival_data = {date: dict(zip(keys, counts)) for date, counts in zip(date_strings, alive.T)}
+
+    # Deaths falling exactly on a grid day, by day and then in row order
+    rows = np.flatnonzero(death_day >= 0)
+    rows = rows[np.argsort(death_day[rows], kind='stable')]
+    # Same (object) values iterrows() would give
+    values = df.iloc[rows].to_numpy()
+    ear_tag, group = df.columns.get_loc('EarTag'), df.columns.get_loc('Group')
+    death_events = [
+        {'date': date_strings[day], 'group': f"Group {row[group]}", 'ear_tag': row[ear_tag]}
+        for day, row in zip(death_day[rows].tolist(), values)
+    ]
     return survival_data, death_events
 
-def get_survival_data(start_date=start_date, end_date=end_date, survival_data_path='data/survival_data.json'):
-    # check if the file exists
-    if os.path.exists(survival_data_path):
-        try:
-            with open(survival_data_path, 'r') as f:
-                survival_data = json.load(f)
-            return survival_data
-        except json.JSONDecodeError:
-            # If JSON loading fails, continue with generating new data
-            pass
-    
-    conn = sqlite3.connect('data/mouse_study.db')
+def load_survival_rows(start_date=start_date, end_date=end_date, db_path='data/mouse_study.db', analysis=False):
+    """
+    EarTag, DOD and Group of every mouse born by start_date that was alive or died by end_date.
+
+    With analysis, mice that died after end_date are included too, for
+    survival_analysis() to censor at end_date.
+    """
+    conn = sqlite3.connect(db_path)
 
     # Convert dates to SQLite format
     start_date = pd.to_datetime(start_date).strftime('%Y-%m-%d')
     end_date = pd.to_datetime(end_date).strftime('%Y-%m-%d')
 
-    # Get all mice and their death dates
-    query = '''
-    SELECT m.EarTag, m.DOD, g.Number as "Group"
-    FROM MouseData m
-    JOIN "Group" g ON m.Group_Number = g.Number
-    WHERE m.DOB <= ? AND (m.DOD IS NULL OR m.DOD <= ?)
-    '''
-    
-    df = pd.read_sql_query(query, conn, params=(start_date, end_date))
+    if analysis:
+        df = pd.read_sql_query(SURVIVAL_ANALYSIS_ROWS_SQL, conn, params=(start_date,))
+    else:
+        df = pd.read_sql_query(SURVIVAL_ROWS_SQL, conn, params=(start_date, end_date))
     conn.close()
-
-    survival_data, death_events = convert_survival_data(df, start_date, end_date)
-
-    # Convert numpy types to native Python types before JSON serialization
-    survival_data_serializable = {}
-    for date, groups in survival_data.items():
-        survival_data_serializable[date] = {
-            group: int(count) for group, count in groups.items()
+    return df
+
+def survival_rows_sql(groups=None, cohorts=None, sex=None, treatments=None, analysis=False):
+    """
+    The survival query narrowed to some groups, cohorts, a sex and treatment factor values.
+
+    Returns (sql, params); the query's own start and end date parameters go before params.
+    With analysis it is the query without the end date bound, which only takes the start date.
+    """
+    conditions, params = [], []
+    if groups:
+        conditions.append(f"g.Number IN ({','.join('?' * len(groups))})")
+        params.extend(groups)
+    if cohorts:
+        conditions.append(f"m.Cohort_id IN ({','.join('?' * len(cohorts))})")
+        params.extend(cohorts)
+    if sex:
+        conditions.append("m.Sex = ?")
+        params.append(sex)
+    for factor, value in (treatments or {}).items():
+        if factor not in TREATMENT_FACTORS:
+            raise ValueError(f"Unknown treatment factor: {factor}")
+        conditions.append(f'g."{factor}" = ?')
+        params.append(value)
+    base = SURVIVAL_ANALYSIS_ROWS_SQL if analysis else SURVIVAL_ROWS_SQL
+    return base + ''.join(f" AND {condition}" for condition in conditions), params
+
+def survival_steps(df, start_date=start_date, end_date=end_date, deaths=True):
+    """
+    Mice alive per group from start_date to end_date, as step changes in columns.
+
+    The counts are convert_survival_data()'s, but each group lists only the
+    first day and the days its count changes ({"dates": [...], "alive": [...]}),
+    each count holding until the next date and the last one until end_date.
+    With deaths, the deaths on the range are columns as well, by day and then ear tag.
+    """
+    dates = pd.date_range(pd.to_datetime(start_date), pd.to_datetime(end_date), freq='D')
+    date_strings = np.array(dates.strftime('%Y-%m-%d'), dtype=str)
+    grid = dates.to_numpy(dtype='datetime64[ns]')
+    days_alive, death_day = grid_placement(grid, df['DOD'])
+
+    numbers, codes = np.unique(df['Group'].to_numpy(), return_inverse=True)
+    codes = codes.reshape(-1)
+    width = len(grid) + 1
+    leaving = np.bincount(codes * width + days_alive, minlength=len(numbers) * width).reshape(len(numbers), width)
+    # alive on day j = group size - mice alive on at most j days; it changes on the days mice leave
+    alive = leaving.sum(axis=1, keepdims=True) - leaving.cumsum(axis=1)[:, :len(grid)]
+    changes = leaving[:, :len(grid)] > 0
+    changes[:, :1] = True
+    series = {}
+    for number, counts, changed in zip(numbers.tolist(), alive, changes):
+        days = np.flatnonzero(changed)
+        series[f"Group {number}"] = {'dates': date_strings[days].tolist(), 'alive': counts[days].tolist()}
+
+    result = {
+        'start_date': pd.to_datetime(start_date).strftime('%Y-%m-%d'),
+        'end_date': pd.to_datetime(end_date).strftime('%Y-%m-%d'),
+        'mice': int(len(df)),
+        'series': series,
+    }
+    if deaths:
+        ear_tags = df['EarTag'].to_numpy()
+        rows = np.flatnonzero(death_day >= 0)
+        rows = rows[np.lexsort((ear_tags[rows], death_day[rows]))]
+        result['deaths'] = {
+            'date': date_strings[death_day[rows]].tolist(),
+            'group': [f"Group {number}" for number in numbers[codes[rows]].tolist()],
+            'ear_tag': ear_tags[rows].tolist(),
         }
+    return result
 
-    # Save the data to a JSON file for caching
-    with open(survival_data_path, 'w') as f:
-        json.dump(survival_data_serializable, f, indent=4)
-
+def _survival_result(arrays):
+    dates, groups = arrays['dates'].tolist(), arrays['groups'].tolist()
+    alive = arrays['alive'].T.tolist()
     return {
-        'survival_data': survival_data_serializable,
-        'death_events': death_events
+        'survival_data': {date: dict(zip(groups, counts)) for date, counts in zip(dates, alive)},
+        'death_events': [
+            {'date': dates[day], 'group': group, 'ear_tag': ear_tag}
+            for day, group, ear_tag in zip(arrays['death_day'].tolist(), arrays['death_group'].tolist(),
+                                           arrays['death_ear_tag'].tolist())
+        ],
     }
 
+def get_survival_data(start_date=start_date, end_date=end_date, db_path='data/mouse_study.db'):
+    """
+    {'survival_data': {date: {"Group <n>": alive}}, 'death_events': [...]} for the date range.
+
+    Results come from the survival cache, keyed on the dates and the database
+    version, so they are computed once per range until the database changes.
+    After a change the range's survival store patches the curves of the mice
+    that changed. The result is shared between callers and must not be modified.
+    """
+    start_date = pd.to_datetime(start_date).strftime('%Y-%m-%d')
+    end_date = pd.to_datetime(end_date).strftime('%Y-%m-%d')
+
+    def compute():
+        store = survival_store(db_path, start_date, end_date)
+        store.refresh()
+        return store.arrays()
+
+    params = {'kind': 'survival_data', 'start_date': start_date, 'end_date': end_date}
+    return survival_cache.get(db_path, params, compute, _survival_result)
+
 def draw_kaplan_meier_chart(data_json):
     survival_data = data_json['survival_data']
     death_events = data_json['death_events']
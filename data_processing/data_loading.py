@@ -5,6 +5,7 @@ import pandas as pd
 import sqlite3
 from datetime import datetime
 import traceback
+from data_processing.survival_store import install_change_log
 
 def load_grip_strength_data(start_directory):
     conn = sqlite3.connect('mouse_study.db')
@@ -90,6 +91,8 @@ def load_cohort_data(file_path):
     cursor = conn.cursor()
 
     try:
+        # Log changed mice so survival curves are patched rather than rebuilt (once the tables exist)
+        install_change_log(conn)
         df = pd.read_csv(file_path, sep=',', quotechar='"', 
                          lineterminator='\n', quoting=csv.QUOTE_MINIMAL, 
                          on_bad_lines='warn')
@@ -148,6 +151,8 @@ def load_death_data(file_path):
     cursor = conn.cursor()
 
     try:
+        # Log changed mice so survival curves are patched rather than rebuilt (once the tables exist)
+        install_change_log(conn)
         # Read the Excel file
         df = pd.read_excel(file_path, sheet_name=0)
         
@@ -9,6 +9,7 @@ from PyQt6.QtGui import QPixmap, QImage, QKeySequence, QShortcut, QNativeGesture
 import os
 from dotenv import load_dotenv
 from backend.mouse_data import get_db, get_full_mice_data_from_db
+from image_storage import get_picture_index
 
 load_dotenv()
 
@@ -139,7 +140,8 @@ class ImageEditor(QMainWindow):
         
         # Load the CSV data
         self.csv_path = 'data/image_results.csv'  # Store path as instance variable
-        self.df = pd.read_csv(self.csv_path, dtype={'ear_tag': 'Int64'})
+        self.pictures = get_picture_index(self.csv_path)
+        self.df = self.pictures.read_frame()
         
         self.df = fix_full_text(self.df)
         
@@ -439,7 +441,7 @@ class ImageEditor(QMainWindow):
 
     def save_changes(self):
         self.update_current_row()
-        self.df.to_csv(self.csv_path, index=False)  # Use stored path
+        self.pictures.write_frame(self.df)
         
         # Show temporary success message in notification label
         self.notification_label.setText("✓ Changes saved!")
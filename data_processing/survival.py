@@ -0,0 +1,318 @@
+"""
+Kaplan-Meier survival analysis for the study's treatment groups.
+
+Everything works on arrays of (duration, observed, group): durations in days
+since the experiment start, observed False for right-censored mice (still alive
+at the end of the study). Subjects are sorted by group and time once
+and every group's curve is built from that single ordering with segmented
+cumulative sums, so thousands of groups cost little more than one.
+"""
+import math
+import sys
+from dataclasses import dataclass
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_processing.data_functions import end_date, load_survival_rows, start_date
+
+# Pairwise tests grow with the square of the number of groups; beyond this only the overall test runs
+MAX_PAIRWISE_GROUPS = 50
+
+
+@dataclass
+class SurvivalCurve:
+    """Product-limit estimate for one group, one row per distinct event or censoring time"""
+    group: Any
+    subjects: int
+    time: np.ndarray
+    at_risk: np.ndarray
+    events: np.ndarray
+    censored: np.ndarray
+    survival: np.ndarray
+    lower: np.ndarray  # Greenwood confidence band, on the log(-log) scale so it stays within [0, 1]
+    upper: np.ndarray
+    median: Optional[float]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'subjects': self.subjects,
+            'events': int(self.events.sum()),
+            'median': self.median,
+            'time': self.time.tolist(),
+            'at_risk': self.at_risk.tolist(),
+            'deaths': self.events.tolist(),
+            'censored': self.censored.tolist(),
+            'survival': self.survival.tolist(),
+            'lower': self.lower.tolist(),
+            'upper': self.upper.tolist(),
+        }
+
+
+@dataclass
+class LogRankResult:
+    groups: tuple
+    statistic: float
+    df: int
+    p_value: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'groups': list(self.groups), 'statistic': self.statistic, 'df': self.df, 'p_value': self.p_value}
+
+
+def chi2_sf(x: float, df: int) -> float:
+    """P(X >= x) for a chi-squared variable: the regularized upper incomplete gamma Q(df/2, x/2)"""
+    if x <= 0 or df <= 0:
+        return 1.0
+    if df == 1:
+        return math.erfc(math.sqrt(x / 2))
+    a, x = df / 2, x / 2
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # Series for the lower function P
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefix))
+    # Continued fraction for Q (modified Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c, d = 1 / tiny, 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, h * math.exp(log_prefix))
+
+
+def _segmented_cumsum(values: np.ndarray, codes: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Running sums that restart at each group, for rows sorted by group (starts: each group's first row)"""
+    total = np.cumsum(values)
+    before = np.r_[0.0, total][starts]
+    return total - before[codes]
+
+
+def kaplan_meier(durations, observed, groups=None, alpha: float = 0.05) -> Dict[Any, SurvivalCurve]:
+    """
+    Survival curves with (1 - alpha) Greenwood confidence bands and medians, per group.
+
+    durations are times to death or censoring, observed whether the death
+    was seen. Subjects without a group (NaN) are left out.
+    """
+    durations = np.asarray(durations, dtype=float)
+    observed = np.asarray(observed, dtype=bool)
+    codes, labels = pd.factorize(pd.Series(np.zeros(len(durations)) if groups is None else groups), sort=True)
+    keep = codes >= 0
+    durations, observed, codes = durations[keep], observed[keep], codes[keep]
+
+    # The one sort: by group, then time
+    order = np.lexsort((durations, codes))
+    durations, observed, codes = durations[order], observed[order], codes[order]
+
+    # Collapse ties: one row per distinct (group, time)
+    distinct = np.r_[True, (codes[1:] != codes[:-1]) | (durations[1:] != durations[:-1])] if len(codes) else np.zeros(0, bool)
+    first = np.flatnonzero(distinct)
+    row_codes, time = codes[first], durations[first]
+    deaths = np.add.reduceat(observed.astype(np.int64), first) if len(first) else np.zeros(0, np.int64)
+    subjects = np.diff(np.r_[first, len(codes)])
+    group_sizes = np.bincount(codes, minlength=len(labels))
+    group_ends = np.cumsum(group_sizes)
+    at_risk = group_ends[row_codes] - first
+
+    # S(t) = prod(1 - d/n): segmented sums of logs, with the steps that reach zero counted separately
+    row_counts = np.bincount(row_codes, minlength=len(labels))
+    starts = np.r_[0, np.cumsum(row_counts)[:-1]]
+    emptied = deaths == at_risk
+    log_step = np.log1p(-np.divide(deaths, at_risk, out=np.zeros(len(time)), where=~emptied))
+    survival = np.exp(_segmented_cumsum(log_step, row_codes, starts))
+    reached_zero = _segmented_cumsum(emptied.astype(float), row_codes, starts) > 0
+    survival[reached_zero] = 0.0
+
+    # Greenwood: Var(log S) = sum d / (n (n - d)); the log(-log S) transform keeps the band in [0, 1]
+    greenwood = _segmented_cumsum(
+        np.divide(deaths, at_risk * (at_risk - deaths), out=np.zeros(len(time)), where=~emptied), row_codes, starts)
+    z = NormalDist().inv_cdf(1 - alpha / 2)
+    lower, upper = survival.copy(), survival.copy()
+    interior = (survival > 0) & (survival < 1)
+    log_s = np.log(survival[interior])
+    theta = z * np.sqrt(greenwood[interior]) / np.abs(log_s)
+    lower[interior] = survival[interior] ** np.exp(theta)
+    upper[interior] = survival[interior] ** np.exp(-theta)
+
+    # Median: the first time the curve reaches 0.5 or below
+    medians = np.full(len(labels), np.nan)
+    below = np.flatnonzero(survival <= 0.5)
+    median_groups, first_below = np.unique(row_codes[below], return_index=True)
+    medians[median_groups] = time[below[first_below]]
+
+    curves = {}
+    for code, label in enumerate(labels):
+        if not row_counts[code]:
+            continue
+        rows = slice(starts[code], starts[code] + row_counts[code])
+        curves[label] = SurvivalCurve(
+            group=label,
+            subjects=int(group_sizes[code]),
+            time=time[rows],
+            at_risk=at_risk[rows],
+            events=deaths[rows],
+            censored=subjects[rows] - deaths[rows],
+            survival=survival[rows],
+            lower=lower[rows],
+            upper=upper[rows],
+            median=None if np.isnan(medians[code]) else float(medians[code]),
+        )
+    return curves
+
+
+def _risk_tables(durations, observed, groups):
+    """At-risk and death counts per group (rows) at each distinct death time (columns), and group labels"""
+    durations = np.asarray(durations, dtype=float)
+    observed = np.asarray(observed, dtype=bool)
+    codes, labels = pd.factorize(pd.Series(groups), sort=True)
+    keep = codes >= 0
+    durations, observed, codes = durations[keep], observed[keep], codes[keep]
+
+    death_times = np.unique(durations[observed])
+    # A subject is at risk at every death time up to and including its own time
+    position = np.searchsorted(death_times, durations, side='right')
+    leaving = np.bincount(codes * (len(death_times) + 1) + position,
+                          minlength=len(labels) * (len(death_times) + 1)).reshape(len(labels), -1)
+    at_risk = leaving[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+    deaths = np.bincount(codes[observed] * len(death_times) + position[observed] - 1,
+                         minlength=len(labels) * len(death_times)).reshape(len(labels), -1)
+    return at_risk.astype(float), deaths.astype(float), list(labels)
+
+
+def _solve_diagonal_minus_low_rank(diagonal, factors, weights, y):
+    """x with (diag(diagonal) - factors diag(weights) factors^T) x = y, by the Woodbury identity"""
+    inverse = 1 / diagonal
+    scaled = factors * inverse[:, None]
+    core = np.diag(1 / weights) - factors.T @ scaled
+    return inverse * y + scaled @ np.linalg.solve(core, scaled.T @ y)
+
+
+def logrank_test(durations, observed, groups) -> LogRankResult:
+    """k-group log-rank test of equal survival across all groups"""
+    at_risk, deaths, labels = _risk_tables(durations, observed, groups)
+    n, d = at_risk.sum(axis=0), deaths.sum(axis=0)
+    share = np.divide(at_risk, n, out=np.zeros_like(at_risk), where=n > 0)
+    observed_minus_expected = (deaths - share * d).sum(axis=1)
+    # Hypergeometric covariance of the death counts, summed over death times:
+    # V = diag(sum_t w_t p_gt) - P diag(w) P^T, with p_gt the group's share of those at risk
+    weight = np.divide(d * (n - d), n - 1, out=np.zeros_like(d), where=n > 1)
+    diagonal = (share * weight).sum(axis=1)
+
+    # Groups nobody was at risk in add nothing; one of the rest is redundant
+    informative = np.flatnonzero(diagonal > 0)
+    if len(informative) < 2:
+        return LogRankResult(tuple(labels), 0.0, 0, 1.0)
+    kept = informative[:-1]
+    difference = observed_minus_expected[kept]
+    columns = weight > 0
+    factors, weights = share[np.ix_(kept, columns)], weight[columns]
+    if len(weights) < len(kept):
+        solved = _solve_diagonal_minus_low_rank(diagonal[kept], factors, weights, difference)
+    else:
+        covariance = np.diag(diagonal[kept]) - (factors * weights) @ factors.T
+        try:
+            solved = np.linalg.solve(covariance, difference)
+        except np.linalg.LinAlgError:
+            solved = np.linalg.lstsq(covariance, difference, rcond=None)[0]
+    statistic = float(difference @ solved)
+    return LogRankResult(tuple(labels), statistic, len(kept), chi2_sf(statistic, len(kept)))
+
+
+def pairwise_logrank(durations, observed, groups) -> List[LogRankResult]:
+    """Two-group log-rank tests for every pair of groups, computed together"""
+    at_risk, deaths, labels = _risk_tables(durations, observed, groups)
+    first, second = np.triu_indices(len(labels), k=1)
+    n = at_risk[first] + at_risk[second]
+    d = deaths[first] + deaths[second]
+    expected = np.divide(at_risk[first] * d, n, out=np.zeros_like(n), where=n > 0).sum(axis=1)
+    variance = np.divide(at_risk[first] * at_risk[second] * d * (n - d), n * n * (n - 1),
+                         out=np.zeros_like(n), where=n > 1).sum(axis=1)
+    difference = deaths[first].sum(axis=1) - expected
+    statistics = np.divide(difference ** 2, variance, out=np.zeros_like(variance), where=variance > 0)
+    return [
+        LogRankResult((labels[a], labels[b]), float(statistic), 1, chi2_sf(statistic, 1))
+        for a, b, statistic in zip(first, second, statistics)
+    ]
+
+
+def survival_durations(df: pd.DataFrame, start_date=start_date, end_date=end_date) -> pd.DataFrame:
+    """
+    Days from the experiment start to death or censoring for the survival query's rows.
+
+    Mice still alive, or dying after end_date, are censored at end_date, so the
+    rows should come from the analysis query that keeps the latter. Mice that
+    died before the start or whose DOD cannot be read are dropped.
+    """
+    start, end = pd.to_datetime(start_date), pd.to_datetime(end_date)
+    dod = pd.to_datetime(df['DOD'], errors='coerce')
+    usable = (df['DOD'].isna() | dod.notna()) & ~(dod < start)
+    df, dod = df[usable], dod[usable]
+
+    died = dod.notna() & (dod <= end)
+    stop = dod.where(dod.notna() & (dod <= end), end)
+    return pd.DataFrame({
+        'EarTag': df['EarTag'],
+        'Group': df['Group'],
+        'duration': (stop - start) / pd.Timedelta(days=1),
+        'observed': died,
+    })
+
+
+def survival_analysis(df: pd.DataFrame, start_date=start_date, end_date=end_date, alpha: float = 0.05) -> Dict[str, Any]:
+    """
+    Curves, medians and log-rank tests for the survival query's rows (EarTag, DOD, Group).
+
+    Groups are labelled "Group <n>" like the alive counts of get_survival_data().
+    Times are days since start_date.
+    """
+    data = survival_durations(df, start_date, end_date)
+    # Group numbers keep their numeric order; the labels are only applied to the results
+    label = lambda group: f"Group {group}"
+    groups, durations, observed = data['Group'].to_numpy(), data['duration'].to_numpy(), data['observed'].to_numpy()
+
+    curves = kaplan_meier(durations, observed, groups, alpha)
+    overall = logrank_test(durations, observed, groups) if len(curves) > 1 else None
+    result = {
+        'start_date': pd.to_datetime(start_date).strftime('%Y-%m-%d'),
+        'end_date': pd.to_datetime(end_date).strftime('%Y-%m-%d'),
+        'alpha': alpha,
+        'excluded': int(len(df) - len(data)),
+        'curves': {label(group): curve.to_dict() for group, curve in curves.items()},
+        'logrank': {**overall.to_dict(), 'groups': [label(group) for group in overall.groups]} if overall else None,
+        'pairwise': [],
+    }
+    if 1 < len(curves) <= MAX_PAIRWISE_GROUPS:
+        result['pairwise'] = [{**test.to_dict(), 'groups': [label(group) for group in test.groups]}
+                              for test in pairwise_logrank(durations, observed, groups)]
+    return result
+
+
+if __name__ == '__main__':
+    # python -m data_processing.survival [database]: medians and tests for the study database
+    rows = load_survival_rows(db_path=sys.argv[1] if len(sys.argv) > 1 else 'data/mouse_study.db', analysis=True)
+    analysis = survival_analysis(rows)
+    for label, curve in analysis['curves'].items():
+        print(f"{label}: {curve['subjects']} mice, {curve['events']} deaths, median {curve['median']} days")
+    print(f"log-rank: {analysis['logrank']}")
+    for test in analysis['pairwise']:
+        if test['p_value'] < 0.05:
+            print(f"  {test['groups'][0]} vs {test['groups'][1]}: chi2 {test['statistic']:.2f}, p {test['p_value']:.4f}")
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import threading
+import zipfile
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+import numpy as np
+
+from backend.file_stamps import database_version
+
+logger = logging.getLogger(__name__)
+
+# Bump when the arrays stored for a result change shape, so old files are never read back
+CACHE_FORMAT = 1
+
+
+class SurvivalCache:
+    """
+    Survival results keyed on their parameters and the database version.
+
+    An entry's key is a hash of the parameters, the database path and the
+    database's version stamp (the database and WAL file stamps), so a
+    different date range or any write to the database looks up a different
+    entry and stale curves are never served. Entries are stored as compressed
+    .npz arrays in `directory`, and decoded results are kept in an in-process
+    LRU in front of the files; both are shared by every caller, which must not
+    mutate what they get back.
+    """
+
+    def __init__(self, directory: str, memory_entries: int = 32, max_files: int = 256):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def key(self, db_path: str, params: Dict[str, Any]) -> str:
+        stamp = json.dumps([CACHE_FORMAT, os.path.abspath(db_path), database_version(db_path), params],
+                           sort_keys=True, default=str)
+        return hashlib.sha1(stamp.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def _remember(self, key: str, result):
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _load(self, key: str):
+        try:
+            with np.load(self._path(key), allow_pickle=False) as stored:
+                return {name: stored[name] for name in stored.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            logger.warning(f"Ignoring unreadable survival cache entry {key}: {str(e)}")
+            return None
+
+    def _store(self, key: str, arrays: Dict[str, np.ndarray]):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write survival cache entry {key}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._prune()
+
+    def _prune(self):
+        # Entries for old database versions are never read again; keep only the newest files
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.npz')]
+        except OSError:
+            return
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def get(self, db_path: str, params: Dict[str, Any],
+            compute: Callable[[], Dict[str, np.ndarray]], decode: Callable[[Dict[str, np.ndarray]], Any]):
+        """
+        The decoded result for params against the current database.
+
+        compute() produces the arrays to store on a miss and decode() turns
+        stored arrays into the result handed out.
+        """
+        # Read the version before computing: a write during compute leaves the entry under the old version
+        key = self.key(db_path, params)
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return result
+
+        arrays = self._load(key)
+        if arrays is not None:
+            with self._lock:
+                self.counters['disk_hits'] += 1
+        else:
+            with self._lock:
+                self.counters['misses'] += 1
+            arrays = compute()
+            self._store(key, arrays)
+
+        result = decode(arrays)
+        self._remember(key, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counters, 'memory_entries': len(self._memory)}
+
+
+survival_cache = SurvivalCache(
+    os.getenv('SURVIVAL_CACHE_DIR', 'data/survival_cache'),
+    memory_entries=int(os.getenv('SURVIVAL_CACHE_ENTRIES', 32)),
+)
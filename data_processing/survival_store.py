@@ -0,0 +1,329 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import closing
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# EarTag, DOD and Group of every mouse born by the start date that was alive or died by the end date
+SURVIVAL_ROWS_SQL = '''
+    SELECT m.EarTag, m.DOD, g.Number as "Group"
+    FROM MouseData m
+    JOIN "Group" g ON m.Group_Number = g.Number
+    WHERE m.DOB <= ? AND (m.DOD IS NULL OR m.DOD <= ?)
+    '''
+
+# The same mice plus those that died after the end date, which survival analysis censors there;
+# only the start date is a parameter
+SURVIVAL_ANALYSIS_ROWS_SQL = '''
+    SELECT m.EarTag, m.DOD, g.Number as "Group"
+    FROM MouseData m
+    JOIN "Group" g ON m.Group_Number = g.Number
+    WHERE m.DOB <= ?
+    '''
+
+CHANGE_LOG_TABLE = 'SurvivalChangeLog'
+
+# Every write that can move a mouse in or out of a survival curve logs its EarTag;
+# a NULL EarTag (a group added, removed or renumbered) means every mouse may have changed
+CHANGE_LOG_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    EarTag INTEGER,
+    changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TRIGGER IF NOT EXISTS survival_mouse_insert AFTER INSERT ON MouseData BEGIN
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) VALUES (NEW.EarTag);
+END;
+CREATE TRIGGER IF NOT EXISTS survival_mouse_delete AFTER DELETE ON MouseData BEGIN
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) VALUES (OLD.EarTag);
+END;
+CREATE TRIGGER IF NOT EXISTS survival_mouse_update AFTER UPDATE OF EarTag, DOB, DOD, Group_Number ON MouseData BEGIN
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) VALUES (OLD.EarTag);
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) SELECT NEW.EarTag WHERE NEW.EarTag IS NOT OLD.EarTag;
+END;
+CREATE TRIGGER IF NOT EXISTS survival_group_insert AFTER INSERT ON "Group" BEGIN
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) VALUES (NULL);
+END;
+CREATE TRIGGER IF NOT EXISTS survival_group_delete AFTER DELETE ON "Group" BEGIN
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) VALUES (NULL);
+END;
+CREATE TRIGGER IF NOT EXISTS survival_group_update AFTER UPDATE OF Number ON "Group" BEGIN
+    INSERT INTO {CHANGE_LOG_TABLE} (EarTag) VALUES (NULL);
+END;
+'''
+
+# Without every one of these, writes go unlogged and the log cannot be trusted
+CHANGE_LOG_TRIGGERS = frozenset(re.findall(r'CREATE TRIGGER IF NOT EXISTS (\w+)', CHANGE_LOG_SCHEMA))
+
+# Ear tags re-read per query, below SQLite's bound-parameter limit
+READ_CHUNK = 500
+# Survival stores kept in memory, one per database and date range
+MAX_STORES = 8
+
+
+def grid_placement(grid: np.ndarray, dod: pd.Series):
+    """
+    Days alive and death day of each mouse on a grid of consecutive days.
+
+    A mouse is alive on a prefix of the grid: every day when its DOD is
+    missing, no day when the DOD is present but not a date, otherwise the days
+    before its DOD. The death day is its DOD's index on the grid, -1 if off it.
+    """
+    dates = pd.to_datetime(dod).to_numpy(dtype='datetime64[ns]')
+    days_alive = np.where(dod.isna().to_numpy(), len(grid), 0)
+    dies = ~np.isnat(dates)
+    days_alive[dies] = np.searchsorted(grid, dates[dies], side='left')
+    death_day = np.full(len(dod), -1)
+    on_grid = dies & (days_alive < len(grid))
+    on_grid[on_grid] = grid[days_alive[on_grid]] == dates[on_grid]
+    death_day[on_grid] = days_alive[on_grid]
+    return days_alive, death_day
+
+
+def install_change_log(conn: sqlite3.Connection) -> bool:
+    """
+    Create the change log and its triggers (idempotent); writers then record their changes automatically.
+
+    Returns False, installing nothing, while MouseData or "Group" does not exist yet.
+    """
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if not {'MouseData', 'Group'} <= tables:
+        return False
+    conn.executescript(CHANGE_LOG_SCHEMA)
+    return True
+
+
+def prune_change_log(conn: sqlite3.Connection, keep: int = 10000) -> int:
+    """Delete all but the newest `keep` entries; stores that had not read the deleted ones rebuild"""
+    deleted = conn.execute(f"DELETE FROM {CHANGE_LOG_TABLE} WHERE id <= (SELECT MAX(id) FROM {CHANGE_LOG_TABLE}) - ?",
+                           (keep,)).rowcount
+    conn.commit()
+    return deleted
+
+
+def _prune_applied(db_path: str):
+    """
+    Delete the log entries every store of this process has applied.
+
+    Stores in other processes that had not read them notice the gap and
+    rebuild. A database that cannot be written right now is left for the
+    next refresh.
+    """
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        positions = [store._log_position for (path, _, _), store in _stores.items() if path == key]
+        applied = min(positions) if positions and None not in positions else None
+        if not applied or applied <= _pruned.get(key, 0):
+            return
+    try:
+        with closing(sqlite3.connect(f"file:{key}?mode=rw", uri=True, timeout=0.1)) as conn:
+            conn.execute(f"DELETE FROM {CHANGE_LOG_TABLE} WHERE id <= ?", (applied,))
+            conn.commit()
+    except sqlite3.Error as e:
+        logger.debug(f"Survival change log of {db_path} not pruned: {str(e)}")
+        return
+    with _stores_lock:
+        _pruned[key] = max(_pruned.get(key, 0), applied)
+
+
+class SurvivalStore:
+    """
+    Mice alive per group on every day of a date range, kept up to date incrementally.
+
+    The store remembers each mouse's group and how many days of the range it
+    is alive on. When the database has the change log (installed by the
+    loaders or "python -m data_processing.survival_store install", never by the
+    server), refresh() re-reads only the mice logged since the last refresh and
+    patches the alive counts of their groups over the days that changed, e.g. a
+    new DOD subtracts the mouse from its group's curve from that date forward;
+    applied entries are then pruned. Without a change log or any of its
+    triggers (dropped along with a replaced table), after a change log gap
+    (pruned entries, a replaced database) or when a group changes, it reloads
+    every mouse.
+    """
+
+    def __init__(self, db_path: str, start_date, end_date):
+        self.db_path = db_path
+        self.dates = pd.date_range(pd.to_datetime(start_date), pd.to_datetime(end_date), freq='D')
+        self.grid = self.dates.to_numpy(dtype='datetime64[ns]')
+        self.date_strings = np.array(self.dates.strftime('%Y-%m-%d'), dtype=str)
+        self.params = (pd.to_datetime(start_date).strftime('%Y-%m-%d'), pd.to_datetime(end_date).strftime('%Y-%m-%d'))
+        self._lock = threading.Lock()
+        self._log_position = None
+        self.counters = {'rebuilds': 0, 'patches': 0, 'mice_patched': 0}
+        self._reset()
+
+    def _reset(self):
+        # EarTag -> (group number, days alive, death day or -1)
+        self.mice: Dict[int, tuple] = {}
+        self.groups: Dict[int, int] = {}
+        self.alive = np.zeros((0, len(self.grid)), dtype=np.int64)
+        self.group_sizes = np.zeros(0, dtype=np.int64)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True)
+
+    def _rows(self, conn: sqlite3.Connection, ear_tags: Iterable[int] = None) -> pd.DataFrame:
+        if ear_tags is None:
+            return pd.read_sql_query(SURVIVAL_ROWS_SQL, conn, params=self.params)
+        ear_tags = list(ear_tags)
+        frames = []
+        for start in range(0, len(ear_tags), READ_CHUNK):
+            chunk = ear_tags[start:start + READ_CHUNK]
+            sql = f"{SURVIVAL_ROWS_SQL} AND m.EarTag IN ({','.join('?' * len(chunk))})"
+            frames.append(pd.read_sql_query(sql, conn, params=(*self.params, *chunk)))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['EarTag', 'DOD', 'Group'])
+
+    def _group(self, number) -> int:
+        index = self.groups.get(number)
+        if index is None:
+            index = self.groups[number] = len(self.groups)
+            self.alive = np.vstack([self.alive, np.zeros((1, len(self.grid)), dtype=np.int64)])
+            self.group_sizes = np.append(self.group_sizes, 0)
+        return index
+
+    def _rebuild(self, conn: sqlite3.Connection):
+        self._reset()
+        df = self._rows(conn)
+        days_alive, death_day = grid_placement(self.grid, df['DOD'])
+        codes = np.array([self._group(number) for number in df['Group'].tolist()], dtype=np.int64)
+        # alive on day j = mice whose days alive exceed j, per group
+        width = len(self.grid) + 1
+        counts = np.bincount(codes * width + days_alive, minlength=len(self.groups) * width).reshape(len(self.groups), width)
+        self.alive = counts[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:].copy()
+        self.group_sizes = counts.sum(axis=1)
+        self.mice = {ear_tag: (group, alive, death) for ear_tag, group, alive, death in
+                     zip(df['EarTag'].tolist(), df['Group'].tolist(), days_alive.tolist(), death_day.tolist())}
+        self.counters['rebuilds'] += 1
+
+    def _move(self, ear_tag: int, new):
+        """Replace one mouse's contribution: only its group's counts between the old and new days alive change"""
+        old = self.mice.pop(ear_tag, None)
+        if old is not None and new is not None and old[0] == new[0]:
+            group = self.groups[old[0]]
+            if new[1] > old[1]:
+                self.alive[group, old[1]:new[1]] += 1
+            else:
+                self.alive[group, new[1]:old[1]] -= 1
+            self.mice[ear_tag] = new
+            return
+        if old is not None:
+            group = self.groups[old[0]]
+            self.alive[group, :old[1]] -= 1
+            self.group_sizes[group] -= 1
+        if new is not None:
+            group = self._group(new[0])
+            self.alive[group, :new[1]] += 1
+            self.group_sizes[group] += 1
+            self.mice[ear_tag] = new
+
+    def _patch(self, conn: sqlite3.Connection, ear_tags: set):
+        df = self._rows(conn, ear_tags)
+        days_alive, death_day = grid_placement(self.grid, df['DOD'])
+        current = {ear_tag: (group, alive, death) for ear_tag, group, alive, death in
+                   zip(df['EarTag'].tolist(), df['Group'].tolist(), days_alive.tolist(), death_day.tolist())}
+        # Mice no longer returned by the query (deleted, regrouped away, out of range) leave their curve
+        for ear_tag in ear_tags:
+            self._move(ear_tag, current.get(ear_tag))
+        self.counters['patches'] += 1
+        self.counters['mice_patched'] += len(ear_tags)
+
+    def _pending_changes(self, conn: sqlite3.Connection):
+        """(position, changed ear tags) since the last refresh, or (position, None) when everything must be reloaded"""
+        has_log = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                               (CHANGE_LOG_TABLE,)).fetchone()
+        if not has_log:
+            return None, None
+        triggers = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+        if not CHANGE_LOG_TRIGGERS <= triggers:
+            # A table was dropped and recreated, taking its triggers along: the log misses writes
+            return None, None
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (CHANGE_LOG_TABLE,)).fetchone()
+        position = row[0] if row else 0
+        if self._log_position is None or position < self._log_position:
+            return position, None
+        changes = conn.execute(f"SELECT EarTag FROM {CHANGE_LOG_TABLE} WHERE id > ? AND id <= ?",
+                               (self._log_position, position)).fetchall()
+        # Ids are never reused, so fewer entries than the id gap means some were pruned before being read
+        if len(changes) != position - self._log_position or any(ear_tag is None for ear_tag, in changes):
+            return position, None
+        return position, {ear_tag for ear_tag, in changes}
+
+    def refresh(self):
+        """Bring the curves up to date with the database"""
+        with self._lock, closing(self._connect()) as conn:
+            # One read transaction, so the log position and the rows re-read agree
+            conn.execute("BEGIN")
+            try:
+                position, changed = self._pending_changes(conn)
+                if changed is None or len(changed) > len(self.mice) // 2:
+                    self._rebuild(conn)
+                elif changed:
+                    self._patch(conn, changed)
+                self._log_position = position
+            finally:
+                conn.rollback()
+        if self._log_position:
+            _prune_applied(self.db_path)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """
+        The current curves as the survival cache stores them.
+
+        Groups with mice, in numeric order; deaths on the grid by day and then ear tag.
+        """
+        with self._lock:
+            numbers = sorted(number for number, index in self.groups.items() if self.group_sizes[index] > 0)
+            alive = self.alive[[self.groups[number] for number in numbers]].reshape(len(numbers), len(self.grid))
+            deaths = [(death, ear_tag, group) for ear_tag, (group, _, death) in self.mice.items() if death >= 0]
+        deaths.sort()
+        return {
+            'dates': self.date_strings,
+            'groups': np.array([f"Group {number}" for number in numbers], dtype=str),
+            'alive': alive.copy(),
+            'death_day': np.array([death for death, _, _ in deaths], dtype=np.int64),
+            'death_group': np.array([f"Group {group}" for _, _, group in deaths], dtype=str),
+            'death_ear_tag': np.array([ear_tag for _, ear_tag, _ in deaths], dtype=np.int64),
+        }
+
+
+_stores = OrderedDict()
+_stores_lock = threading.Lock()
+# Database path -> highest change log id deleted by _prune_applied()
+_pruned: Dict[str, int] = {}
+
+
+def survival_store(db_path: str, start_date, end_date) -> SurvivalStore:
+    """The shared store for a database and date range, created on first use"""
+    key = (os.path.abspath(db_path), pd.to_datetime(start_date).strftime('%Y-%m-%d'),
+           pd.to_datetime(end_date).strftime('%Y-%m-%d'))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = SurvivalStore(db_path, start_date, end_date)
+            while len(_stores) > MAX_STORES:
+                _stores.popitem(last=False)
+        _stores.move_to_end(key)
+        return store
+
+
+if __name__ == '__main__':
+    # python -m data_processing.survival_store install|prune [database]
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('install', 'prune'):
+        sys.exit("Usage: python -m data_processing.survival_store install|prune [database]")
+    with closing(sqlite3.connect(sys.argv[2] if len(sys.argv) == 3 else 'data/mouse_study.db')) as conn:
+        if sys.argv[1] == 'install':
+            if not install_change_log(conn):
+                sys.exit("The database has no MouseData and \"Group\" tables to log changes of")
+            print(f"Installed the {CHANGE_LOG_TABLE} table and its triggers")
+        else:
+            print(f"Deleted {prune_change_log(conn)} change log entries")
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, replace
+from io import BytesIO
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from image_storage import (CHUNK_SIZE, ByteRange, ImageInfo, ImageStorage, ImageStream,
+                           resolve_range)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CachedImage:
+    info: ImageInfo
+    data: bytes
+    validated_at: float
+
+
+class CachedImageStorage(ImageStorage):
+    """
+    Read-through cache in front of another ImageStorage.
+
+    Images are kept in two tiers: an in-memory LRU bounded by total bytes, and a
+    local disk directory with its own byte budget and LRU eviction (file access
+    times carry the order across restarts). Entries are trusted for
+    revalidate_after seconds; after that they are revalidated with a conditional
+    request on their generation/ETag, which costs a 304 instead of a download
+    when the object has not changed.
+    """
+
+    def __init__(self, backend: ImageStorage, memory_bytes: int, disk_dir: str, disk_bytes: int,
+                 revalidate_after: float = 3600):
+        self.backend = backend
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.revalidate_after = revalidate_after
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # path -> _CachedImage, least recently used first
+        self._memory_total = 0
+        self._disk = OrderedDict()  # key -> size of the data file, least recently used first
+        self._disk_total = 0
+        self._path_locks = {}  # path -> [lock, threads holding or waiting for it]
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'revalidations': 0,
+            'not_modified': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+        }
+        self._load_disk()
+
+    # Disk tier
+
+    def _key(self, path: str) -> str:
+        return hashlib.sha1(path.encode()).hexdigest()
+
+    def _disk_paths(self, key: str):
+        base = os.path.join(self.disk_dir, key[:2], key)
+        return f"{base}.bin", f"{base}.json"
+
+    def _load_disk(self):
+        os.makedirs(self.disk_dir, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                full_path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    os.remove(full_path)
+                elif name.endswith('.bin'):
+                    stat = os.stat(full_path)
+                    files.append((stat.st_atime, name[:-len('.bin')], stat.st_size))
+
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self._disk_total += size
+        with self._lock:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_total > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_total -= size
+            self.counters['disk_evictions'] += 1
+            for file_path in self._disk_paths(key):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+
+    def _read_disk(self, path: str) -> Optional[_CachedImage]:
+        key = self._key(path)
+        with self._lock:
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(data_path, 'rb') as f:
+                data = f.read()
+        except (OSError, ValueError):
+            with self._lock:
+                self._disk_total -= self._disk.pop(key, 0)
+            return None
+
+        # The data is served from memory: the file can be evicted while the entry is still in use
+        return _CachedImage(ImageInfo(**meta['info']), data, meta['validated_at'])
+
+    def _write_disk(self, path: str, entry: _CachedImage):
+        if len(entry.data) > self.disk_bytes:
+            return
+        key = self._key(path)
+        data_path, meta_path = self._disk_paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        suffix = f".{threading.get_ident()}.tmp"
+
+        with open(data_path + suffix, 'wb') as f:
+            f.write(entry.data)
+        os.replace(data_path + suffix, data_path)
+        self._write_disk_meta(path, entry)
+
+        with self._lock:
+            self._disk_total += len(entry.data) - self._disk.pop(key, 0)
+            self._disk[key] = len(entry.data)
+            self._evict_disk()
+
+    def _write_disk_meta(self, path: str, entry: _CachedImage):
+        _, meta_path = self._disk_paths(self._key(path))
+        suffix = f".{threading.get_ident()}.tmp"
+        meta = {'path': path, 'info': asdict(replace(entry.info, local_path=None)), 'validated_at': entry.validated_at}
+        with open(meta_path + suffix, 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+
+    # Memory tier
+
+    def _remember(self, path: str, entry: _CachedImage):
+        if len(entry.data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(path, None)
+            if previous:
+                self._memory_total -= len(previous.data)
+            self._memory[path] = entry
+            self._memory_total += len(entry.data)
+            while self._memory_total > self.memory_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_total -= len(evicted.data)
+                self.counters['memory_evictions'] += 1
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    @contextmanager
+    def _path_lock(self, path: str):
+        """Hold the path's lock; it is dropped once no thread is using it"""
+        with self._lock:
+            holder = self._path_locks.setdefault(path, [threading.Lock(), 0])
+            holder[1] += 1
+        try:
+            with holder[0]:
+                yield
+        finally:
+            with self._lock:
+                holder[1] -= 1
+                if not holder[1]:
+                    del self._path_locks[path]
+
+    def _entry(self, path: str) -> _CachedImage:
+        """Return a validated cache entry for the image, fetching or revalidating it as needed"""
+        with self._lock:
+            entry = self._memory.get(path)
+            if entry:
+                self._memory.move_to_end(path)
+        tier = 'memory_hits'
+        if entry is None:
+            entry = self._read_disk(path)
+            tier = 'disk_hits'
+            if entry:
+                self._remember(path, entry)
+
+        if entry and time.time() - entry.validated_at < self.revalidate_after:
+            self._count(tier)
+            return entry
+
+        # Only one thread downloads or revalidates a given image at a time
+        with self._path_lock(path):
+            with self._lock:
+                current = self._memory.get(path)
+            if current and time.time() - current.validated_at < self.revalidate_after:
+                self._count(tier)
+                return current
+
+            if entry:
+                self._count('revalidations')
+                stream = self.backend.open_image(path, if_none_match=entry.info.etag)
+                if stream.not_modified or stream.info.etag == entry.info.etag:
+                    stream.close()
+                    self._count('not_modified')
+                    entry = replace(entry, validated_at=time.time())
+                    self._remember(path, entry)
+                    with self._lock:
+                        on_disk = self._key(path) in self._disk
+                    if on_disk:
+                        self._write_disk_meta(path, entry)
+                    return entry
+            else:
+                self._count('misses')
+                stream = self.backend.open_image(path)
+
+            try:
+                data = b''.join(stream.chunks)
+            finally:
+                stream.close()
+            entry = _CachedImage(replace(stream.info, local_path=None), data, time.time())
+            self._remember(path, entry)
+            self._write_disk(path, entry)
+            return entry
+
+    # ImageStorage interface
+
+    def get_image(self, path: str) -> tuple[BinaryIO, str]:
+        entry = self._entry(path)
+        return BytesIO(entry.data), entry.info.content_type
+
+    def stat(self, path: str) -> ImageInfo:
+        return self._entry(path).info
+
+    def iter_image(self, path: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        data = self._entry(path).data
+        end = len(data) if length is None else min(len(data), start + length)
+        return self._chunks(data, start, end, chunk_size)
+
+    def open_image(self, path: str, byte_range: ByteRange = None, if_none_match: str = None) -> ImageStream:
+        entry = self._entry(path)
+        if byte_range is None:
+            return ImageStream(entry.info, self._chunks(entry.data, 0, len(entry.data)))
+        start, end = resolve_range(byte_range, entry.info.size)
+        return ImageStream(entry.info, self._chunks(entry.data, start, end + 1), byte_range=(start, end))
+
+    @staticmethod
+    def _chunks(data: bytes, start: int, end: int, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        view = memoryview(data)
+        for offset in range(start, end, chunk_size):
+            yield bytes(view[offset:min(offset + chunk_size, end)])
+
+    @property
+    def signed_urls(self) -> bool:
+        return self.backend.signed_urls
+
+    def get_image_url(self, path: str) -> Optional[str]:
+        return self.backend.get_image_url(path)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters plus the current size of each tier"""
+        with self._lock:
+            return {
+                **self.counters,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_total,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_total,
+            }
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import logging
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import List, Optional
+
+from fastapi import Request, Response
+from PIL import Image, ImageOps
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+
+from backend.image_responses import image_response
+from image_storage import ImageInfo, ImageStorage, LocalImageStorage
+
+logger = logging.getLogger(__name__)
+
+# Output formats we can encode: fmt parameter -> (Pillow format, file extension)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+    'jpg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+}
+MAX_DIMENSION = 4096
+# Source validators remembered between revalidations
+MAX_SOURCE_INFOS = 10_000
+# A file being sent is kept at least this long, even if its response never reports back
+HOLD_SECONDS = 60
+
+
+def contact_sheet_columns(tiles: int) -> int:
+    """Columns of a roughly square contact sheet with the given number of tiles"""
+    return max(1, math.ceil(math.sqrt(tiles)))
+
+
+class DerivativeCache:
+    """
+    Resized / re-encoded copies of stored images, generated on demand.
+
+    Derivatives are rendered once in a thread pool (Pillow releases the GIL while
+    decoding, resizing and encoding) and kept on disk under a key built from the
+    source path, its mtime and ETag, and the requested parameters, so a changed
+    source never serves an old derivative. The source's validators are
+    remembered for revalidate_after seconds, so repeat requests within that
+    window need no round trip to the storage. The cache is bounded by total
+    bytes and evicts the least recently used files first, skipping files that
+    are being sent; file access times carry the LRU order across restarts.
+    """
+
+    def __init__(self, source: ImageStorage, cache_dir: str, max_bytes: int, workers: int = None,
+                 revalidate_after: float = 30):
+        self.source = source
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        self.storage = LocalImageStorage(cache_dir)
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix="derivatives")
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # relative path -> size, least recently used first
+        self._total_bytes = 0
+        self._pending = {}
+        self._held = {}  # relative path -> [responses sending it, hold expiry]
+        self._sources = OrderedDict()  # source path -> (ImageInfo, validated at)
+        self._load_entries()
+
+    def _load_entries(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                full_path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    os.remove(full_path)
+                    continue
+                stat = os.stat(full_path)
+                files.append((stat.st_atime, os.path.relpath(full_path, self.cache_dir), stat.st_size))
+
+        for _, rel_path, size in sorted(files):
+            self._entries[rel_path] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        excess = self._total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        now = time.monotonic()
+        victims = []
+        for rel_path, size in self._entries.items():
+            if excess <= 0:
+                break
+            held = self._held.get(rel_path)
+            if held and held[1] > now:
+                continue  # still being sent; a later eviction takes it
+            victims.append(rel_path)
+            excess -= size
+        for rel_path in victims:
+            self._total_bytes -= self._entries.pop(rel_path)
+            self._held.pop(rel_path, None)
+            try:
+                os.remove(os.path.join(self.cache_dir, rel_path))
+            except FileNotFoundError:
+                pass
+
+    def _hold(self, rel_path: str):
+        with self._lock:
+            held = self._held.setdefault(rel_path, [0, 0.0])
+            held[0] += 1
+            held[1] = time.monotonic() + HOLD_SECONDS
+
+    def _release(self, rel_path: str):
+        with self._lock:
+            held = self._held.get(rel_path)
+            if held:
+                held[0] -= 1
+                if held[0] <= 0:
+                    del self._held[rel_path]
+
+    def _touch(self, rel_path: str) -> bool:
+        with self._lock:
+            if rel_path not in self._entries:
+                return False
+            self._entries.move_to_end(rel_path)
+        try:
+            # Record the use in atime only; mtime feeds the ETag and must stay put
+            full_path = os.path.join(self.cache_dir, rel_path)
+            os.utime(full_path, ns=(time.time_ns(), os.stat(full_path).st_mtime_ns))
+        except FileNotFoundError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(rel_path, 0)
+            return False
+        return True
+
+    def _open_source(self, path: str, info: ImageInfo = None) -> Image.Image:
+        if info is None:
+            stream = self.source.open_image(path)
+            info = stream.info
+            if info.local_path:
+                stream.close()
+            else:
+                try:
+                    return Image.open(BytesIO(b''.join(stream.chunks)))
+                finally:
+                    stream.close()
+        if info.local_path:
+            try:
+                return Image.open(info.local_path)
+            except FileNotFoundError:
+                pass  # e.g. a cache file evicted since the source was validated; read it through the storage
+        return Image.open(BytesIO(b''.join(self.source.iter_image(path))))
+
+    @staticmethod
+    def _shrink(image: Image.Image, target) -> Image.Image:
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft('RGB', target)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(target, Image.Resampling.LANCZOS)
+        return image
+
+    def _save(self, image: Image.Image, rel_path: str, fmt: str, quality: int):
+        pil_format, _ = DERIVATIVE_FORMATS[fmt]
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        full_path = os.path.join(self.cache_dir, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = f"{full_path}.{threading.get_ident()}.tmp"
+        image.save(tmp_path, pil_format, quality=quality, optimize=True)
+        os.replace(tmp_path, full_path)
+
+        size = os.path.getsize(full_path)
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(rel_path, 0)
+            self._entries[rel_path] = size
+            self._evict()
+
+    def _render(self, path: str, info: ImageInfo, rel_path: str, width: Optional[int], height: Optional[int],
+                fmt: str, quality: int):
+        with self._open_source(path, info) as image:
+            image = self._shrink(image, (width or MAX_DIMENSION, height or MAX_DIMENSION))
+            self._save(image, rel_path, fmt, quality)
+
+    def _render_contact_sheet(self, paths: List[str], rel_path: str, tile: int, columns: int, fmt: str, quality: int):
+        rows = (len(paths) + columns - 1) // columns
+        mode = 'RGBA' if DERIVATIVE_FORMATS[fmt][0] != 'JPEG' else 'RGB'
+        sheet = Image.new(mode, (columns * tile, rows * tile), (255, 255, 255, 0) if mode == 'RGBA' else 'white')
+        for index, path in enumerate(paths):
+            try:
+                with self._open_source(path) as image:
+                    image = self._shrink(image, (tile, tile)).convert(mode)
+            except Exception as e:
+                # A missing or unreadable picture leaves an empty tile rather than failing the sheet
+                logger.warning(f"Skipping {path} in contact sheet: {str(e)}")
+                continue
+            row, column = divmod(index, columns)
+            sheet.paste(image, (column * tile + (tile - image.width) // 2, row * tile + (tile - image.height) // 2))
+        self._save(sheet, rel_path, fmt, quality)
+
+    async def _render_once(self, rel_path: str, render, *args):
+        """Run render in the pool unless the file is cached; concurrent requests share one render"""
+        if self._touch(rel_path):
+            return
+        pending = self._pending.get(rel_path)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(self._executor, render, *args)
+            self._pending[rel_path] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(rel_path, None))
+        await asyncio.shield(pending)
+
+    async def _source_info(self, path: str) -> ImageInfo:
+        """The source's validators, fetched again once they are older than revalidate_after"""
+        with self._lock:
+            cached = self._sources.get(path)
+            if cached and time.monotonic() - cached[1] < self.revalidate_after:
+                self._sources.move_to_end(path)
+                return cached[0]
+        validated_at = time.monotonic()
+        info = await run_in_threadpool(self.source.stat, path)
+        with self._lock:
+            self._sources[path] = (info, validated_at)
+            self._sources.move_to_end(path)
+            while len(self._sources) > MAX_SOURCE_INFOS:
+                self._sources.popitem(last=False)
+        return info
+
+    async def _derivative(self, path: str, width: Optional[int], height: Optional[int], fmt: str, quality: int):
+        info = await self._source_info(path)
+        key = hashlib.sha1(
+            f"{path}|{info.mtime}|{info.etag}|{width}|{height}|{fmt}|{quality}".encode()
+        ).hexdigest()
+        rel_path = os.path.join(key[:2], f"{key}.{DERIVATIVE_FORMATS[fmt][1]}")
+        return rel_path, (self._render, path, info, rel_path, width, height, fmt, quality)
+
+    def _contact_sheet(self, paths: List[str], tile: int, columns: Optional[int], fmt: str, quality: int):
+        # Stored pictures are never rewritten in place, so the sheet is keyed on the
+        # list of paths alone and no source needs to be fetched on a cache hit
+        columns = columns or contact_sheet_columns(len(paths))
+        listing = '\n'.join(paths)
+        key = hashlib.sha1(f"sheet|{tile}|{columns}|{fmt}|{quality}|{listing}".encode()).hexdigest()
+        rel_path = os.path.join(key[:2], f"{key}.{DERIVATIVE_FORMATS[fmt][1]}")
+        return rel_path, (self._render_contact_sheet, paths, rel_path, tile, columns, fmt, quality)
+
+    async def _respond(self, request: Request, rel_path: str, job) -> Response:
+        """Render if needed and build the response, holding the file on disk until it has been sent"""
+        self._hold(rel_path)
+        try:
+            await self._render_once(rel_path, *job)
+            response = await image_response(request, self.storage, rel_path)
+        except BaseException:
+            self._release(rel_path)
+            raise
+        release = BackgroundTask(self._release, rel_path)
+        response.background = BackgroundTasks([response.background, release]) if response.background else release
+        return response
+
+    async def get(self, path: str, width: int = None, height: int = None, fmt: str = 'webp', quality: int = 80) -> str:
+        """
+        Return the derivative's path relative to the cache directory, rendering it if needed.
+
+        Raises FileNotFoundError if the source image does not exist.
+        """
+        rel_path, job = await self._derivative(path, width, height, fmt, quality)
+        await self._render_once(rel_path, *job)
+        return rel_path
+
+    async def response(self, request: Request, path: str, width: int = None, height: int = None, fmt: str = 'webp',
+                       quality: int = 80) -> Response:
+        """image_response() for a derivative, which cannot be evicted before it has been sent"""
+        rel_path, job = await self._derivative(path, width, height, fmt, quality)
+        return await self._respond(request, rel_path, job)
+
+    async def get_contact_sheet(self, paths: List[str], tile: int = 96, columns: int = None, fmt: str = 'webp',
+                                quality: int = 75) -> str:
+        """Return the path of a sprite with one tile x tile cell per image, left to right, top to bottom"""
+        rel_path, job = self._contact_sheet(paths, tile, columns, fmt, quality)
+        await self._render_once(rel_path, *job)
+        return rel_path
+
+    async def contact_sheet_response(self, request: Request, paths: List[str], tile: int = 96, columns: int = None,
+                                     fmt: str = 'webp', quality: int = 75) -> Response:
+        """image_response() for a contact sheet, held like response()"""
+        rel_path, job = self._contact_sheet(paths, tile, columns, fmt, quality)
+        return await self._respond(request, rel_path, job)
+
+
+def get_derivative_cache(source: ImageStorage) -> DerivativeCache:
+    """Factory function to create the derivative cache configured by the environment"""
+    return DerivativeCache(
+        source,
+        cache_dir=os.getenv('IMAGE_CACHE_DIR', 'data/image_cache'),
+        max_bytes=int(os.getenv('IMAGE_CACHE_MAX_BYTES', 1024 ** 3)),
+        revalidate_after=float(os.getenv('IMAGE_DERIVATIVE_REVALIDATE_SECONDS', 30)),
+    )
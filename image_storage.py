@@ -1,11 +1,22 @@
 from google.cloud import storage
 from abc import ABC, abstractmethod
-from typing import Union, BinaryIO
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Union, BinaryIO, Callable, Dict, Iterator, Optional, Tuple
+from urllib.parse import quote
+import asyncio
+import hashlib
 import os
+import threading
+import time
 from io import BytesIO
 import pandas as pd
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2 import service_account
 from google.api_core import exceptions as google_exceptions
+from requests.adapters import HTTPAdapter
 import logging
 from data_processing.utils import generate_full_image_path
 
@@ -14,37 +25,178 @@ pd.set_option('future.no_silent_downcasting', True)
 
 logger = logging.getLogger(__name__)
 
+# Size of the chunks images are streamed in
+CHUNK_SIZE = 256 * 1024
+
+def guess_content_type(path: str) -> str:
+    content_type = "image/jpeg"  # Default
+    if path.lower().endswith('.png'):
+        content_type = "image/png"
+    elif path.lower().endswith('.gif'):
+        content_type = "image/gif"
+    elif path.lower().endswith('.webp'):
+        content_type = "image/webp"
+    return content_type
+
+@dataclass
+class ImageInfo:
+    """Metadata needed to serve an image: size and validators for conditional requests"""
+    size: int
+    mtime: Optional[float]
+    etag: str
+    content_type: str
+    local_path: Optional[str] = None
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size: int = None):
+        super().__init__(f"Requested range not satisfiable (size {size})")
+        self.size = size
+
+# A requested byte range: (start, end) with an inclusive end, (start, None) for
+# "to the end", or (None, n) for the last n bytes
+ByteRange = Tuple[Optional[int], Optional[int]]
+
+def resolve_range(byte_range: ByteRange, size: int) -> Tuple[int, int]:
+    """Turn a requested range into an inclusive (start, end) pair within an image of the given size"""
+    start, end = byte_range
+    if start is None:
+        start, end = max(size - end, 0), size - 1
+    else:
+        end = size - 1 if end is None else min(end, size - 1)
+    if start > end or start >= size:
+        raise RangeNotSatisfiable(size)
+    return start, end
+
+@dataclass
+class ImageStream:
+    """An opened image: its metadata and a lazy iterator over the requested bytes"""
+    info: ImageInfo
+    chunks: Iterator[bytes] = ()
+    byte_range: Optional[Tuple[int, int]] = None
+    not_modified: bool = False
+    on_close: Optional[Callable[[], None]] = None
+
+    def close(self):
+        if self.on_close:
+            self.on_close()
+            self.on_close = None
+
 class ImageStorage(ABC):
     @abstractmethod
     def get_image(self, path: str) -> tuple[BinaryIO, str]:
         """Returns tuple of (image_data, content_type)"""
         pass
 
+    @abstractmethod
+    def stat(self, path: str) -> ImageInfo:
+        """Returns the image metadata, raising FileNotFoundError if it does not exist"""
+        pass
+
+    def iter_image(self, path: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yields the image bytes from start, up to length bytes, in chunks"""
+        image_data, _ = self.get_image(path)
+        with image_data:
+            image_data.seek(start)
+            remaining = length
+            while remaining is None or remaining > 0:
+                chunk = image_data.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def open_image(self, path: str, byte_range: ByteRange = None, if_none_match: str = None) -> ImageStream:
+        """
+        Open an image for streaming, optionally restricted to a byte range.
+
+        Backends that can evaluate If-None-Match themselves may answer with a
+        not_modified stream; otherwise the caller compares validators. The body
+        is read lazily, so a stream that is never iterated costs nothing.
+        """
+        info = self.stat(path)
+        if byte_range is None:
+            return ImageStream(info, self.iter_image(path))
+        start, end = resolve_range(byte_range, info.size)
+        return ImageStream(info, self.iter_image(path, start, end - start + 1), byte_range=(start, end))
+
+    async def open_image_async(self, path: str, byte_range: ByteRange = None, if_none_match: str = None) -> ImageStream:
+        """open_image() run in a worker thread, so network-backed storage never blocks the event loop"""
+        return await asyncio.to_thread(self.open_image, path, byte_range, if_none_match)
+
+    # True when get_image_url() hands out URLs that expire
+    signed_urls = False
+
+    def get_image_url(self, path: str) -> Optional[str]:
+        """A URL clients can fetch the image from directly, or None if it must be served through us"""
+        return None
+
 class LocalImageStorage(ImageStorage):
     def __init__(self, base_dir: str):
         self.base_dir = base_dir
+
+    def _full_path(self, path: str) -> str:
+        base_dir = os.path.abspath(self.base_dir)
+        full_path = os.path.abspath(os.path.join(base_dir, path))
+        if os.path.commonpath([base_dir, full_path]) != base_dir or not os.path.isfile(full_path):
+            raise FileNotFoundError(f"Image not found: {full_path}")
+        return full_path
     
     def get_image(self, path: str) -> tuple[BinaryIO, str]:
-        full_path = os.path.join(self.base_dir, path)
-        if not os.path.isfile(full_path):
-            raise FileNotFoundError(f"Image not found: {full_path}")
-        
-        content_type = "image/jpeg"  # Default
-        if path.lower().endswith('.png'):
-            content_type = "image/png"
-        elif path.lower().endswith('.gif'):
-            content_type = "image/gif"
-            
-        return open(full_path, 'rb'), content_type
+        full_path = self._full_path(path)
+        return open(full_path, 'rb'), guess_content_type(path)
+
+    def stat(self, path: str) -> ImageInfo:
+        full_path = self._full_path(path)
+        stat = os.stat(full_path)
+        return ImageInfo(
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            content_type=guess_content_type(path),
+            local_path=full_path,
+        )
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
 
 class GCSImageStorage(ImageStorage):
-    def __init__(self, bucket_name: str, base_path: str, local_fallback_path: str = None):
+    """
+    Images in a Google Cloud Storage bucket, read through the JSON API.
+
+    Downloads go through one pooled, authorized HTTP session and take a single
+    streamed GET: conditional requests are passed on as ifGenerationNotMatch and
+    byte ranges as a Range header. Set STORAGE_EMULATOR_HOST to point it at a
+    local fake GCS server.
+
+    With signed URLs enabled (GCS_SIGNED_URLS=true) get_image_url() hands out
+    short-lived V4 signed URLs so clients download straight from the bucket.
+    Signing is done locally with the service-account key (GCS_SIGNING_KEY_FILE,
+    gcs_key2.json by default), and each URL is reused until shortly before it
+    expires.
+    """
+
+    def __init__(self, bucket_name: str, base_path: str, local_fallback_path: str = None,
+                 pool_size: int = None, timeout: float = None, signed_url_ttl: int = None):
         try:
-            # Initialize client
-            credentials = service_account.Credentials.from_service_account_file(
-                'gcs_key2.json'
-            )
-            self.client = storage.Client(credentials=credentials)
+            emulator_host = os.getenv('STORAGE_EMULATOR_HOST')
+            if emulator_host:
+                if '://' not in emulator_host:
+                    emulator_host = f"http://{emulator_host}"
+                self.endpoint = emulator_host.rstrip('/')
+                credentials = AnonymousCredentials()
+                self.client = storage.Client(credentials=credentials, project='emulator',
+                                             client_options={'api_endpoint': self.endpoint})
+            else:
+                self.endpoint = 'https://storage.googleapis.com'
+                # Initialize client
+                credentials = service_account.Credentials.from_service_account_file(
+                    'gcs_key2.json'
+                )
+                self.client = storage.Client(credentials=credentials)
             
             # Check if bucket exists
             try:
@@ -60,7 +212,31 @@ class GCSImageStorage(ImageStorage):
             except google_exceptions.Forbidden:
                 raise ValueError(f"No access to bucket {bucket_name}. Check permissions!")
             
-            self.base_path = base_path
+            self.bucket_name = bucket_name
+            self.base_path = base_path or ''
+            self.credentials = credentials
+            self.timeout = timeout or float(os.getenv('GCS_TIMEOUT', 30))
+
+            # One keep-alive connection pool shared by every download
+            pool_size = pool_size or int(os.getenv('GCS_POOL_SIZE', 32))
+            self.session = AuthorizedSession(credentials)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+
+            self.signing_credentials = None
+            if signed_url_ttl is None and os.getenv('GCS_SIGNED_URLS', '').lower() == 'true':
+                signed_url_ttl = int(os.getenv('GCS_SIGNED_URL_TTL', 900))
+            if signed_url_ttl:
+                self.signing_credentials = (
+                    credentials if isinstance(credentials, service_account.Credentials)
+                    else service_account.Credentials.from_service_account_file(
+                        os.getenv('GCS_SIGNING_KEY_FILE', 'gcs_key2.json'))
+                )
+            self.signed_url_ttl = signed_url_ttl
+            self.signed_urls = bool(self.signing_credentials)
+            self._signed_urls = {}  # path -> (url, expires_at)
+            self._signed_urls_lock = threading.Lock()
             self.use_gcs = True
             
         except Exception as e:
@@ -71,54 +247,293 @@ class GCSImageStorage(ImageStorage):
                 self.use_gcs = False
             else:
                 raise
+
+    def _object_name(self, path: str) -> str:
+        return os.path.join(self.base_path, path)
+
+    def _object_url(self, path: str) -> str:
+        return f"{self.endpoint}/storage/v1/b/{self.bucket_name}/o/{quote(self._object_name(path), safe='')}"
+
+    def get_image_url(self, path: str) -> Optional[str]:
+        if not self.use_gcs or not self.signing_credentials:
+            return None
+
+        # Reuse a signed URL until it is within a fifth of its lifetime (at most a minute) of expiring
+        now = time.time()
+        margin = min(60, self.signed_url_ttl / 5)
+        with self._signed_urls_lock:
+            cached = self._signed_urls.get(path)
+        if cached and cached[1] - margin > now:
+            return cached[0]
+
+        url = self.bucket.blob(self._object_name(path)).generate_signed_url(
+            version='v4',
+            expiration=timedelta(seconds=self.signed_url_ttl),
+            method='GET',
+            credentials=self.signing_credentials,
+            api_access_endpoint=self.endpoint,
+        )
+        with self._signed_urls_lock:
+            # Drop expired URLs now and then so the dict does not grow without bound
+            if len(self._signed_urls) > 10000:
+                self._signed_urls = {p: v for p, v in self._signed_urls.items() if v[1] - margin > now}
+            self._signed_urls[path] = (url, now + self.signed_url_ttl)
+        return url
     
     def get_image(self, path: str) -> tuple[BinaryIO, str]:
-        blob = self.bucket.blob(os.path.join(self.base_path, path))
-        if not blob.exists():
+        if not self.use_gcs:
+            return self.local_storage.get_image(path)
+
+        stream = self.open_image(path)
+        try:
+            return BytesIO(b''.join(stream.chunks)), stream.info.content_type
+        finally:
+            stream.close()
+
+    def stat(self, path: str) -> ImageInfo:
+        if not self.use_gcs:
+            return self.local_storage.stat(path)
+
+        response = self.session.get(self._object_url(path), params={'fields': 'size,updated,generation'},
+                                    timeout=self.timeout)
+        if response.status_code == 404:
+            raise FileNotFoundError(f"Image not found in GCS: {path}")
+        response.raise_for_status()
+        metadata = response.json()
+
+        return ImageInfo(
+            size=int(metadata['size']),
+            mtime=datetime.fromisoformat(metadata['updated'].replace('Z', '+00:00')).timestamp(),
+            etag=f'"{metadata["generation"]}"',
+            content_type=guess_content_type(path),
+        )
+
+    def iter_image(self, path: str, start: int = 0, length: int = None, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        if not self.use_gcs:
+            yield from self.local_storage.iter_image(path, start, length, chunk_size)
+            return
+
+        byte_range = None
+        if start or length is not None:
+            byte_range = (start, None if length is None else start + length - 1)
+        stream = self.open_image(path, byte_range)
+        try:
+            yield from stream.chunks
+        finally:
+            stream.close()
+
+    def open_image(self, path: str, byte_range: ByteRange = None, if_none_match: str = None) -> ImageStream:
+        if not self.use_gcs:
+            return self.local_storage.open_image(path, byte_range, if_none_match)
+
+        params = {'alt': 'media'}
+        headers = {}
+        # Our ETags are quoted generations, so a single one can be checked by GCS itself
+        etag = (if_none_match or '').strip().removeprefix('W/').strip('"')
+        if etag.isdigit():
+            params['ifGenerationNotMatch'] = etag
+        if byte_range is not None:
+            start, end = byte_range
+            headers['Range'] = f"bytes=-{end}" if start is None else f"bytes={start}-{'' if end is None else end}"
+
+        response = self.session.get(self._object_url(path), params=params, headers=headers,
+                                    stream=True, timeout=self.timeout)
+        content_type = guess_content_type(path)
+        last_modified = _http_date(response.headers.get('Last-Modified'))
+
+        if response.status_code == 304:
+            response.close()
+            info = ImageInfo(size=0, mtime=last_modified, etag=f'"{etag}"', content_type=content_type)
+            return ImageStream(info, not_modified=True)
+        if response.status_code == 404:
+            response.close()
             raise FileNotFoundError(f"Image not found in GCS: {path}")
-        
-        content_type = "image/jpeg"  # Default
-        if path.lower().endswith('.png'):
-            content_type = "image/png"
-        elif path.lower().endswith('.gif'):
-            content_type = "image/gif"
-        
-        return BytesIO(blob.download_as_bytes()), content_type
+        if response.status_code == 416:
+            response.close()
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            raise RangeNotSatisfiable(int(total) if total.isdigit() else None)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+
+        served_range = None
+        if response.status_code == 206:
+            # Content-Range: bytes start-end/size
+            span, _, total = response.headers['Content-Range'].removeprefix('bytes ').partition('/')
+            first, _, last = span.partition('-')
+            served_range = (int(first), int(last))
+            size = int(total)
+        else:
+            size = int(response.headers['Content-Length'])
+
+        generation = response.headers.get('x-goog-generation')
+        info = ImageInfo(
+            size=size,
+            mtime=last_modified,
+            etag=f'"{generation}"' if generation else response.headers.get('ETag', ''),
+            content_type=content_type,
+        )
+        return ImageStream(info, response.iter_content(CHUNK_SIZE), byte_range=served_range, on_close=response.close)
 
 def get_image_storage():
     """Factory function to create the appropriate image storage instance"""
     if os.getenv('USE_GCS', '').lower() == 'true':
-        return GCSImageStorage(os.getenv('GCS_BUCKET_NAME'), os.getenv('GCS_BASE_PATH'))
+        gcs_storage = GCSImageStorage(os.getenv('GCS_BUCKET_NAME'), os.getenv('GCS_BASE_PATH'))
+        if os.getenv('IMAGE_STORAGE_CACHE', 'true').lower() != 'true':
+            return gcs_storage
+
+        # Keep downloaded images in memory and on local disk so repeat views skip the bucket
+        from image_cache import CachedImageStorage
+        return CachedImageStorage(
+            gcs_storage,
+            memory_bytes=int(os.getenv('IMAGE_MEMORY_CACHE_BYTES', 256 * 1024 ** 2)),
+            disk_dir=os.getenv('IMAGE_DISK_CACHE_DIR', 'data/image_store_cache'),
+            disk_bytes=int(os.getenv('IMAGE_DISK_CACHE_BYTES', 5 * 1024 ** 3)),
+            revalidate_after=float(os.getenv('IMAGE_CACHE_REVALIDATE_SECONDS', 3600)),
+        )
     else:
         return LocalImageStorage(os.getenv('LOCAL_BASE_PATH'))
     
+def _group_by_date(pictures: list) -> list:
+    """[{'date': ..., 'file_paths': [...]}, ...] in date order"""
+    by_date = {}
+    for picture in pictures:
+        by_date.setdefault(picture['date'], []).append(picture['file_path'])
+    return [{'date': date, 'file_paths': by_date[date]} for date in sorted(by_date, key=str)]
+
+@dataclass(frozen=True)
+class PictureSnapshot:
+    """One parse of the image CSV with the views built from it; never modified once published"""
+    digest: Optional[str]
+    images: Dict[int, list]
+    counts: Dict[int, int]
+    by_date: Dict[int, list]
+
+
+class PictureIndex:
+    """
+    Cached ear_tag -> pictures index built from the image CSV.
+
+    The CSV is only re-parsed when its content changes: a cheap mtime/size check
+    runs on every access, and a content hash confirms the change before the
+    index is rebuilt, so touching or re-saving an identical file is free. Each
+    rebuild publishes a new PictureSnapshot in a single assignment, so readers
+    that take the snapshot never see images, counts and dates from different
+    versions of the file.
+    """
+
+    def __init__(self, image_csv_path: str):
+        self.image_csv_path = image_csv_path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._snapshot = PictureSnapshot(None, {}, {}, {})
+
+    def _file_stamp(self):
+        stat = os.stat(self.image_csv_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _file_digest(self):
+        digest = hashlib.sha1()
+        with open(self.image_csv_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _parse(self):
+        wanted = {'ear_tag', 'date', 'corrupt', 'new_file_path'}
+        df = pd.read_csv(self.image_csv_path, dtype={'ear_tag': 'Int64'}, usecols=lambda c: c in wanted)
+
+        # Drop rows with missing ear_tags, corrupt images and images without a valid new_file_path
+        corrupt_series = df.get('corrupt', pd.Series(False, index=df.index))
+        df = df[
+            df['ear_tag'].notna() &
+            ~corrupt_series.fillna(False).astype(bool) &
+            df['new_file_path'].notna()
+        ].sort_values('ear_tag', kind='stable')
+
+        # Create list of dicts with only file_path and date for each mouse
+        images = {}
+        for ear_tag, file_path, date in zip(df['ear_tag'].tolist(), df['new_file_path'].tolist(), df['date'].tolist()):
+            images.setdefault(int(ear_tag), []).append({'file_path': file_path, 'date': date})
+        return images
+
+    def refresh(self) -> bool:
+        """Re-parse the CSV if its content changed. Returns True if the index was rebuilt"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return False
+
+            digest = self._file_digest()
+            if digest == self._snapshot.digest:
+                self._stamp = stamp
+                return False
+
+            # The stamp is only recorded once the file parsed, so a failed parse is retried
+            images = self._parse()
+            self._snapshot = PictureSnapshot(
+                digest=digest,
+                images=images,
+                counts={ear_tag: len(pictures) for ear_tag, pictures in images.items()},
+                by_date={ear_tag: _group_by_date(pictures) for ear_tag, pictures in images.items()},
+            )
+            self._stamp = stamp
+            logger.info(f"Picture index rebuilt from {self.image_csv_path}: {len(images)} mice")
+            return True
+
+    def read_frame(self) -> pd.DataFrame:
+        """The whole CSV, every row and column, for tools that edit it"""
+        return pd.read_csv(self.image_csv_path, dtype={'ear_tag': 'Int64'})
+
+    def write_frame(self, df: pd.DataFrame):
+        """Replace the CSV with df and rebuild the index from it"""
+        # Written beside the CSV and renamed over it, so readers never parse a half-written file
+        tmp_path = f"{self.image_csv_path}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.image_csv_path)
+        self.refresh()
+
+    @property
+    def snapshot(self) -> PictureSnapshot:
+        """The current snapshot; read several views from one snapshot to keep them consistent"""
+        return self._snapshot
+
+    @property
+    def images(self) -> Dict[int, list]:
+        return self._snapshot.images
+
+    @property
+    def counts(self) -> Dict[int, int]:
+        return self._snapshot.counts
+
+    @property
+    def by_date(self) -> Dict[int, list]:
+        return self._snapshot.by_date
+
+    @property
+    def digest(self) -> str:
+        self.refresh()
+        return self._snapshot.digest
+
+
+_picture_indexes = {}
+_picture_indexes_lock = threading.Lock()
+
+def get_picture_index(image_csv_path='data/image_results.csv') -> PictureIndex:
+    """Return the shared, up-to-date picture index for a CSV file"""
+    key = os.path.abspath(image_csv_path)
+    with _picture_indexes_lock:
+        index = _picture_indexes.get(key)
+        if index is None:
+            index = _picture_indexes[key] = PictureIndex(image_csv_path)
+    index.refresh()
+    return index
+
 def load_mouse_images(image_csv_path='data/image_results.csv'):
-    """Load and process mouse images from CSV"""
-    # Read the CSV file with ear_tag as nullable integer type
-    df = pd.read_csv(image_csv_path, dtype={'ear_tag': 'Int64'})
-    
-    # Drop rows with missing ear_tags and corrupt images
-    corrupt_series = df.get('corrupt', pd.Series(False, index=df.index))
-    df = df[
-        df['ear_tag'].notna() & 
-        ~corrupt_series.fillna(False)
-    ]
-    
-    # Group by ear_tag and create a dictionary of images for each mouse
-    result = {}
-    for ear_tag, group in df.groupby('ear_tag'):
-        if pd.isna(ear_tag):
-            continue
-            
-        # Only include rows that have a valid new_file_path
-        valid_images = group[group['new_file_path'].notna()]
-        if not valid_images.empty:
-            # Create list of dicts with only file_path and date
-            images = [{'file_path': row['new_file_path'], 'date': row['date']} 
-                     for _, row in valid_images.iterrows()]
-            result[int(ear_tag)] = images
-    
-    return result
+    """Return the cached mapping of ear_tag to image dicts; treat it as read-only"""
+    return get_picture_index(image_csv_path).images
 
 def get_images_for_mouse(ear_tag, mouse_images):
     """Get list of image paths for a specific mouse"""
@@ -1,9 +1,24 @@
+import asyncio
 import json
-from datetime import date
+import os
 import sqlite3
+import time
 import pandas as pd
 from data_processing.data_functions import get_survival_data
-from backend.llm import get_llm_response
+from backend.llm import LLM_MODEL, get_llm_response, get_llm_response_async, llm_client
+from backend.translation_cache import translation_cache
+from backend.prompt_builder import prompt_builder
+from backend.file_stamps import database_version
+from backend.result_cache import result_cache
+from backend.sql_guard import get_guard
+from backend.sql_engine import get_engine
+from backend.result_format import frame_to_columnar, frame_to_records
+
+DATABASE_PATH = "data/mouse_study.db"
+
+def build_prompt(question):
+    """System prompt for one question, showing only the tables and examples relevant to it"""
+    return prompt_builder.build(question)
 
 
 def clean_response(response):
@@ -11,9 +26,16 @@ def clean_response(response):
     return response
 
 def read_sql_query(sql, db):
-    conn = sqlite3.connect(db)
-    df = pd.read_sql_query(sql, conn)
-    conn.close()
+    # Results are reused until the database file changes
+    version = database_version(db)
+    df = result_cache.get(db, sql, version)
+    if df is not None:
+        return df
+
+    # Generated SQL is checked and costed first, then runs read-only under a time budget and a row cap
+    df, truncated = get_guard(db).run(sql)
+    df.attrs['truncated'] = truncated
+    result_cache.put(db, sql, version, df)
     return df
 
 def determine_chart_type(df):
@@ -26,22 +48,23 @@ def determine_chart_type(df):
         return 'line'
     return None
 
-def call_llm_and_get_results(question):
-    # Read prompt from file
-    with open("prompt.txt", "r") as f:
-        prompt = f.read()
-    
-    # Get LLM response
-    response = get_llm_response(question, prompt)
-    response = clean_response(response)
+def parse_translation(response):
+    """(sql, requested chart type or None) from a cleaned LLM response"""
     response_json = json.loads(response)
-    
-    sql = response_json['sql']
-    chart_type = response_json.get('graph')
-    
+    return response_json['sql'], response_json.get('graph')
+
+def execute_translation(sql, chart_type, shape='records'):
+    """
+    Execute translated SQL. Returns (results, chart_type, truncated), with the
+    chart type inferred from the results when none was requested.
+
+    Table results come back as a list of records, or with shape='columnar' as
+    column names plus one array per column.
+    """
     # Execute SQL query
-    database_path = "data/mouse_study.db"
+    database_path = DATABASE_PATH
     
+    truncated = False
     # If it's a Kaplan-Meier chart, get survival data
     if chart_type == 'kaplan-meier':
         results = get_survival_data()
@@ -52,19 +75,142 @@ def call_llm_and_get_results(question):
         if not chart_type:
             chart_type = determine_chart_type(results)
             
-        # Convert DataFrame to records and handle special types
-        results_dict = []
-        for record in results.to_dict(orient='records'):
-            processed_record = {}
-            for key, value in record.items():
-                if pd.isna(value):
-                    processed_record[key] = None
-                elif isinstance(value, (pd.Timestamp, date)):
-                    processed_record[key] = value.isoformat()
-                elif hasattr(value, 'item'):  # Handle numpy types
-                    processed_record[key] = value.item()
-                else:
-                    processed_record[key] = value
-            results_dict.append(processed_record)
+        truncated = results.attrs.get('truncated', False)
+
+        # Convert column by column rather than cell by cell
+        results_dict = frame_to_columnar(results) if shape == 'columnar' else frame_to_records(results)
+
+    return results_dict, chart_type, truncated
+
+def run_translation(response, shape='records'):
+    """Execute the SQL from a cleaned LLM response. Returns (sql, results, chart_type, truncated)."""
+    sql, chart_type = parse_translation(response)
+    return (sql, *execute_translation(sql, chart_type, shape))
+
+def call_llm_and_get_results(question, shape='records'):
+    prompt = build_prompt(question)
+
+    # Identical questions reuse the earlier translation instead of another LLM round trip
+    response = translation_cache.get(question, prompt, LLM_MODEL)
+    cached = response is not None
+    if not cached:
+        response = clean_response(get_llm_response(question, prompt))
+    result = run_translation(response, shape)
+
+    # Only keep translations that parsed and ran
+    if not cached:
+        translation_cache.put(question, prompt, LLM_MODEL, response)
     
-    return sql, results_dict, chart_type
+    return result
+
+async def translate_async(question):
+    """(prompt, cleaned LLM response, whether it came from the translation cache) for a question"""
+    prompt = await asyncio.to_thread(build_prompt, question)
+
+    response = await asyncio.to_thread(translation_cache.get, question, prompt, LLM_MODEL)
+    cached = response is not None
+    if not cached:
+        response = clean_response(await get_llm_response_async(question, prompt))
+    return prompt, response, cached
+
+def run_and_cache_translation(question, prompt, response, cached, shape='records'):
+    """run_translation(), keeping the translation once it parsed and ran"""
+    result = run_translation(response, shape)
+    if not cached:
+        translation_cache.put(question, prompt, LLM_MODEL, response)
+    return result
+
+async def call_llm_and_get_results_async(question, shape='records'):
+    """call_llm_and_get_results() for the event loop: the LLM call is awaited and the database work runs in threads"""
+    prompt, response, cached = await translate_async(question)
+    return await asyncio.to_thread(run_and_cache_translation, question, prompt, response, cached, shape)
+
+# Questions of one batch that are answered at the same time
+BATCH_CONCURRENCY = int(os.getenv('QUERY_BATCH_CONCURRENCY', 4))
+
+async def call_llm_and_get_results_batch(questions, shape='records', concurrency=BATCH_CONCURRENCY):
+    """
+    call_llm_and_get_results_async() for several questions at once.
+
+    Up to `concurrency` questions are translated together and repeated
+    questions are answered once. Once every translation is in, all of the
+    batch's SQL runs in one worker thread on one pooled connection in a single
+    read transaction, so the answers agree with each other and the transaction
+    is never held open while waiting for the LLM. Returns a (result or
+    exception, seconds) pair per question, in order.
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def translate(question):
+        async with slots:
+            started = time.perf_counter()
+            try:
+                translation = await translate_async(question)
+            except Exception as e:
+                translation = e
+            return translation, time.perf_counter() - started
+
+    def execute(translations):
+        answers = []
+        # The session is opened, rolled back and released in this thread, never on the event loop
+        with get_engine(DATABASE_PATH).session():
+            for question, (translation, elapsed) in zip(unique, translations):
+                if isinstance(translation, Exception):
+                    answers.append((translation, elapsed))
+                    continue
+                started = time.perf_counter()
+                try:
+                    result = run_and_cache_translation(question, *translation, shape)
+                except Exception as e:
+                    result = e
+                answers.append((result, elapsed + time.perf_counter() - started))
+        return answers
+
+    unique = list(dict.fromkeys(questions))
+    translations = await asyncio.gather(*(translate(question) for question in unique))
+    answers = await asyncio.to_thread(execute, translations)
+    by_question = dict(zip(unique, answers))
+    return [by_question[question] for question in questions]
+
+# Rows per "rows" event when streaming results
+ROW_BATCH_SIZE = 500
+
+async def stream_llm_and_results(question):
+    """
+    call_llm_and_get_results_async() as a sequence of (event, data) pairs.
+
+    Yields "token" events while the model writes its answer (none when the
+    translation is cached), then "sql" and "chart_type" as soon as the answer
+    is parsed, before the query runs. A second "chart_type" follows when none
+    was requested and one is inferred from the results, then the results as
+    "rows" batches (or a single "results" event for survival data) and "done".
+    """
+    prompt = await asyncio.to_thread(build_prompt, question)
+
+    response = await asyncio.to_thread(translation_cache.get, question, prompt, LLM_MODEL)
+    cached = response is not None
+    if not cached:
+        pieces = []
+        async for text in llm_client.stream_response(question, prompt):
+            pieces.append(text)
+            yield 'token', {'text': text}
+        response = clean_response(''.join(pieces))
+
+    # The SQL and the requested chart type are known before the query runs
+    sql, chart_type = parse_translation(response)
+    yield 'sql', {'sql': sql}
+    yield 'chart_type', {'chart_type': chart_type}
+
+    results_dict, result_chart_type, truncated = await asyncio.to_thread(execute_translation, sql, chart_type)
+    if not cached:
+        await asyncio.to_thread(translation_cache.put, question, prompt, LLM_MODEL, response)
+
+    if result_chart_type != chart_type:
+        yield 'chart_type', {'chart_type': result_chart_type}
+    if isinstance(results_dict, list):
+        for start in range(0, len(results_dict), ROW_BATCH_SIZE):
+            yield 'rows', {'rows': results_dict[start:start + ROW_BATCH_SIZE]}
+        yield 'done', {'row_count': len(results_dict), 'truncated': truncated, 'cached': cached}
+    else:
+        yield 'results', {'results': results_dict}
+        yield 'done', {'cached': cached}
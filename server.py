@@ -1,27 +1,52 @@
-import os
-
-from fastapi import FastAPI, Request, Query, HTTPException, Response
+from fastapi import FastAPI, Request, Query, HTTPException
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import RedirectResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
-import os
-import pandas as pd
+from datetime import date
+import time
+import asyncio
 
-from llm_sql import call_llm_and_get_results, clean_response, determine_chart_type, read_sql_query
+from llm_sql import DATABASE_PATH, call_llm_and_get_results_async, call_llm_and_get_results_batch, stream_llm_and_results
 
+from contextlib import asynccontextmanager
 import logging
 logger = logging.getLogger(__name__)
-app = FastAPI()
 
-from image_storage import get_image_storage, load_mouse_images, get_images_for_mouse
-from backend.mouse_data import get_full_mice_data_from_db
+from image_storage import get_image_storage
+from backend.mouse_data import get_mice_page
+from backend.mouse_catalog import MouseCatalog
+from backend.image_responses import image_response
+from backend.json_responses import cached_json_response, dumps, response_cache
+from backend.translation_cache import translation_cache
+from backend.llm import RETRYABLE_ERRORS, llm_client
+from backend.llm_replay import ReplayMiss
+from backend.file_stamps import database_version
+from backend.result_cache import result_cache
+from backend.sql_engine import QueryBudgetExceeded, get_engine
+from backend.sql_guard import SQLRejected
+from backend.result_format import RESULT_SHAPES
+from data_processing.data_functions import (TREATMENT_FACTORS, end_date as survival_end_date, start_date as survival_start_date,
+                                            survival_rows_sql, survival_steps)
+from data_processing.survival import survival_analysis
+from image_derivatives import DERIVATIVE_FORMATS, MAX_DIMENSION, contact_sheet_columns, get_derivative_cache
 
-# Load mice data from the database
-mice_data = get_full_mice_data_from_db()
+# Indexed mice and pictures, rebuilt whenever the database or image CSV changes
+mouse_catalog = MouseCatalog(image_csv_path='data/image_results.csv')
 
 # Initialize storage based on environment
 image_storage = get_image_storage()
-mouse_images = load_mouse_images('data/image_results.csv')
+derivative_cache = get_derivative_cache(image_storage)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The first catalog load reads every mouse, so it stays off the event loop
+    await run_in_threadpool(mouse_catalog.start)
+    yield
+    mouse_catalog.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Templates
 templates = Jinja2Templates(directory="templates")
@@ -31,10 +56,25 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Add this new route to serve mouse images
 @app.get("/mouse-images/{path:path}")
-async def get_mouse_image(path: str):
+async def get_mouse_image(
+    path: str,
+    request: Request,
+    w: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    h: Optional[int] = Query(None, ge=1, le=MAX_DIMENSION),
+    fmt: Optional[str] = Query(None),
+    q: int = Query(80, ge=1, le=100),
+):
+    if fmt is not None and fmt not in DERIVATIVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported image format: {fmt}")
     try:
-        image_data, content_type = image_storage.get_image(path)
-        return Response(content=image_data.read(), media_type=content_type)
+        if w or h or fmt:
+            fmt = fmt or ('png' if path.lower().endswith('.png') else 'jpeg')
+            return await derivative_cache.response(request, path, w, h, fmt, q)
+        signed_url = await run_in_threadpool(image_storage.get_image_url, path)
+        if signed_url:
+            # Send the client straight to the bucket instead of proxying the bytes
+            return RedirectResponse(signed_url, status_code=307, headers={'Cache-Control': 'no-cache'})
+        return await image_response(request, image_storage, path)
     except FileNotFoundError:
         logger.error(f"File not found: {path}")
         raise HTTPException(status_code=404, detail="Image not found")
@@ -42,13 +82,109 @@ async def get_mouse_image(path: str):
         logger.error(f"Error retrieving image: {str(e)}")
         raise HTTPException(status_code=500, detail="Error retrieving image")
 
+@app.get("/api/image-cache/stats")
+async def get_image_cache_stats():
+    stats = getattr(image_storage, 'stats', None)
+    return stats() if stats else {}
+
+@app.get("/api/json-cache/stats")
+async def get_json_cache_stats():
+    return response_cache.stats()
+
+@app.get("/api/translation-cache/stats")
+async def get_translation_cache_stats():
+    return {**await run_in_threadpool(translation_cache.stats), 'llm': llm_client.counters}
+
+@app.get("/api/query-cache/stats")
+async def get_query_cache_stats():
+    return {**result_cache.stats(), 'engine': get_engine(DATABASE_PATH).stats()}
+
 @app.get("/api/mice")
-async def get_mice(sort: Optional[str] = Query(None)):
-    if sort:
-        column, _, order = sort.partition('-')
-        order = 'asc' if order == 'asc' else 'desc'
-        return get_full_mice_data_from_db(column, order)
-    return get_full_mice_data_from_db()
+async def get_mice(
+    request: Request,
+    sort: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = Query(None),
+    group: Optional[List[int]] = Query(None),
+    cohort: Optional[List[int]] = Query(None),
+    sex: Optional[str] = Query(None),
+    alive: Optional[bool] = Query(None),
+    dob_from: Optional[date] = Query(None),
+    dob_to: Optional[date] = Query(None),
+    dod_from: Optional[date] = Query(None),
+    dod_to: Optional[date] = Query(None),
+):
+    snapshot = await mouse_catalog.current()
+
+    async def build():
+        try:
+            mice, total, next_cursor = await run_in_threadpool(
+                get_mice_page,
+                limit=limit, after=after, sort=sort,
+                group=group, cohort=cohort, sex=sex, alive=alive,
+                dob_from=dob_from, dob_to=dob_to, dod_from=dod_from, dod_to=dod_to,
+                picture_counts=snapshot.picture_counts,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        headers = {"X-Total-Count": str(total)}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return mice, headers
+
+    # Pages are read from the database itself, so they are keyed on its stamps (and the pictures CSV's)
+    return await cached_json_response(request, snapshot.stamps, build)
+
+
+# Longest date range /api/survival builds curves over
+MAX_SURVIVAL_DAYS = 20 * 366
+
+@app.get("/api/survival")
+async def get_survival(
+    request: Request,
+    group: Optional[List[int]] = Query(None),
+    cohort: Optional[List[int]] = Query(None),
+    sex: Optional[str] = Query(None),
+    rapamycin: Optional[str] = Query(None),
+    hscs: Optional[str] = Query(None),
+    senolytic: Optional[str] = Query(None),
+    mobilization: Optional[str] = Query(None),
+    aav9: Optional[str] = Query(None),
+    start_date: date = Query(date.fromisoformat(survival_start_date)),
+    end_date: date = Query(date.fromisoformat(survival_end_date)),
+    deaths: bool = Query(False),
+    analysis: bool = Query(False),
+):
+    """
+    Alive counts per group as step changes, straight from the database.
+
+    deaths=true adds every death's date, group and ear tag; analysis=true adds
+    Kaplan-Meier estimates and log-rank tests for the same mice.
+    """
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date is before start_date")
+    if (end_date - start_date).days >= MAX_SURVIVAL_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range is longer than {MAX_SURVIVAL_DAYS} days")
+    factors = (rapamycin, hscs, senolytic, mobilization, aav9)
+    treatments = {factor: value for factor, value in zip(TREATMENT_FACTORS, factors) if value is not None}
+
+    async def build():
+        # The analysis also needs the mice that died after end_date, to censor them there
+        sql, params = survival_rows_sql(group, cohort, sex, treatments, analysis=analysis)
+        dates = (start_date.isoformat(),) if analysis else (start_date.isoformat(), end_date.isoformat())
+        try:
+            df, _ = await run_in_threadpool(get_engine(DATABASE_PATH).read_frame, sql, (*dates, *params), max_rows=0)
+        except QueryBudgetExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        # Alive counts only cover mice that were alive or died by end_date, as in the bounded query
+        rows = df[df['DOD'].isna() | (df['DOD'] <= end_date.isoformat())] if analysis else df
+        payload = await run_in_threadpool(survival_steps, rows, start_date, end_date, deaths)
+        if analysis:
+            payload['analysis'] = await run_in_threadpool(survival_analysis, df, start_date, end_date)
+        return payload, {}
+
+    return await cached_json_response(request, database_version(DATABASE_PATH), build)
 
 
 @app.get("/")
@@ -61,7 +197,7 @@ async def dashboard(request: Request):
 
 @app.get("/mice")
 async def mice(request: Request):
-    return templates.TemplateResponse("mice.html", {"request": request, "mice": mice_data})
+    return templates.TemplateResponse("mice.html", {"request": request, "mice": (await mouse_catalog.current()).mice})
 
 @app.get("/query")
 async def query(request: Request):
@@ -69,27 +205,149 @@ async def query(request: Request):
 
 @app.get("/api/mouse/{ear_tag}")
 async def get_mouse(ear_tag: int):
-    mouse = next((m for m in mice_data if m.EarTag == ear_tag), None)
+    snapshot = await mouse_catalog.current()
+    mouse = snapshot.by_ear_tag.get(ear_tag)
     if mouse:
-        return {**mouse.dict(), "image": mouse_images.get(ear_tag)}
+        return {**mouse.dict(), "image": snapshot.images.get(ear_tag)}
     return {"error": "Mouse not found"}
 
 @app.get("/api/mouse-pictures/{ear_tag}")
-async def get_mouse_pictures(ear_tag: int):
-    mouse = next((m for m in mice_data if m.EarTag == ear_tag), None)
+async def get_mouse_pictures(ear_tag: int, request: Request):
+    snapshot = await mouse_catalog.current()
+    mouse = snapshot.by_ear_tag.get(ear_tag)
     if not mouse:
         raise HTTPException(status_code=404, detail="Mouse not found")
     
-    images = get_images_for_mouse(ear_tag, mouse_images)
+    images = snapshot.images.get(ear_tag, [])
     logger.debug(f"Images for mouse {ear_tag}: {images}")
-    return {
-        "ear_tag": ear_tag,
-        "sex": mouse.Sex,
-        "dob": mouse.DOB.isoformat(),
-        "pictures": images
-    }
+
+    async def build():
+        pictures = await run_in_threadpool(
+            lambda: [{**image, 'url': picture_url(image['file_path'])} for image in images]
+        )
+        return {
+            "ear_tag": ear_tag,
+            "sex": mouse.Sex,
+            "dob": mouse.DOB.isoformat(),
+            "pictures": pictures
+        }, None
+
+    # Signed picture URLs expire, so those responses cannot be reused
+    return await cached_json_response(request, snapshot.version, build, cache=not image_storage.signed_urls)
+
+def picture_url(file_path: str) -> str:
+    return image_storage.get_image_url(file_path) or f"/mouse-images/{file_path}"
+
+MAX_MANIFEST_MICE = 1000
+MAX_CONTACT_SHEET_TILES = 2500
+
+def select_manifest_mice(snapshot, ear_tag: Optional[List[int]], group: Optional[int], cohort: Optional[int]):
+    """Mice for a picture manifest: the listed ear tags in order, or everyone matching group/cohort"""
+    if ear_tag:
+        if len(ear_tag) > MAX_MANIFEST_MICE:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_MANIFEST_MICE} ear tags per request")
+        return [snapshot.by_ear_tag[tag] for tag in dict.fromkeys(ear_tag) if tag in snapshot.by_ear_tag]
+    if group is None and cohort is None:
+        raise HTTPException(status_code=400, detail="Provide ear_tag values or a group/cohort filter")
+    return mouse_catalog.filter(group=group, cohort=cohort, snapshot=snapshot)
+
+def manifest_paths(snapshot, mice) -> List[str]:
+    pictures_by_date = snapshot.pictures_by_date
+    return [
+        file_path
+        for mouse in mice
+        for day in pictures_by_date.get(mouse.EarTag, [])
+        for file_path in day['file_paths']
+    ]
+
+@app.get("/api/picture-manifest")
+async def get_picture_manifest(
+    request: Request,
+    ear_tag: Optional[List[int]] = Query(None),
+    group: Optional[int] = Query(None),
+    cohort: Optional[int] = Query(None),
+    sprite: bool = Query(False),
+    tile: int = Query(96, ge=16, le=512),
+):
+    """Picture manifests for many mice in one response, grouped by mouse and date"""
+    snapshot = await mouse_catalog.current()
+    mice = select_manifest_mice(snapshot, ear_tag, group, cohort)
+    pictures_by_date = snapshot.pictures_by_date
+
+    def build():
+        sprite_index = 0
+        manifests = []
+        for mouse in mice:
+            dates = []
+            for day in pictures_by_date.get(mouse.EarTag, []):
+                pictures = []
+                for file_path in day['file_paths']:
+                    picture = {'file_path': file_path, 'url': picture_url(file_path)}
+                    if sprite:
+                        picture['sprite_index'] = sprite_index
+                        sprite_index += 1
+                    pictures.append(picture)
+                dates.append({'date': day['date'], 'pictures': pictures})
+            manifests.append({
+                'ear_tag': mouse.EarTag,
+                'sex': mouse.Sex,
+                'dob': mouse.DOB.isoformat() if mouse.DOB else None,
+                'group': mouse.Group_Number,
+                'cohort': mouse.Cohort_id,
+                'dates': dates,
+            })
+        return manifests, sprite_index
+
+    async def build_response():
+        manifests, tiles = await run_in_threadpool(build)
+        result = {'mice': manifests, 'total_pictures': sum(snapshot.picture_counts.get(m.EarTag, 0) for m in mice)}
+        if sprite:
+            if tiles > MAX_CONTACT_SHEET_TILES:
+                raise HTTPException(status_code=400, detail=f"Contact sheets are limited to {MAX_CONTACT_SHEET_TILES} pictures")
+            result['sprite'] = {
+                'url': f"/api/picture-manifest/contact-sheet?{request.url.query}",
+                'tile': tile,
+                'columns': contact_sheet_columns(tiles),
+            }
+        return result, None
+
+    return await cached_json_response(request, snapshot.version, build_response, cache=not image_storage.signed_urls)
+
+@app.get("/api/picture-manifest/contact-sheet")
+async def get_contact_sheet(
+    request: Request,
+    ear_tag: Optional[List[int]] = Query(None),
+    group: Optional[int] = Query(None),
+    cohort: Optional[int] = Query(None),
+    tile: int = Query(96, ge=16, le=512),
+    fmt: str = Query('webp'),
+    q: int = Query(75, ge=1, le=100),
+):
+    """Sprite of the manifest's pictures, one tile each in sprite_index order"""
+    if fmt not in DERIVATIVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported image format: {fmt}")
+    snapshot = await mouse_catalog.current()
+    paths = manifest_paths(snapshot, select_manifest_mice(snapshot, ear_tag, group, cohort))
+    if not paths:
+        raise HTTPException(status_code=404, detail="No pictures found")
+    if len(paths) > MAX_CONTACT_SHEET_TILES:
+        raise HTTPException(status_code=400, detail=f"Contact sheets are limited to {MAX_CONTACT_SHEET_TILES} pictures")
+    return await derivative_cache.contact_sheet_response(request, paths, tile, None, fmt, q)
 
 # Add new endpoint for handling queries
+def query_failure(e: Exception):
+    """(status code, message) reported for a question that could not be answered"""
+    if isinstance(e, (asyncio.TimeoutError, *RETRYABLE_ERRORS)):
+        logger.error(f"LLM unavailable for query: {type(e).__name__} {str(e)}")
+        return 504, "The language model did not answer in time, please try again"
+    if isinstance(e, (QueryBudgetExceeded, SQLRejected)):
+        return 422, str(e)
+    if isinstance(e, ReplayMiss):
+        # LLM_PROVIDER=replay only answers the questions in its recording
+        return 404, "No recorded answer for this question"
+    logger.error(f"Error answering query: {type(e).__name__} {str(e)}")
+    return 500, str(e)
+
 @app.post("/api/query")
 async def handle_query(request: Request):
     data = await request.json()
@@ -97,15 +355,89 @@ async def handle_query(request: Request):
     
     if not question:
         raise HTTPException(status_code=400, detail="No question provided")
+
+    # "columnar" returns {"columns", "dtypes", "data"} instead of a list of records
+    shape = data.get('format', 'records')
+    if shape not in RESULT_SHAPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported result format: {shape}")
     
-    sql, results_dict, chart_type = call_llm_and_get_results(question)
-    
-    return {
-        "sql": sql,
-        "results": results_dict,
-        "chart_type": chart_type
-    }
+    async def build():
+        try:
+            sql, results_dict, chart_type, truncated = await call_llm_and_get_results_async(question, shape)
+        except (asyncio.TimeoutError, *RETRYABLE_ERRORS, QueryBudgetExceeded, SQLRejected, ReplayMiss) as e:
+            status_code, detail = query_failure(e)
+            raise HTTPException(status_code=status_code, detail=detail)
+        return {
+            "sql": sql,
+            "results": results_dict,
+            "chart_type": chart_type,
+            "truncated": truncated
+        }, None
+
+    return await cached_json_response(request, database_version(DATABASE_PATH), build, params=(question, shape))
+
+
+MAX_BATCH_QUESTIONS = 20
+
+@app.post("/api/query/batch")
+async def handle_query_batch(request: Request):
+    """
+    Answer several questions in one request, e.g. the panels of a dashboard.
+
+    Questions are translated concurrently and their SQL shares one connection,
+    so the batch takes about as long as its slowest question. Each answer
+    carries its own status and timing; one failing question does not fail the
+    others.
+    """
+    data = await request.json()
+    questions = data.get('questions')
+
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        raise HTTPException(status_code=400, detail="questions must be a non-empty list of questions")
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUESTIONS} questions per batch")
+
+    shape = data.get('format', 'records')
+    if shape not in RESULT_SHAPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported result format: {shape}")
+
+    async def build():
+        started = time.perf_counter()
+        answers = await call_llm_and_get_results_batch(questions, shape)
+        results = []
+        for question, (outcome, elapsed) in zip(questions, answers):
+            answer = {"question": question, "elapsed_ms": round(elapsed * 1000, 1)}
+            if isinstance(outcome, Exception):
+                answer["status"], answer["error"] = query_failure(outcome)
+            else:
+                sql, results_dict, chart_type, truncated = outcome
+                answer.update(status=200, sql=sql, results=results_dict, chart_type=chart_type, truncated=truncated)
+            results.append(answer)
+        return {"results": results, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}, None
+
+    # Timings differ on every call, so batches are not cached as a whole (their questions still are)
+    return await cached_json_response(request, database_version(DATABASE_PATH), build, cache=False)
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+@app.get("/api/query/stream")
+async def stream_query(question: str = Query(..., min_length=1)):
+    """/api/query as Server-Sent Events, so the page can render while the answer is produced"""
+    async def events():
+        try:
+            async for event, data in stream_llm_and_results(question):
+                yield sse_event(event, data)
+        except (asyncio.TimeoutError, *RETRYABLE_ERRORS, ReplayMiss) as e:
+            status_code, detail = query_failure(e)
+            yield sse_event('error', {'status': status_code, 'detail': detail})
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            yield sse_event('error', {'detail': str(e)})
 
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 if __name__ == "__main__":
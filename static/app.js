@@ -43,65 +43,90 @@
 
     function initDashboard() {
         const ctx = document.getElementById('kaplanMeierChart');
-        if (ctx) {
-            new Chart(ctx.getContext('2d'), {
-                type: 'line',
-                data: {
-                    labels: [0, 10, 20, 30, 40, 50],
-                    datasets: [{
-                        label: 'Survival Probability',
-                        data: [1, 0.9, 0.8, 0.7, 0.6, 0.5],
-                        borderColor: 'rgb(75, 192, 192)',
-                        tension: 0.1
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    scales: {
-                        x: {
-                            title: {
-                                display: true,
-                                text: 'Time'
-                            }
-                        },
-                        y: {
-                            title: {
-                                display: true,
-                                text: 'Survival Probability'
+        if (!ctx) {
+            return;
+        }
+        $.ajax({
+            url: '/api/survival',
+            dataType: 'json',
+            success: function(data) {
+                const start = Date.parse(data.start_date);
+                const day = date => (Date.parse(date) - start) / 86400000;
+                const lastDay = day(data.end_date);
+                // Each count holds until the next change; the last one runs to the end date
+                const datasets = Object.entries(data.series)
+                    .filter(([, series]) => series.alive[0] > 0)
+                    .map(([group, series]) => {
+                        const points = series.dates.map((date, i) => ({ x: day(date), y: series.alive[i] / series.alive[0] }));
+                        points.push({ x: lastDay, y: points[points.length - 1].y });
+                        return { label: group, data: points, stepped: true, pointRadius: 0, borderWidth: 2 };
+                    });
+                new Chart(ctx.getContext('2d'), {
+                    type: 'line',
+                    data: { datasets: datasets },
+                    options: {
+                        responsive: true,
+                        scales: {
+                            x: {
+                                type: 'linear',
+                                min: 0,
+                                max: lastDay,
+                                title: {
+                                    display: true,
+                                    text: 'Days since ' + data.start_date
+                                }
                             },
-                            min: 0,
-                            max: 1
+                            y: {
+                                title: {
+                                    display: true,
+                                    text: 'Survival Probability'
+                                },
+                                min: 0,
+                                max: 1
+                            }
                         }
                     }
-                }
-            });
-        }
+                });
+            },
+            error: function(jqXHR, textStatus, errorThrown) {
+                ctx.insertAdjacentHTML('afterend', '<div class="alert alert-danger">Error loading survival data: ' + textStatus + '</div>');
+            }
+        });
     }
 
     function initMice() {
         let currentPage = 1;
         const rowsPerPage = 20;
-        let allMiceData = [];
-
-        function loadMiceData(currentPage=1, sortColumn=null, sortOrder = 'asc') {
-            var url = '/api/mice';
-            if (sortColumn) {
-                url += `?sort=${sortColumn}-${sortOrder}`;
+        let totalMice = 0;
+        let sortSpec = null;
+        // cursors[i] is the keyset cursor that fetches page i + 1
+        let cursors = [null];
+
+        function loadMiceData(page=1) {
+            const params = new URLSearchParams({ limit: rowsPerPage });
+            if (sortSpec) {
+                params.set('sort', sortSpec);
             }
-            $.getJSON(url, function(data) {
-                allMiceData = data;
-                displayMiceData(currentPage);
-                updatePagination();
-            }).fail(function(jqXHR, textStatus, errorThrown) {
-                $('#debug').text('Error: ' + textStatus + ', ' + errorThrown);
+            if (cursors[page - 1]) {
+                params.set('after', cursors[page - 1]);
+            }
+            $.ajax({
+                url: '/api/mice?' + params.toString(),
+                dataType: 'json',
+                success: function(data, textStatus, jqXHR) {
+                    currentPage = page;
+                    totalMice = parseInt(jqXHR.getResponseHeader('X-Total-Count')) || data.length;
+                    cursors[page] = jqXHR.getResponseHeader('X-Next-Cursor');
+                    displayMiceData(data);
+                    updatePagination();
+                },
+                error: function(jqXHR, textStatus, errorThrown) {
+                    $('#debug').text('Error: ' + textStatus + ', ' + errorThrown);
+                }
             });
         }
 
-        function displayMiceData(page) {
-            const startIndex = (page - 1) * rowsPerPage;
-            const endIndex = startIndex + rowsPerPage;
-            const pageData = allMiceData.slice(startIndex, endIndex);
-
+        function displayMiceData(pageData) {
             var tbody = $('#miceTable tbody');
             tbody.empty();
             $.each(pageData, function(i, mouse) {
@@ -117,7 +142,7 @@
         }
 
         function updatePagination() {
-            const totalPages = Math.ceil(allMiceData.length / rowsPerPage);
+            const totalPages = Math.max(1, Math.ceil(totalMice / rowsPerPage));
             const pagination = $('#mice-pagination');
             pagination.empty();
 
@@ -128,34 +153,15 @@
                 </li>
             `);
 
-            // Add page numbers
-            const maxVisiblePages = 5;
-            let startPage = Math.max(1, currentPage - Math.floor(maxVisiblePages / 2));
-            let endPage = Math.min(totalPages, startPage + maxVisiblePages - 1);
-
-            if (endPage - startPage + 1 < maxVisiblePages) {
-                startPage = Math.max(1, endPage - maxVisiblePages + 1);
-            }
-
-            if (startPage > 1) {
-                pagination.append('<li class="page-item disabled"><span class="page-link">...</span></li>');
-            }
-
-            for (let i = startPage; i <= endPage; i++) {
-                pagination.append(`
-                    <li class="page-item ${i === currentPage ? 'active' : ''}">
-                        <a class="page-link" href="#" data-page="${i}">${i}</a>
-                    </li>
-                `);
-            }
-
-            if (endPage < totalPages) {
-                pagination.append('<li class="page-item disabled"><span class="page-link">...</span></li>');
-            }
+            pagination.append(`
+                <li class="page-item disabled">
+                    <span class="page-link">Page ${currentPage} of ${totalPages}</span>
+                </li>
+            `);
 
             // Add "Next" button
             pagination.append(`
-                <li class="page-item ${currentPage === totalPages ? 'disabled' : ''}">
+                <li class="page-item ${cursors[currentPage] ? '' : 'disabled'}">
                     <a class="page-link" href="#" data-page="${currentPage + 1}">Next &raquo;</a>
                 </li>
             `);
@@ -169,7 +175,9 @@
             var newOrder = currentOrder === 'asc' ? 'desc' : 'asc';
             
             $(this).data('order', newOrder);
-            loadMiceData(currentPage, column, newOrder);
+            sortSpec = `${column}-${newOrder}`;
+            cursors = [null];
+            loadMiceData(1);
             
             // Update sort indicators
             $('#miceTable th').removeClass('sort-asc sort-desc');
@@ -179,10 +187,8 @@
         $('#mice-pagination').on('click', '.page-link', function(e) {
             e.preventDefault();
             const newPage = parseInt($(this).data('page'));
-            if (!isNaN(newPage) && newPage !== currentPage) {
-                currentPage = newPage;
-                displayMiceData(currentPage);
-                updatePagination();
+            if (!isNaN(newPage) && newPage !== currentPage && (newPage === 1 || cursors[newPage - 1])) {
+                loadMiceData(newPage);
             }
         });
 
@@ -256,10 +262,12 @@
                         const picturesRow = $('<div class="row"></div>');
                         
                         picturesByDate[date].forEach(function(picData) {
-                            const imgSrc = `/mouse-images/${picData.file_path}`;
+                            const thumbSrc = `/mouse-images/${picData.file_path}?w=640&fmt=webp`;
+                            // Full-size images may come straight from the bucket via a signed URL
+                            const imgSrc = picData.url || `/mouse-images/${picData.file_path}`;
                             picturesRow.append(`
                                 <div class="col-md-6 mb-3">
-                                    <img src="${imgSrc}" 
+                                    <img src="${thumbSrc}" loading="lazy" 
                                          class="img-fluid rounded cursor-pointer" 
                                          title="${picData.full_text || ''}"
                                          style="cursor: pointer"
@@ -321,37 +329,68 @@
         `;
 
         // Add event listener for the Run button
-        document.getElementById('run-query').addEventListener('click', async () => {
+        let querySource = null;
+        document.getElementById('run-query').addEventListener('click', () => {
             const question = document.getElementById('question-input').value;
-            
-            try {
-                const response = await fetch('/api/query', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ question })
-                });
-                
-                const data = await response.json();
-                
-                // Display SQL query
-                document.getElementById('sql-query').textContent = data.sql;
-                
-                // Display results in table
-                const resultsTable = document.getElementById('results-table');
-                if (data.results.length > 0) {
-                    const table = createDataTable(data.results);
-                    resultsTable.innerHTML = '';
+            const sqlQuery = document.getElementById('sql-query');
+            const resultsTable = document.getElementById('results-table');
+            const chartContainer = document.getElementById('chart-container');
+
+            // Results stream in over Server-Sent Events: model tokens, then the SQL, chart type and row batches
+            if (querySource) {
+                querySource.close();
+            }
+            sqlQuery.textContent = '';
+            resultsTable.innerHTML = '';
+            chartContainer.innerHTML = '';
+
+            const source = new EventSource('/api/query/stream?question=' + encodeURIComponent(question));
+            querySource = source;
+            let chartType = null;
+            let rows = [];
+            let tbody = null;
+
+            source.addEventListener('token', (e) => {
+                sqlQuery.textContent += JSON.parse(e.data).text;
+            });
+            source.addEventListener('sql', (e) => {
+                sqlQuery.textContent = JSON.parse(e.data).sql;
+            });
+            source.addEventListener('chart_type', (e) => {
+                chartType = JSON.parse(e.data).chart_type;
+            });
+            source.addEventListener('rows', (e) => {
+                const batch = JSON.parse(e.data).rows;
+                if (batch.length === 0) {
+                    return;
+                }
+                if (!tbody) {
+                    const table = createDataTable(batch);
                     resultsTable.appendChild(table);
+                    tbody = table.querySelector('tbody');
+                } else {
+                    appendTableRows(tbody, batch);
                 }
-                
-                // Create visualization
-                const chartContainer = document.getElementById('chart-container');
-                createVisualization(data.results, data.chart_type, chartContainer);
-            } catch (error) {
-                console.error('Error:', error);
-            }
+                rows = rows.concat(batch);
+            });
+            source.addEventListener('results', (e) => {
+                rows = JSON.parse(e.data).results;
+            });
+            source.addEventListener('done', () => {
+                source.close();
+                createVisualization(rows, chartType, chartContainer);
+            });
+            source.addEventListener('error', (e) => {
+                // Our own error events carry a message; a bare error means the connection dropped
+                source.close();
+                const detail = e.data ? JSON.parse(e.data).detail : 'Connection lost';
+                console.error('Error:', detail);
+                resultsTable.innerHTML = '';
+                const message = document.createElement('p');
+                message.className = 'text-danger';
+                message.textContent = detail;
+                resultsTable.appendChild(message);
+            });
         });
     }
 
@@ -372,6 +411,13 @@
         
         // Create body
         const tbody = document.createElement('tbody');
+        appendTableRows(tbody, data);
+        table.appendChild(tbody);
+        
+        return table;
+    }
+
+    function appendTableRows(tbody, data) {
         data.forEach(row => {
             const tr = document.createElement('tr');
             Object.values(row).forEach(value => {
@@ -381,9 +427,6 @@
             });
             tbody.appendChild(tr);
         });
-        table.appendChild(tbody);
-        
-        return table;
     }
 
     function createVisualization(data, chartType, container) {
@@ -411,9 +454,9 @@
             return;
         }
 
-        // The data is already in the survival data format
-        const survivalData = data;
-        const deathEvents = []; // We'll handle death events separately if needed
+        // {survival_data, death_events}; a bare {date: {group: count}} map is still accepted
+        const survivalData = data.survival_data || data;
+        const deathEvents = data.death_events || [];
         
         const traces = [];
         const groups = {};
@@ -36,6 +36,8 @@ import plotly.express as px
 import json
 from litellm import completion
 from backend.llm import get_llm_response
+from backend.prompt_builder import prompt_builder
+from backend.sql_guard import get_guard
 
 from data_processing.data_functions import convert_survival_data, get_survival_data
 
@@ -46,9 +48,7 @@ def clean_response(response):
 
 
 def read_sql_query(sql, db):
-    conn = sqlite3.connect(db)
-    df = pd.read_sql_query(sql, conn)
-    conn.close()
+    df, _ = get_guard(db).run(sql)
     return df
 
 def get_sql_query_from_response(response):
@@ -200,11 +200,10 @@ with st.container():
             st.write("")
             submit = st.form_submit_button("Run", help="Click to submit your question.", use_container_width=True)
 
-prompt = open("prompt.txt", "r").read()
 database_path = os.getenv("DATABASE_URL")
 
 if submit or question:  # This will trigger on button click or when Enter is pressed
-    response = get_llm_response(question, prompt)
+    response = get_llm_response(question, prompt_builder.build(question))
     response = clean_response(response)
     response_json = json.loads(response)
     sql = response_json['sql']
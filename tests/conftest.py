@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import pytest
+
+# backend.mouse_data binds its engine to DATABASE_URL on import, so the tests get a
+# scratch database before anything imports it; the study database is never written
+TEST_DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix='mouse-study-tests-'), 'study.db')
+os.environ['DATABASE_URL'] = f"sqlite:///{TEST_DATABASE_PATH}"
+# litellm fetches its model price list at import unless told to use the bundled copy
+os.environ.setdefault('LITELLM_LOCAL_MODEL_COST_MAP', 'True')
+
+from tests.fake_gcs import FakeGCSServer
+
+
+class GCSEmulator:
+    """A fake GCS to run the storage against, and a way to put objects in it"""
+
+    def __init__(self, host: str, stand_in: FakeGCSServer = None):
+        self.host = host
+        self.stand_in = stand_in
+        self._client = None
+
+    def put(self, bucket: str, name: str, data: bytes):
+        if self.stand_in:
+            self.stand_in.put(bucket, name, data)
+            return
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import storage
+
+        if self._client is None:
+            self._client = storage.Client(credentials=AnonymousCredentials(), project='test',
+                                          client_options={'api_endpoint': self.host})
+        target = self._client.lookup_bucket(bucket) or self._client.create_bucket(bucket)
+        target.blob(name).upload_from_string(data)
+
+
+@pytest.fixture(scope='session')
+def gcs_emulator():
+    """
+    fake-gcs-server when STORAGE_EMULATOR_HOST is already set (e.g. fsouza/fake-gcs-server
+    started with -scheme http), otherwise the in-process stand-in from tests/fake_gcs.py.
+    """
+    host = os.getenv('STORAGE_EMULATOR_HOST')
+    if host:
+        yield GCSEmulator(host if '://' in host else f"http://{host}")
+        return
+    stand_in = FakeGCSServer().start()
+    try:
+        yield GCSEmulator(stand_in.host, stand_in)
+    finally:
+        stand_in.stop()
+
+
+@pytest.fixture
+def mouse_db():
+    """
+    An empty study schema in the scratch database; returns add(rows), which
+    inserts MouseData rows given as dicts of column values.
+    """
+    from backend.models import Base, Cohort, Group, MouseData
+    from backend.mouse_data import SessionLocal, engine
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    def add(rows):
+        with SessionLocal() as db:
+            for number in {row.get('Group_Number') for row in rows} - {None}:
+                if db.get(Group, number) is None:
+                    db.add(Group(Number=number))
+            for cohort in {row.get('Cohort_id') for row in rows} - {None}:
+                if db.get(Cohort, cohort) is None:
+                    db.add(Cohort(Cohort_id=cohort, CohortName=f"Cohort {cohort}"))
+            db.add_all(MouseData(**row) for row in rows)
+            db.commit()
+
+    yield add
+    engine.dispose()
@@ -0,0 +1,138 @@
+"""
+A small in-process stand-in for fake-gcs-server.
+
+It answers the parts of the GCS JSON API that GCSImageStorage uses: bucket
+and object metadata, listing and alt=media downloads with Range and
+ifGenerationNotMatch. Media is written in CHUNK_SIZE pieces, and tests can
+hold a download after its first piece through `gate` to observe streaming.
+"""
+import json
+import threading
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from image_storage import CHUNK_SIZE
+
+
+class FakeGCSServer:
+    def __init__(self):
+        self.objects = {}  # (bucket, name) -> (data, generation, updated)
+        self.buckets = set()
+        self.requests = []
+        self.gate = None  # threading.Event a download waits on after its first chunk
+        self._generation = 1000
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def create_bucket(self, bucket: str):
+        self.buckets.add(bucket)
+
+    def put(self, bucket: str, name: str, data: bytes) -> int:
+        self.buckets.add(bucket)
+        self._generation += 1
+        self.objects[(bucket, name)] = (data, self._generation, 1700000000.0 + self._generation)
+        return self._generation
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _metadata(self, bucket, name):
+                data, generation, updated = fake.objects[(bucket, name)]
+                return {
+                    'kind': 'storage#object', 'bucket': bucket, 'name': name, 'size': str(len(data)),
+                    'generation': str(generation),
+                    'updated': datetime.fromtimestamp(updated, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                }
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                fake.requests.append((url.path, query, dict(self.headers)))
+                parts = url.path.split('/')
+                # /storage/v1/b/<bucket>[/o[/<object>]]
+                if parts[1:4] != ['storage', 'v1', 'b'] or len(parts) < 5:
+                    return self._json(404, {'error': {'code': 404}})
+                bucket = unquote(parts[4])
+                if bucket not in fake.buckets:
+                    return self._json(404, {'error': {'code': 404, 'message': 'bucket not found'}})
+                if len(parts) == 5:
+                    return self._json(200, {'kind': 'storage#bucket', 'name': bucket, 'id': bucket})
+                if len(parts) == 6:
+                    items = [self._metadata(b, n) for b, n in fake.objects if b == bucket]
+                    return self._json(200, {'kind': 'storage#objects', 'items': items[:int(query.get('maxResults', 1000))]})
+
+                name = unquote('/'.join(parts[6:]))
+                if (bucket, name) not in fake.objects:
+                    return self._json(404, {'error': {'code': 404, 'message': 'object not found'}})
+                if query.get('alt') != 'media':
+                    return self._json(200, self._metadata(bucket, name))
+                self._media(bucket, name, query)
+
+            def _media(self, bucket, name, query):
+                data, generation, updated = fake.objects[(bucket, name)]
+                headers = {'x-goog-generation': str(generation), 'Last-Modified': formatdate(updated, usegmt=True),
+                           'ETag': f'"{generation}"'}
+                if query.get('ifGenerationNotMatch') == str(generation):
+                    self.send_response(304)
+                    for key, value in headers.items():
+                        self.send_header(key, value)
+                    self.end_headers()
+                    return
+
+                status, start, end = 200, 0, len(data) - 1
+                spec = self.headers.get('Range', '')
+                if spec.startswith('bytes='):
+                    first, _, last = spec[len('bytes='):].partition('-')
+                    if first:
+                        start, end = int(first), min(int(last), len(data) - 1) if last else len(data) - 1
+                    else:
+                        start = max(0, len(data) - int(last))
+                    if start >= len(data):
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{len(data)}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+                    headers['Content-Range'] = f'bytes {start}-{end}/{len(data)}'
+
+                body = data[start:end + 1]
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                for offset in range(0, len(body), CHUNK_SIZE):
+                    self.wfile.write(body[offset:offset + CHUNK_SIZE])
+                    self.wfile.flush()
+                    if offset == 0 and fake.gate is not None:
+                        fake.gate.wait(5)
+
+        return Handler
@@ -0,0 +1,95 @@
+"""
+A local OpenAI-compatible chat completions server for the LLM client tests.
+
+POST /v1/chat/completions answers from a queue of scripted replies: each is
+either an HTTP error status or a list of text pieces streamed as SSE chunks,
+optionally delayed before the headers or between pieces.
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+
+@dataclass
+class Reply:
+    pieces: List[str] = field(default_factory=list)
+    status: int = 200
+    delay_before: float = 0.0  # before the response headers
+    delay_between: float = 0.0  # before every piece after the first
+
+
+class FakeLLMServer:
+    def __init__(self):
+        self.replies: List[Reply] = []
+        self.requests = []
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_reply(self) -> Optional[Reply]:
+        return self.replies.pop(0) if self.replies else Reply(status=500)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                fake.requests.append(body)
+                reply = fake._next_reply()
+                time.sleep(reply.delay_before)
+                try:
+                    if reply.status != 200:
+                        self._error(reply.status)
+                    else:
+                        self._stream(reply)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _error(self, status):
+                payload = json.dumps({'error': {'message': f'scripted {status}', 'type': 'server_error', 'code': status}}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, reply):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for index, piece in enumerate(reply.pieces):
+                    if index:
+                        time.sleep(reply.delay_between)
+                    chunk = {'id': 'fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'fake',
+                             'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                done = {'id': 'fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'fake',
+                        'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+                self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
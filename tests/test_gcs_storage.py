@@ -0,0 +1,126 @@
+import os
+import threading
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from backend.image_responses import image_response
+from image_storage import CHUNK_SIZE, GCSImageStorage, RangeNotSatisfiable
+
+BUCKET = 'test-pictures'
+BASE_PATH = 'study'
+IMAGE = os.urandom(3 * CHUNK_SIZE + 1234)
+
+
+@pytest.fixture
+def gcs(gcs_emulator, monkeypatch):
+    monkeypatch.setenv('STORAGE_EMULATOR_HOST', gcs_emulator.host)
+    gcs_emulator.put(BUCKET, f'{BASE_PATH}/1234/side.jpg', IMAGE)
+    storage = GCSImageStorage(BUCKET, BASE_PATH)
+    assert storage.use_gcs
+    return storage
+
+
+def read(stream) -> bytes:
+    try:
+        return b''.join(stream.chunks)
+    finally:
+        stream.close()
+
+
+def test_stat_reports_size_and_generation_etag(gcs):
+    info = gcs.stat('1234/side.jpg')
+    assert info.size == len(IMAGE)
+    assert info.etag.strip('"').isdigit()
+    assert info.content_type == 'image/jpeg'
+
+
+def test_full_read(gcs):
+    stream = gcs.open_image('1234/side.jpg')
+    assert stream.byte_range is None
+    assert stream.info.size == len(IMAGE)
+    assert stream.info.etag == gcs.stat('1234/side.jpg').etag
+    assert read(stream) == IMAGE
+
+
+@pytest.mark.parametrize('byte_range, expected', [
+    ((10, 99), (10, 99)),
+    ((len(IMAGE) - 5, None), (len(IMAGE) - 5, len(IMAGE) - 1)),
+    ((None, 7), (len(IMAGE) - 7, len(IMAGE) - 1)),
+    ((CHUNK_SIZE - 1, 2 * CHUNK_SIZE), (CHUNK_SIZE - 1, 2 * CHUNK_SIZE)),
+])
+def test_ranged_reads(gcs, byte_range, expected):
+    stream = gcs.open_image('1234/side.jpg', byte_range)
+    assert stream.byte_range == expected
+    assert stream.info.size == len(IMAGE)
+    assert read(stream) == IMAGE[expected[0]:expected[1] + 1]
+
+
+def test_unsatisfiable_range(gcs):
+    with pytest.raises(RangeNotSatisfiable) as error:
+        gcs.open_image('1234/side.jpg', (len(IMAGE) + 10, None))
+    assert error.value.size == len(IMAGE)
+
+
+def test_conditional_read(gcs):
+    etag = gcs.stat('1234/side.jpg').etag
+    stream = gcs.open_image('1234/side.jpg', if_none_match=etag)
+    assert stream.not_modified
+    stream.close()
+
+    stream = gcs.open_image('1234/side.jpg', if_none_match='"1"')
+    assert not stream.not_modified
+    assert read(stream) == IMAGE
+
+
+def test_missing_image(gcs):
+    with pytest.raises(FileNotFoundError):
+        gcs.stat('missing.jpg')
+    with pytest.raises(FileNotFoundError):
+        gcs.open_image('missing.jpg')
+
+
+def test_chunks_arrive_before_the_download_finishes(gcs, gcs_emulator):
+    if gcs_emulator.stand_in is None:
+        pytest.skip("needs the in-process stand-in to hold the download")
+    gcs_emulator.stand_in.gate = gate = threading.Event()
+    try:
+        stream = gcs.open_image('1234/side.jpg')
+        first = next(stream.chunks)
+        # The server is still holding the rest of the body
+        assert len(first) == CHUNK_SIZE and not gate.is_set()
+        gate.set()
+        assert first + read(stream) == IMAGE
+    finally:
+        gate.set()
+        gcs_emulator.stand_in.gate = None
+
+
+@pytest.fixture
+def client(gcs):
+    app = FastAPI()
+
+    @app.get('/images/{path:path}')
+    async def get_image(path: str, request: Request):
+        return await image_response(request, gcs, path)
+
+    return TestClient(app)
+
+
+def test_http_range_and_not_modified(client):
+    full = client.get('/images/1234/side.jpg')
+    assert full.status_code == 200
+    assert full.content == IMAGE
+    etag = full.headers['etag']
+
+    partial = client.get('/images/1234/side.jpg', headers={'Range': 'bytes=100-199'})
+    assert partial.status_code == 206
+    assert partial.headers['content-range'] == f'bytes 100-199/{len(IMAGE)}'
+    assert partial.content == IMAGE[100:200]
+
+    assert client.get('/images/1234/side.jpg', headers={'If-None-Match': etag}).status_code == 304
+    stale = client.get('/images/1234/side.jpg', headers={'If-None-Match': '"1"'})
+    assert stale.status_code == 200 and stale.content == IMAGE
+
+    assert client.get('/images/1234/side.jpg', headers={'Range': f'bytes={len(IMAGE)}-'}).status_code == 416
@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+from PIL import Image
+from starlette.requests import Request
+
+from image_derivatives import DerivativeCache
+from image_storage import LocalImageStorage
+
+
+class CountingStorage(LocalImageStorage):
+    def __init__(self, base_dir: str):
+        super().__init__(base_dir)
+        self.stats = 0
+
+    def stat(self, path: str):
+        self.stats += 1
+        return super().stat(path)
+
+
+@pytest.fixture
+def source(tmp_path):
+    pictures = tmp_path / 'pictures'
+    for index in range(3):
+        (pictures / str(index)).mkdir(parents=True)
+        Image.new('RGB', (640, 480), (index * 80, 20, 20)).save(pictures / str(index) / 'side.jpg', quality=95)
+    return CountingStorage(str(pictures))
+
+
+def request() -> Request:
+    return Request({'type': 'http', 'method': 'GET', 'path': '/', 'query_string': b'', 'headers': []})
+
+
+def test_source_is_revalidated_only_after_the_window(source, tmp_path):
+    cache = DerivativeCache(source, str(tmp_path / 'cache'), max_bytes=10 ** 7, revalidate_after=60)
+    first = asyncio.run(cache.get('0/side.jpg', 100))
+    assert asyncio.run(cache.get('0/side.jpg', 100)) == first
+    assert asyncio.run(cache.get('0/side.jpg', 50)) != first
+    assert source.stats == 1
+
+    # Past the window a changed source gets a new derivative
+    cache.revalidate_after = 0
+    Image.new('RGB', (320, 240), 'blue').save(os.path.join(source.base_dir, '0', 'side.jpg'))
+    os.utime(os.path.join(source.base_dir, '0', 'side.jpg'), (1, 1))
+    assert asyncio.run(cache.get('0/side.jpg', 100)) != first
+    assert source.stats == 2
+
+
+def test_a_derivative_being_sent_is_not_evicted(source, tmp_path):
+    cache = DerivativeCache(source, str(tmp_path / 'cache'), max_bytes=1, revalidate_after=60)
+
+    async def scenario():
+        response = await cache.response(request(), '0/side.jpg', 100)
+        held = response.path
+        # Rendering others pushes the cache over its budget while the first response is unsent
+        await cache.get('1/side.jpg', 100)
+        assert os.path.exists(held)
+
+        await response.background()
+        await cache.get('2/side.jpg', 100)
+        return held
+
+    held = asyncio.run(scenario())
+    assert not os.path.exists(held)
@@ -0,0 +1,46 @@
+import threading
+
+from backend.json_responses import CachedBody, ResponseCache, dumps
+
+
+def entry() -> CachedBody:
+    body = dumps([{'EarTag': tag, 'Group': tag % 5} for tag in range(500)])
+    return CachedBody(body, '"etag"', {})
+
+
+def test_concurrent_compression_is_counted_once():
+    cache = ResponseCache(max_bytes=10 ** 7)
+    cached = entry()
+    cache.put('mice', cached)
+
+    # Every thread misses the gzip variant before any of them stores it
+    start = threading.Barrier(8)
+
+    def request():
+        start.wait()
+        cached.encode('gzip')
+        cache.resize('mice', cached)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert cache.stats()['bytes'] == cached.size == len(cached.body) + len(cached.encoded['gzip'])
+
+
+def test_resizing_a_replaced_or_evicted_entry_is_ignored():
+    cache = ResponseCache(max_bytes=10 ** 7)
+    old, new = entry(), entry()
+    cache.put('mice', old)
+    cache.put('mice', new)
+    old.encode('gzip')
+    cache.resize('mice', old)
+    assert cache.stats()['bytes'] == new.size
+
+    cache = ResponseCache(max_bytes=len(new.body) + 10)
+    cache.put('mice', new)
+    new.encode('gzip')
+    cache.resize('mice', new)
+    assert cache.stats() == {'hits': 0, 'misses': 0, 'entries': 0, 'bytes': 0}
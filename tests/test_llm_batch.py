@@ -0,0 +1,64 @@
+import asyncio
+import json
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+import llm_sql
+from backend.sql_engine import get_engine
+
+ANSWERS = {
+    'How many mice?': ('SELECT COUNT(*) AS n FROM MouseData', 0.2),
+    'How many groups?': ('SELECT COUNT(*) AS n FROM "Group"', 0.05),
+}
+
+
+class NoCache:
+    def get(self, *args):
+        return None
+
+    def put(self, *args):
+        pass
+
+
+@pytest.fixture
+def events(monkeypatch):
+    events = []
+
+    async def fake_llm(question, prompt):
+        if question not in ANSWERS:
+            raise RuntimeError('model unavailable')
+        sql, delay = ANSWERS[question]
+        await asyncio.sleep(delay)
+        events.append(('llm', question))
+        return json.dumps({'sql': sql, 'graph': None})
+
+    engine = get_engine(llm_sql.DATABASE_PATH)
+    original_session = engine.session
+
+    @contextmanager
+    def recorded_session():
+        events.append(('session', threading.current_thread() is threading.main_thread()))
+        with original_session():
+            yield
+
+    monkeypatch.setattr(llm_sql, 'get_llm_response_async', fake_llm)
+    monkeypatch.setattr(llm_sql, 'translation_cache', NoCache())
+    monkeypatch.setattr(engine, 'session', recorded_session)
+    return events
+
+
+def test_batch_sql_runs_after_every_translation_off_the_event_loop(events):
+    questions = ['How many mice?', 'How many groups?', 'Unanswerable', 'How many mice?']
+    answers = asyncio.run(llm_sql.call_llm_and_get_results_batch(questions))
+
+    # The read transaction opens once, in a worker thread, after the last LLM answer
+    assert [kind for kind, _ in events] == ['llm', 'llm', 'session']
+    assert events[-1] == ('session', False)
+
+    (mice, _), (groups, _), (failure, _), (repeat, _) = answers
+    assert mice[0] == ANSWERS['How many mice?'][0] and mice[1][0]['n'] > 0
+    assert groups[1][0]['n'] > 0
+    assert isinstance(failure, RuntimeError)
+    assert repeat is mice
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import llm_sql
+import server
+from backend import llm
+from backend.llm_replay import ReplayProvider
+
+QUESTION = 'How many mice are there?'
+
+
+class NoCache:
+    def get(self, *args):
+        return None
+
+    def put(self, *args):
+        pass
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    recording = tmp_path / 'replay.json'
+    recording.write_text(json.dumps({QUESTION: json.dumps({'sql': 'SELECT 1 AS n', 'graph': None})}))
+    provider = ReplayProvider(str(recording), latency=0)
+    monkeypatch.setattr(llm, 'acompletion', provider.acompletion)
+    monkeypatch.setattr(llm_sql, 'translation_cache', NoCache())
+    monkeypatch.setattr(llm_sql, 'build_prompt', lambda question: 'You write SQL.')
+    return TestClient(server.app)
+
+
+def test_an_unrecorded_question_is_a_404(client):
+    response = client.post('/api/query', json={'question': 'Which mouse is the fastest?'})
+    assert response.status_code == 404
+    assert response.json() == {'detail': 'No recorded answer for this question'}
+
+
+def test_batches_report_the_miss_per_question(client):
+    response = client.post('/api/query/batch', json={'questions': [QUESTION, 'Which mouse is the fastest?']})
+    assert response.status_code == 200
+    found, missing = response.json()['results']
+    assert found['status'] == 200 and found['results'] == [{'n': 1}]
+    assert (missing['status'], missing['error']) == (404, 'No recorded answer for this question')
+
+
+def test_streams_end_with_an_error_event(client):
+    with client.stream('GET', '/api/query/stream', params={'question': 'Which mouse is the fastest?'}) as response:
+        body = ''.join(response.iter_text())
+    assert response.status_code == 200
+    assert body == 'event: error\ndata: {"status":404,"detail":"No recorded answer for this question"}\n\n'
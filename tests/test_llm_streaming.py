@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import litellm
+import pytest
+
+from backend import llm
+from tests.fake_llm import FakeLLMServer, Reply
+
+
+@pytest.fixture(scope='module')
+def fake_llm():
+    server = FakeLLMServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='module', autouse=True)
+def warm_up(fake_llm):
+    """litellm sets its HTTP client up on the first call, which can outlast the short timeouts below"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(llm, 'LLM_MODEL', 'openai/fake-model')
+        mp.setattr(llm, 'LLM_API_BASE', fake_llm.api_base)
+        mp.setenv('OPENAI_API_KEY', 'test-key')
+        fake_llm.replies.append(Reply(['ok']))
+        collect(llm.AsyncLLMClient(timeout=30, max_retries=0))
+
+
+@pytest.fixture
+def client(fake_llm, monkeypatch):
+    fake_llm.replies.clear()
+    fake_llm.requests.clear()
+    monkeypatch.setattr(llm, 'LLM_MODEL', 'openai/fake-model')
+    monkeypatch.setattr(llm, 'LLM_API_BASE', fake_llm.api_base)
+    monkeypatch.setattr(llm, 'acompletion', litellm.acompletion)
+    monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+    return llm.AsyncLLMClient(timeout=0.5, max_retries=1, backoff=0)
+
+
+def collect(client):
+    """(pieces with their arrival times, the error the stream ended with or None)"""
+    async def run():
+        pieces = []
+        try:
+            async for text in client.stream_response('How many mice?', 'You write SQL.'):
+                pieces.append((text, time.perf_counter()))
+        except Exception as e:
+            return pieces, e
+        return pieces, None
+
+    return asyncio.run(run())
+
+
+def test_tokens_are_streamed_as_they_arrive(client, fake_llm):
+    tokens = ['{"sql": ', '"SELECT COUNT(*) ', 'FROM MouseData"', ', "graph": null}']
+    fake_llm.replies.append(Reply(tokens, delay_between=0.1))
+    pieces, error = collect(client)
+
+    assert error is None
+    assert [text for text, _ in pieces] == tokens
+    # The first piece was handed out well before the last one was sent
+    assert pieces[-1][1] - pieces[0][1] > 0.25
+    request = fake_llm.requests[0]
+    assert request['stream'] is True
+    assert request['messages'][-1] == {'role': 'user', 'content': 'How many mice?'}
+    assert client.counters == {'calls': 1, 'coalesced': 0, 'retries': 0, 'failures': 0}
+
+
+def test_server_errors_before_the_first_token_are_retried(client, fake_llm):
+    fake_llm.replies.extend([Reply(status=503), Reply(['SELECT 1'])])
+    pieces, error = collect(client)
+
+    assert error is None
+    assert [text for text, _ in pieces] == ['SELECT 1']
+    assert client.counters['calls'] == 2 and client.counters['retries'] == 1
+
+
+def test_persistent_server_errors_fail_after_the_retries(client, fake_llm):
+    fake_llm.replies.extend([Reply(status=503), Reply(status=503)])
+    pieces, error = collect(client)
+
+    assert pieces == []
+    assert isinstance(error, llm.RETRYABLE_ERRORS)
+    assert client.counters['calls'] == 2 and client.counters['failures'] == 1
+
+
+def test_client_errors_are_not_retried(client, fake_llm):
+    fake_llm.replies.append(Reply(status=400))
+    pieces, error = collect(client)
+
+    assert pieces == []
+    assert isinstance(error, litellm.BadRequestError)
+    assert len(fake_llm.requests) == 1 and client.counters['retries'] == 0
+
+
+def test_no_response_within_the_timeout(client, fake_llm):
+    fake_llm.replies.extend([Reply(['late'], delay_before=1.5), Reply(['late'], delay_before=1.5)])
+    started = time.perf_counter()
+    pieces, error = collect(client)
+
+    assert pieces == []
+    assert isinstance(error, (asyncio.TimeoutError, *llm.RETRYABLE_ERRORS))
+    assert client.counters['calls'] == 2 and client.counters['failures'] == 1
+    # Two attempts bounded by the 0.5s timeout, not by the server's delay
+    assert time.perf_counter() - started < 2.5
+
+
+def test_a_stalled_stream_times_out_without_a_retry(client, fake_llm):
+    fake_llm.replies.append(Reply(['SELECT ', 'stalled'], delay_between=1.5))
+    pieces, error = collect(client)
+
+    assert [text for text, _ in pieces] == ['SELECT ']
+    assert isinstance(error, (asyncio.TimeoutError, *llm.RETRYABLE_ERRORS))
+    # Tokens were already handed out, so the call is not repeated
+    assert len(fake_llm.requests) == 1 and client.counters['retries'] == 0
+
+
+def test_a_paused_consumer_does_not_hold_an_upstream_slot(fake_llm, client):
+    fake_llm.replies.extend([Reply(['first', ' second']), Reply(['other'])])
+    client = llm.AsyncLLMClient(timeout=0.5, max_retries=0, max_concurrency=1, backoff=0)
+
+    async def run():
+        paused = client.stream_response('How many mice?', 'You write SQL.')
+        first = await paused.__anext__()
+        # The only slot is free again once the first response is read, however slowly it is consumed
+        other = [text async for text in client.stream_response('How many groups?', 'You write SQL.')]
+        return first, other, [text async for text in paused]
+
+    first, other, rest = asyncio.run(asyncio.wait_for(run(), 5))
+    assert (first, other, rest) == ('first', ['other'], [' second'])
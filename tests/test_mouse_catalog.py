@@ -0,0 +1,41 @@
+import asyncio
+import os
+from datetime import date
+
+import pytest
+
+from backend.mouse_catalog import MouseCatalog
+from backend.mouse_data import engine
+
+
+@pytest.fixture
+def catalog(mouse_db, tmp_path):
+    mouse_db([{'EarTag': tag, 'Sex': 'F', 'DOB': date(2023, 1, 1), 'Group_Number': 1} for tag in (1, 2)])
+    csv_path = tmp_path / 'image_results.csv'
+    csv_path.write_text('ear_tag,date,corrupt,new_file_path\n1,2023-05-01,False,1/side.jpg\n')
+    # A long poll interval: freshness must not depend on the watcher
+    catalog = MouseCatalog(engine.url.database, str(csv_path), poll_interval=3600)
+    catalog.start()
+    yield catalog
+    catalog.stop()
+
+
+def test_reads_after_a_write_see_it_without_waiting_for_the_watcher(catalog, mouse_db):
+    assert sorted(catalog.snapshot.by_ear_tag) == [1, 2]
+    mouse_db([{'EarTag': 3, 'Sex': 'M', 'DOB': date(2023, 2, 1), 'Group_Number': 2}])
+
+    snapshot = asyncio.run(catalog.current())
+    assert sorted(snapshot.by_ear_tag) == [1, 2, 3]
+    assert snapshot.stamps == catalog.stamps()
+    assert catalog.filter(group=2, snapshot=snapshot)[0].EarTag == 3
+
+
+def test_picture_csv_changes_are_seen_on_read(catalog):
+    assert catalog.snapshot.images[1][0]['file_path'] == '1/side.jpg'
+    with open(catalog.image_csv_path, 'a') as f:
+        f.write('2,2023-05-02,False,2/side.jpg\n')
+    os.utime(catalog.image_csv_path, ns=(0, os.stat(catalog.image_csv_path).st_mtime_ns + 10 ** 9))
+
+    version = catalog.snapshot.version
+    assert catalog.snapshot.images[2][0]['file_path'] == '2/side.jpg'
+    assert asyncio.run(catalog.current()).version == version
@@ -0,0 +1,36 @@
+import pytest
+
+from image_storage import PictureIndex
+
+CSV = 'ear_tag,date,corrupt,new_file_path,full_text\n5001,2023-05-01,False,5001/a.jpg,x\n5002,2023-05-01,True,5002/a.jpg,y\n'
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = tmp_path / 'image_results.csv'
+    path.write_text(CSV)
+    return PictureIndex(str(path))
+
+
+def test_a_failed_parse_is_retried_on_the_next_access(index, monkeypatch):
+    parse = index._parse
+    monkeypatch.setattr(index, '_parse', lambda: (_ for _ in ()).throw(OSError('file busy')))
+    with pytest.raises(OSError):
+        index.refresh()
+
+    # The file did not change, but it was never parsed, so the next refresh must read it
+    monkeypatch.setattr(index, '_parse', parse)
+    assert index.refresh()
+    assert index.counts == {5001: 1}
+    assert not index.refresh()
+
+
+def test_edits_written_through_the_index_are_published(index):
+    index.refresh()
+    df = index.read_frame()
+    assert len(df) == 2 and 'full_text' in df
+
+    df.loc[df['ear_tag'] == 5002, 'corrupt'] = False
+    index.write_frame(df)
+    assert index.counts == {5001: 1, 5002: 1}
+    assert index.read_frame().equals(df)
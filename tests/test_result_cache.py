@@ -0,0 +1,76 @@
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+import pytest
+
+import llm_sql
+from backend.file_stamps import database_version
+from backend.result_cache import QueryResultCache, canonical_sql
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('SELECT  *\n\tFROM MouseData ;', 'SELECT * FROM MouseData'),
+    ('SELECT 1 -- the answer\n;;', 'SELECT 1'),
+    ('SELECT /* all */ EarTag FROM MouseData', 'SELECT EarTag FROM MouseData'),
+    # Quoted text keeps its spacing and comment-like content
+    ("SELECT * FROM MouseData WHERE DeathNotes = 'a  -- b'", "SELECT * FROM MouseData WHERE DeathNotes = 'a  -- b'"),
+    ("SELECT 'it''s  /* x */'  ,  \"Group  Name\" FROM \"Group\"", "SELECT 'it''s  /* x */' , \"Group  Name\" FROM \"Group\""),
+    ('SELECT [a  b], `c  d`', 'SELECT [a  b], `c  d`'),
+])
+def test_canonical_sql(sql, expected):
+    assert canonical_sql(sql) == expected
+
+
+def frame(rows: int) -> pd.DataFrame:
+    return pd.DataFrame({'EarTag': range(rows), 'Weight': [20.5] * rows})
+
+
+def test_entries_are_shared_by_equivalent_sql_and_dropped_on_a_new_version():
+    cache = QueryResultCache(max_bytes=10 ** 6)
+    cache.put('study.db', 'SELECT * FROM Weights;', ('v1',), frame(3))
+
+    hit = cache.get('./study.db', 'SELECT *\n  FROM Weights', ('v1',))
+    pd.testing.assert_frame_equal(hit, frame(3))
+    # Callers get copies
+    hit.loc[0, 'Weight'] = 0
+    assert cache.get('study.db', 'SELECT * FROM Weights', ('v1',)).loc[0, 'Weight'] == 20.5
+
+    assert cache.get('study.db', 'SELECT * FROM Weights', ('v2',)) is None
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'stale': 1, 'evictions': 0, 'entries': 0, 'bytes': 0}
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    one = frame(100).memory_usage(deep=True, index=False).sum()
+    cache = QueryResultCache(max_bytes=int(one * 2.5))
+    for sql in ('SELECT 1', 'SELECT 2'):
+        cache.put('study.db', sql, ('v1',), frame(100))
+    cache.get('study.db', 'SELECT 1', ('v1',))
+    cache.put('study.db', 'SELECT 3', ('v1',), frame(100))
+
+    assert cache.get('study.db', 'SELECT 2', ('v1',)) is None
+    assert cache.get('study.db', 'SELECT 1', ('v1',)) is not None
+    assert cache.stats()['evictions'] == 1 and cache.stats()['bytes'] == 2 * one
+    # A result larger than the whole budget is not stored
+    cache.put('study.db', 'SELECT 4', ('v1',), frame(1000))
+    assert cache.get('study.db', 'SELECT 4', ('v1',)) is None
+
+
+def test_a_write_to_the_database_invalidates_its_results(tmp_path, monkeypatch):
+    path = str(tmp_path / 'study.db')
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('CREATE TABLE MouseData (EarTag INTEGER PRIMARY KEY)')
+        conn.executemany('INSERT INTO MouseData VALUES (?)', [(1,), (2,)])
+        conn.commit()
+    monkeypatch.setattr(llm_sql, 'result_cache', QueryResultCache(max_bytes=10 ** 6))
+
+    assert llm_sql.read_sql_query('SELECT COUNT(*) AS n FROM MouseData', path)['n'][0] == 2
+    assert llm_sql.read_sql_query('SELECT COUNT(*) AS n FROM MouseData', path)['n'][0] == 2
+    version = database_version(path)
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('INSERT INTO MouseData VALUES (3)')
+        conn.commit()
+
+    assert database_version(path) != version
+    assert llm_sql.read_sql_query('SELECT COUNT(*) AS n FROM MouseData', path)['n'][0] == 3
+    assert llm_sql.result_cache.stats()['hits'] == 1 and llm_sql.result_cache.stats()['stale'] == 1
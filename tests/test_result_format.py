@@ -0,0 +1,68 @@
+from datetime import date
+
+import numpy as np
+import orjson
+import pandas as pd
+import pytest
+
+from backend.json_responses import dumps
+from backend.result_format import frame_to_columnar, frame_to_records
+
+
+def records_by_row(df):
+    """The row-by-row conversion frame_to_records() replaced, kept as the reference"""
+    results = []
+    for record in df.to_dict(orient='records'):
+        processed = {}
+        for key, value in record.items():
+            if pd.isna(value):
+                processed[key] = None
+            elif isinstance(value, (pd.Timestamp, date)):
+                processed[key] = value.isoformat()
+            elif hasattr(value, 'item'):
+                processed[key] = value.item()
+            else:
+                processed[key] = value
+        results.append(processed)
+    return results
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'EarTag': np.array([5001, 5002, 5003, 5004], dtype=np.int64),
+        'Weight': [20.5, np.nan, 21.0, np.inf],
+        'Necropsy': [True, False, True, False],
+        'Stagger': pd.array([1, None, 3, 4], dtype='Int64'),
+        'Measured': pd.to_datetime(['2024-01-02 00:00:00', None, '2024-01-03 04:05:06.789', '2024-01-04 12:00:00'], format='ISO8601'),
+        'Zoned': pd.to_datetime(['2024-01-02', None, '2024-03-01', '2024-05-01']).tz_localize('UTC'),
+        'DOB': [date(2023, 1, 1), None, date(2023, 1, 3), date(2023, 1, 4)],
+        'Sex': ['M', None, 'F', 'M'],
+        'Blob': [b'\x00\x01', None, b'', b'abc'],
+        'Mixed': [1, 'two', 3.5, None],
+        'Missing': [None, None, None, None],
+    })
+
+
+def test_records_match_the_row_by_row_conversion(df):
+    actual, expected = frame_to_records(df), records_by_row(df)
+    assert actual == expected
+    # Equal is not enough: 1 == 1.0 == True, so the types must match too
+    assert [[type(v) for v in row.values()] for row in actual] == [[type(v) for v in row.values()] for row in expected]
+
+
+def test_columnar_serializes_to_the_same_values(df):
+    df = df.drop(columns='Blob')  # bytes are not JSON
+    columnar = orjson.loads(dumps(frame_to_columnar(df)))
+    records = orjson.loads(dumps(frame_to_records(df)))
+
+    assert columnar['columns'] == list(df.columns) and columnar['row_count'] == 4
+    assert columnar['dtypes'][:2] == ['int64', 'float64']
+    assert [dict(zip(columnar['columns'], row)) for row in zip(*columnar['data'])] == records
+    # NaN and infinity are null either way
+    assert records[1]['Weight'] is None and records[3]['Weight'] is None
+
+
+def test_empty_result(df):
+    assert frame_to_records(df.iloc[:0]) == []
+    assert orjson.loads(dumps(frame_to_columnar(df.iloc[:0].drop(columns='Blob'))))['data'] == [[]] * (df.shape[1] - 1)
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, quote, urlsplit
+
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from image_storage import GCSImageStorage
+
+BUCKET = 'test-pictures'
+CLIENT_EMAIL = 'signer@test-project.iam.gserviceaccount.com'
+TTL = 600
+
+
+@pytest.fixture(scope='module')
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def signing_storage(gcs_emulator, private_key, tmp_path, monkeypatch):
+    """A storage that signs with a service-account key generated for the test; nothing leaves the machine"""
+    key_file = tmp_path / 'service_account.json'
+    key_file.write_text(json.dumps({
+        'type': 'service_account',
+        'project_id': 'test-project',
+        'private_key_id': 'test-key',
+        'private_key': private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                 serialization.NoEncryption()).decode(),
+        'client_email': CLIENT_EMAIL,
+        'client_id': '1',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    }))
+    monkeypatch.setenv('STORAGE_EMULATOR_HOST', gcs_emulator.host)
+    monkeypatch.setenv('GCS_SIGNING_KEY_FILE', str(key_file))
+    gcs_emulator.put(BUCKET, 'study/1234/side.jpg', b'jpeg bytes')
+    storage = GCSImageStorage(BUCKET, 'study', signed_url_ttl=TTL)
+    assert storage.use_gcs and storage.signed_urls
+    return storage
+
+
+def string_to_sign(url: str) -> tuple:
+    """(V4 string to sign, query parameters) rebuilt from a signed URL"""
+    parts = urlsplit(url)
+    params = dict(parse_qsl(parts.query, keep_blank_values=True))
+    canonical_query = '&'.join(f"{quote(key, safe='')}={quote(value, safe='')}"
+                               for key, value in sorted(params.items()) if key != 'X-Goog-Signature')
+    canonical_request = '\n'.join([
+        'GET', parts.path, canonical_query, f"host:{parts.netloc}", '', params['X-Goog-SignedHeaders'], 'UNSIGNED-PAYLOAD',
+    ])
+    scope = params['X-Goog-Credential'].split('/', 1)[1]
+    return '\n'.join([
+        params['X-Goog-Algorithm'], params['X-Goog-Date'], scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest(),
+    ]), params
+
+
+def test_signed_url_parameters_and_signature(signing_storage, private_key, gcs_emulator):
+    before = datetime.now(timezone.utc).replace(microsecond=0)
+    url = signing_storage.get_image_url('1234/side.jpg')
+    parts = urlsplit(url)
+    assert f"{parts.scheme}://{parts.netloc}" == gcs_emulator.host
+    assert parts.path == f'/{BUCKET}/study/1234/side.jpg'
+
+    payload, params = string_to_sign(url)
+    assert params['X-Goog-Algorithm'] == 'GOOG4-RSA-SHA256'
+    assert params['X-Goog-SignedHeaders'] == 'host'
+    assert params['X-Goog-Expires'] == str(TTL)
+    signed_at = datetime.strptime(params['X-Goog-Date'], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+    assert abs((signed_at - before).total_seconds()) < 60
+    assert params['X-Goog-Credential'] == f"{CLIENT_EMAIL}/{signed_at:%Y%m%d}/auto/storage/goog4_request"
+
+    # Raises InvalidSignature unless the URL was signed with the test key over exactly these parameters
+    private_key.public_key().verify(bytes.fromhex(params['X-Goog-Signature']), payload.encode(),
+                                    padding.PKCS1v15(), hashes.SHA256())
+
+
+def test_signed_urls_are_reused_until_close_to_expiry(signing_storage, monkeypatch):
+    url = signing_storage.get_image_url('1234/side.jpg')
+    assert signing_storage.get_image_url('1234/side.jpg') == url
+
+    # Within the renewal margin (a minute at most) of expiring, the URL is signed again
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + TTL - 30)
+    renewed = signing_storage.get_image_url('1234/side.jpg')
+    assert dict(parse_qsl(urlsplit(renewed).query))['X-Goog-Expires'] == str(TTL)
+    assert signing_storage._signed_urls['1234/side.jpg'][1] == pytest.approx(now + 2 * TTL - 30)
@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+from backend.sql_engine import SQLiteEngine
+from backend.sql_guard import SQLGuard, SQLRejected, _from_aliases
+
+
+@pytest.fixture
+def guard(tmp_path):
+    db_path = tmp_path / 'study.db'
+    with sqlite3.connect(db_path) as conn:
+        conn.execute('CREATE TABLE MouseData (EarTag INTEGER PRIMARY KEY, Sex TEXT)')
+        conn.execute('CREATE TABLE Weights (id INTEGER PRIMARY KEY, EarTag INTEGER, Weight REAL)')
+        conn.executemany('INSERT INTO MouseData VALUES (?, ?)', [(i, 'MF'[i % 2]) for i in range(2000)])
+        conn.executemany('INSERT INTO Weights (EarTag, Weight) VALUES (?, ?)', [(i % 2000, 20.0) for i in range(6000)])
+    return SQLGuard(SQLiteEngine(str(db_path)), max_rows=100, max_scan_rows=50_000,
+                    max_join_rows=1_000_000, large_tables=('Weights',), large_table_rows=5000)
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ('SELECT * FROM Weights w JOIN MouseData AS m ON m.EarTag = w.EarTag', {'w': 'weights', 'm': 'mousedata'}),
+    ('SELECT * FROM MouseData m, main.Weights w', {'m': 'mousedata', 'w': 'weights'}),
+    # Column aliases, keywords after a table and subqueries are not table aliases
+    ('SELECT Sex Weights, COUNT(*) total FROM MouseData WHERE Sex = \'\'', {}),
+    ('SELECT * FROM MouseData LEFT JOIN Weights ON Weights.EarTag = MouseData.EarTag', {}),
+    ('SELECT * FROM (SELECT EarTag FROM Weights) MouseData', {}),
+    ('WITH x AS (SELECT 1) SELECT * FROM x a JOIN x b', {'a': 'x', 'b': 'x'}),
+])
+def test_from_aliases(sql, expected):
+    assert _from_aliases(sql) == expected
+
+
+def test_aliased_unindexed_join_is_costed_and_rejected(guard):
+    with pytest.raises(SQLRejected, match='without an index'):
+        guard.check('SELECT * FROM MouseData m JOIN Weights w ON w.EarTag + m.EarTag = 3')
+
+
+def test_scans_inside_subqueries_and_ctes_are_counted(guard):
+    plan = guard.check('WITH heavy AS (SELECT DISTINCT EarTag FROM Weights) SELECT * FROM heavy h')
+    assert plan.scans == [('weights', 6000)]
+    plan = guard.check('SELECT * FROM (SELECT DISTINCT Weight FROM Weights) s')
+    assert plan.scans == [('weights', 6000)]
+    assert guard.check('SELECT 1').scans == []
+
+
+def test_older_plan_format_names_the_table(guard, monkeypatch):
+    # SQLite before 3.36 reports "SCAN TABLE <table> AS <alias>" and "SCAN SUBQUERY <n>"
+    rows = [(2, 0, 0, 'SCAN TABLE Weights AS w'), (3, 0, 0, 'SCAN SUBQUERY 1')]
+    monkeypatch.setattr(guard.engine, 'explain', lambda sql: rows)
+    assert guard.check('SELECT * FROM Weights w').scans == [('weights', 6000)]
+
+    rows.append((4, 0, 0, 'SCAN TABLE MouseData AS m USING COVERING INDEX x'))
+    with pytest.raises(SQLRejected, match='without an index'):
+        guard.check('SELECT * FROM Weights w, MouseData m')
+
+
+def test_unmapped_scans_fail_closed(guard, monkeypatch):
+    monkeypatch.setattr(guard.engine, 'explain', lambda sql: [(2, 0, 0, 'SCAN mystery')])
+    with pytest.raises(SQLRejected, match='which tables'):
+        guard.check('SELECT * FROM Weights')
@@ -0,0 +1,109 @@
+import math
+
+import numpy as np
+import pytest
+
+from data_processing.survival import chi2_sf, kaplan_meier, logrank_test, pairwise_logrank
+
+# Freireich et al. remission times in weeks (the "gehan" data), + marking censoring
+SIX_MP = [6, 6, 6, 7, 10, 13, 16, 22, 23, '6+', '9+', '10+', '11+', '17+', '19+', '20+', '25+', '32+', '32+', '34+', '35+']
+PLACEBO = [1, 1, 2, 2, 3, 4, 4, 5, 5, 8, 8, 8, 8, 11, 11, 12, 12, 15, 17, 22, 23]
+
+
+def subjects(*groups):
+    durations, observed, labels = [], [], []
+    for label, times in enumerate(groups):
+        for time in times:
+            durations.append(float(str(time).rstrip('+')))
+            observed.append(not str(time).endswith('+'))
+            labels.append(label)
+    return np.array(durations), np.array(observed), np.array(labels)
+
+
+def test_kaplan_meier_matches_the_textbook_table():
+    # survfit(Surv(time, cens) ~ 1, conf.type = "log-log") on the 6-MP arm
+    curve = kaplan_meier(*subjects(SIX_MP))[0]
+    deaths = curve.events > 0
+    table = np.column_stack([curve.time, curve.at_risk, curve.events, curve.survival, curve.lower, curve.upper])[deaths]
+    expected = [
+        (6, 21, 3, 0.857, 0.620, 0.952),
+        (7, 17, 1, 0.807, 0.563, 0.923),
+        (10, 15, 1, 0.753, 0.503, 0.889),
+        (13, 12, 1, 0.690, 0.432, 0.849),
+        (16, 11, 1, 0.627, 0.368, 0.805),
+        (22, 7, 1, 0.538, 0.268, 0.747),
+        (23, 6, 1, 0.448, 0.188, 0.680),
+    ]
+    np.testing.assert_allclose(table, expected, atol=6e-4)
+    assert curve.median == 23 and curve.subjects == 21
+    # The censoring tied with the deaths at 6 leaves after them
+    assert curve.censored[curve.time == 6].tolist() == [1]
+
+
+def test_all_censored_and_single_groups():
+    durations, observed, groups = subjects(PLACEBO, ['5+', '9+', '9+'])
+    curves = kaplan_meier(durations, observed, groups)
+    censored = curves[1]
+    assert censored.survival.tolist() == censored.lower.tolist() == censored.upper.tolist() == [1.0, 1.0]
+    assert censored.median is None and censored.at_risk.tolist() == [3, 2]
+    # Everyone in placebo dies, so its curve ends at zero with a collapsed band
+    assert curves[0].survival[-1] == curves[0].lower[-1] == curves[0].upper[-1] == 0.0
+    assert curves[0].median == 8
+
+    single = logrank_test(*subjects(PLACEBO))
+    assert (single.statistic, single.df, single.p_value) == (0.0, 0, 1.0)
+
+
+def test_two_group_logrank_matches_the_textbook_value():
+    # survdiff: O = 9 and 21, E = 19.25 and 10.75, chi-squared 16.8 on 1 df
+    result = logrank_test(*subjects(SIX_MP, PLACEBO))
+    assert result.df == 1
+    assert result.statistic == pytest.approx(16.7929, abs=1e-4)
+    assert result.p_value == pytest.approx(4.169e-05, rel=1e-3)
+
+    pair, = pairwise_logrank(*subjects(SIX_MP, PLACEBO))
+    assert pair.statistic == pytest.approx(result.statistic)
+
+
+def dense_logrank(durations, observed, groups):
+    """The k-group statistic straight from its definition, one death time at a time"""
+    labels = np.unique(groups)
+    difference, covariance = np.zeros(len(labels)), np.zeros((len(labels), len(labels)))
+    for time in np.unique(durations[observed]):
+        at_risk = np.array([np.sum((groups == g) & (durations >= time)) for g in labels], dtype=float)
+        deaths = np.array([np.sum((groups == g) & (durations == time) & observed) for g in labels], dtype=float)
+        n, d = at_risk.sum(), deaths.sum()
+        share = at_risk / n
+        difference += deaths - d * share
+        if n > 1:
+            covariance += d * (n - d) / (n - 1) * (np.diag(share) - np.outer(share, share))
+    kept = slice(0, len(labels) - 1)
+    return float(difference[kept] @ np.linalg.solve(covariance[kept, kept], difference[kept]))
+
+
+@pytest.mark.parametrize('groups, deaths, death_times', [(3, 12, 10), (12, 8, 3)])
+def test_k_group_logrank_matches_the_dense_computation(groups, deaths, death_times):
+    # With fewer death times than groups the covariance is solved with the Woodbury identity
+    rng = np.random.default_rng(groups)
+    size = 6 * groups
+    durations = rng.integers(1, 60, size).astype(float)
+    observed = np.zeros(size, dtype=bool)
+    observed[rng.choice(size, deaths, replace=False)] = True
+    durations[observed] = rng.choice(np.linspace(5, 55, death_times).round(), deaths)
+    labels = np.repeat(np.arange(groups), 6)
+
+    result = logrank_test(durations, observed, labels)
+    assert result.df == groups - 1
+    assert result.statistic == pytest.approx(dense_logrank(durations, observed, labels), rel=1e-9)
+
+
+@pytest.mark.parametrize('x, df, expected', [
+    (3.841458820694124, 1, 0.05),
+    (5.991464547107979, 2, 0.05),
+    (11.070497693516351, 5, 0.05),
+    (0.5, 4, math.exp(-0.25) * 1.25),
+    (40.0, 4, math.exp(-20) * 21),
+    (0.0, 3, 1.0),
+])
+def test_chi2_sf(x, df, expected):
+    assert chi2_sf(x, df) == pytest.approx(expected, rel=1e-9)
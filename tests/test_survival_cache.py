@@ -0,0 +1,85 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pytest
+
+from data_processing import data_functions
+from data_processing.survival_cache import SurvivalCache
+
+START, END = '2023-01-01', '2023-01-31'
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'study.db')
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('CREATE TABLE "Group" (Number INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TABLE MouseData (EarTag INTEGER PRIMARY KEY, DOB DATE, DOD DATE, Group_Number INTEGER)')
+        conn.executemany('INSERT INTO "Group" VALUES (?)', [(1,), (2,)])
+        conn.executemany('INSERT INTO MouseData VALUES (?, ?, ?, ?)',
+                         [(1, '2022-06-01', None, 1), (2, '2022-06-01', '2023-01-10', 1), (3, '2022-06-01', None, 2)])
+        conn.commit()
+    return path
+
+
+def write(db_path, sql, params=()):
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+class Computations:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return {'alive': np.arange(self.calls, self.calls + 3)}
+
+
+def decode(arrays):
+    return arrays['alive'].tolist()
+
+
+def test_entries_are_reused_until_the_database_changes(db_path, tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache, compute = SurvivalCache(directory), Computations()
+    params = {'start_date': START, 'end_date': END}
+
+    assert cache.get(db_path, params, compute, decode) == [1, 2, 3]
+    assert cache.get(db_path, params, compute, decode) == [1, 2, 3]
+    # Another process finds the .npz file
+    assert SurvivalCache(directory).get(db_path, params, compute, decode) == [1, 2, 3]
+    assert compute.calls == 1 and len(os.listdir(directory)) == 1
+
+    write(db_path, 'UPDATE MouseData SET DOD = ? WHERE EarTag = 1', ('2023-01-20',))
+    assert cache.get(db_path, params, compute, decode) == [2, 3, 4]
+    assert cache.get(db_path, {**params, 'end_date': '2023-02-28'}, compute, decode) == [3, 4, 5]
+    assert cache.stats() == {'memory_hits': 1, 'disk_hits': 0, 'misses': 3, 'memory_entries': 3}
+
+
+def test_unreadable_files_are_recomputed(db_path, tmp_path):
+    cache, compute = SurvivalCache(str(tmp_path / 'cache')), Computations()
+    params = {'start_date': START}
+    cache.get(db_path, params, compute, decode)
+    with open(cache._path(cache.key(db_path, params)), 'wb') as f:
+        f.write(b'not an npz file')
+
+    assert SurvivalCache(cache.directory).get(db_path, params, compute, decode) == [2, 3, 4]
+
+
+def test_survival_data_follows_database_writes(db_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_functions, 'survival_cache', SurvivalCache(str(tmp_path / 'cache')))
+
+    before = data_functions.get_survival_data(START, END, db_path)
+    assert before['survival_data']['2023-01-20'] == {'Group 1': 1, 'Group 2': 1}
+    write(db_path, 'UPDATE MouseData SET DOD = ? WHERE EarTag = 3', ('2023-01-15',))
+    after = data_functions.get_survival_data(START, END, db_path)
+
+    assert after['survival_data']['2023-01-20'] == {'Group 1': 1, 'Group 2': 0}
+    expected = data_functions.convert_survival_data(data_functions.load_survival_rows(START, END, db_path), START, END)
+    assert after['survival_data'] == {date: {group: int(alive) for group, alive in counts.items()}
+                                      for date, counts in expected[0].items()}
+    assert [(event['date'], event['ear_tag']) for event in after['death_events']] == [('2023-01-10', 2), ('2023-01-15', 3)]
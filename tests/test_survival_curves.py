@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.survival_curves import convert_survival_data_by_day, same_output, synthetic_colony
+from data_processing.data_functions import convert_survival_data, survival_steps
+
+# A short range keeps the per-day reference quick
+START, END = '2024-01-01', '2024-03-01'
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_matches_the_per_day_loop(seed):
+    df = synthetic_colony(400, 4, seed=seed)
+    assert same_output(convert_survival_data_by_day(df, START, END), convert_survival_data(df, START, END))
+
+
+def test_matches_the_per_day_loop_on_edge_rows():
+    df = pd.DataFrame({
+        'EarTag': [1, 2, 3, 4, 5, 6, 7],
+        # On the first and last day, before and after the range, alive, and a group without a number
+        'DOD': [START, END, '2020-01-01', '2030-01-01', None, '2024-01-05', '2024-01-05'],
+        'Group': [1, 1, 2, 2, 2, None, 3],
+    })
+    assert same_output(convert_survival_data_by_day(df, START, END), convert_survival_data(df, START, END))
+
+
+def test_steps_hold_the_same_counts():
+    df = synthetic_colony(300, 3, seed=2)
+    survival_data, death_events = convert_survival_data(df, START, END)
+    steps = survival_steps(df, START, END)
+
+    days = list(survival_data)
+    for name, series in steps['series'].items():
+        starts = [days.index(date) for date in series['dates']]
+        # Each count holds until the next step
+        expanded = np.repeat(series['alive'], np.diff(starts + [len(days)]))
+        assert expanded.tolist() == [counts[name] for counts in survival_data.values()]
+    assert sorted(zip(steps['deaths']['date'], steps['deaths']['ear_tag'])) == \
+        sorted((event['date'], event['ear_tag']) for event in death_events)
@@ -0,0 +1,102 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+START, END = '2023-01-01', '2023-01-31'
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / 'study.db')
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('CREATE TABLE "Group" (Number INTEGER PRIMARY KEY, Rapamycin TEXT, HSCs TEXT, Senolytic TEXT, '
+                     'Mobilization TEXT, AAV9 TEXT)')
+        conn.execute('CREATE TABLE MouseData (EarTag INTEGER PRIMARY KEY, Sex TEXT, DOB DATE, DOD DATE, '
+                     'Group_Number INTEGER, Cohort_id INTEGER)')
+        conn.executemany('INSERT INTO "Group" (Number, Rapamycin) VALUES (?, ?)', [(1, 'Y'), (2, 'N')])
+        conn.executemany('INSERT INTO MouseData VALUES (?, ?, ?, ?, ?, ?)', [
+            (1, 'M', '2022-06-01', None, 1, 1),
+            (2, 'F', '2022-06-01', '2023-01-10', 1, 1),
+            (3, 'F', '2022-06-01', '2023-01-20', 2, 2),
+            # Dies after the range: only the analysis sees it, censored at the end
+            (4, 'M', '2022-06-01', '2023-03-01', 2, 2),
+            # Born after the start: never counted
+            (5, 'M', '2023-01-05', None, 1, 1),
+        ])
+        conn.commit()
+    monkeypatch.setattr(server, 'DATABASE_PATH', path)
+    return path
+
+
+@pytest.fixture
+def client(db_path):
+    # Without the lifespan: these requests never touch the mouse catalog
+    return TestClient(server.app)
+
+
+def survival(client, **params):
+    response = client.get('/api/survival', params={'start_date': START, 'end_date': END, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_alive_counts_as_step_changes(client):
+    payload = survival(client)
+    assert payload['mice'] == 3 and 'deaths' not in payload and 'analysis' not in payload
+    assert payload['series'] == {
+        'Group 1': {'dates': ['2023-01-01', '2023-01-10'], 'alive': [2, 1]},
+        'Group 2': {'dates': ['2023-01-01', '2023-01-20'], 'alive': [1, 0]},
+    }
+
+    deaths = survival(client, deaths='true')['deaths']
+    assert deaths == {'date': ['2023-01-10', '2023-01-20'], 'group': ['Group 1', 'Group 2'], 'ear_tag': [2, 3]}
+
+
+@pytest.mark.parametrize('params, series', [
+    ({'group': [2]}, ['Group 2']),
+    ({'cohort': [1]}, ['Group 1']),
+    ({'sex': 'F'}, ['Group 1', 'Group 2']),
+    ({'rapamycin': 'N'}, ['Group 2']),
+    ({'sex': 'M', 'group': [2]}, []),
+])
+def test_filters(client, params, series):
+    assert list(survival(client, **params)['series']) == series
+
+
+def test_analysis_censors_mice_dying_after_the_range(client):
+    payload = survival(client, analysis='true')
+    # The alive counts still leave mouse 4 out, as without the analysis
+    assert payload['mice'] == 3
+    curves = payload['analysis']['curves']
+    assert curves['Group 2']['subjects'] == 2 and curves['Group 2']['events'] == 1
+    assert curves['Group 2']['censored'][-1] == 1 and curves['Group 2']['time'][-1] == 30
+    assert payload['analysis']['logrank']['df'] == 1
+
+
+@pytest.mark.parametrize('params, status', [
+    ({'start_date': '2023-02-01'}, 400),
+    ({'start_date': '1990-01-01', 'end_date': '2020-01-01'}, 400),
+    ({'end_date': 'yesterday'}, 422),
+])
+def test_bad_ranges_are_rejected(client, params, status):
+    response = client.get('/api/survival', params={'start_date': START, 'end_date': END, **params})
+    assert response.status_code == status
+
+
+def test_responses_are_cached_until_the_database_changes(client, db_path):
+    first = client.get('/api/survival', params={'start_date': START, 'end_date': END})
+    again = client.get('/api/survival', params={'start_date': START, 'end_date': END},
+                       headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("UPDATE MouseData SET DOD = '2023-01-15' WHERE EarTag = 1")
+        conn.commit()
+    changed = client.get('/api/survival', params={'start_date': START, 'end_date': END},
+                         headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.json()['series']['Group 1'] == {'dates': ['2023-01-01', '2023-01-10', '2023-01-15'], 'alive': [2, 1, 0]}
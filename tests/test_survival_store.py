@@ -0,0 +1,69 @@
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processing.survival_store import CHANGE_LOG_TABLE, SurvivalStore, install_change_log, survival_store
+
+START, END = '2023-01-01', '2023-03-31'
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'study.db')
+    rng = np.random.default_rng(7)
+    dods = [None if rng.random() < 0.4 else str(pd.Timestamp(START) + pd.Timedelta(days=int(rng.integers(0, 120))))[:10]
+            for _ in range(60)]
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('CREATE TABLE "Group" (Number INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TABLE MouseData (EarTag INTEGER PRIMARY KEY, DOB DATE, DOD DATE, Group_Number INTEGER)')
+        conn.executemany('INSERT INTO "Group" VALUES (?)', [(1,), (2,), (3,)])
+        conn.executemany('INSERT INTO MouseData VALUES (?, ?, ?, ?)',
+                         [(tag, '2022-06-01', dod, 1 + tag % 3) for tag, dod in enumerate(dods)])
+        assert install_change_log(conn)
+        conn.commit()
+    return path
+
+
+def write(db_path, sql, params=()):
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute(sql, params)
+        conn.commit()
+
+
+def assert_matches_full_reload(store, db_path):
+    fresh = SurvivalStore(db_path, START, END)
+    fresh.refresh()
+    expected, actual = fresh.arrays(), store.arrays()
+    for name in expected:
+        np.testing.assert_array_equal(actual[name], expected[name])
+
+
+def test_changes_are_patched_and_the_applied_log_pruned(db_path):
+    store = survival_store(db_path, START, END)
+    store.refresh()
+    write(db_path, 'UPDATE MouseData SET DOD = ? WHERE EarTag = 4', ('2023-02-10',))
+    write(db_path, 'DELETE FROM MouseData WHERE EarTag = 5')
+    store.refresh()
+
+    assert store.counters['rebuilds'] == 1 and store.counters['patches'] == 1
+    assert_matches_full_reload(store, db_path)
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert conn.execute(f'SELECT COUNT(*) FROM {CHANGE_LOG_TABLE}').fetchone()[0] == 0
+
+
+def test_a_replaced_table_without_triggers_forces_a_rebuild(db_path):
+    store = survival_store(db_path, START, END)
+    store.refresh()
+    with closing(sqlite3.connect(db_path)) as conn:
+        df = pd.read_sql_query('SELECT * FROM MouseData', conn)
+        df.loc[df['EarTag'] == 7, 'DOD'] = '2023-01-15'
+        # Replacing the table drops its triggers, so this and later writes are not logged
+        df.to_sql('MouseData', conn, if_exists='replace', index=False)
+    write(db_path, 'UPDATE MouseData SET Group_Number = 2 WHERE EarTag = 9')
+    store.refresh()
+
+    assert store.counters['rebuilds'] == 2 and store.counters['patches'] == 0
+    assert_matches_full_reload(store, db_path)